@@ -7,9 +7,14 @@ from .schema.models import db
 from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
 from flask_migrate import Migrate
-from .constants.http_status_codes import HTTP_404_NOT_FOUND, HTTP_500_INTERNAL_SERVER_ERROR, HTTP_503_SERVICE_UNAVAILABLE, HTTP_429_TOO_MANY_REQUESTS
+from .constants.http_status_codes import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_500_INTERNAL_SERVER_ERROR, HTTP_503_SERVICE_UNAVAILABLE, HTTP_429_TOO_MANY_REQUESTS
 from flask_mail import Mail
 from flask_swagger_ui import get_swaggerui_blueprint
+from .utils.pagination import InvalidCursor
+from .services.llm_gateway import LLMError
+from .utils.storage import StorageError
+# registers the sqlite:// and resp:// rate limit storages
+from .utils.rate_limit import get_user_or_remote_address
 
 load_dotenv(override=True)
 
@@ -25,12 +30,11 @@ swaggerui_blueprint = get_swaggerui_blueprint(
 
 mail = Mail()
 
+# storage and strategy come from RATELIMIT_STORAGE_URI and RATELIMIT_STRATEGY
 limiter = Limiter(
-    get_remote_address,
+    get_user_or_remote_address,
     default_limits=["100 per day", "50 per hour"],
-    storage_uri="memory://",
-    strategy="moving-window",
-)  
+)
 
 def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
@@ -48,7 +52,11 @@ def create_app(test_config=None):
     # initialise the database here
     db.app=app
     db.init_app(app)
-    # initialise the limiter here
+    # initialise the limiter here, the counters are shared by every worker on the host by default
+    app.config.setdefault('RATELIMIT_STORAGE_URI', os.getenv(
+        'RATELIMIT_STORAGE_URI', 'sqlite:///' + os.path.join(app.instance_path, 'ratelimits.db')
+    ))
+    app.config.setdefault('RATELIMIT_STRATEGY', 'sliding-window-counter')
     limiter.init_app(app)
     # initialise jwt here
     JWTManager(app)
@@ -66,8 +74,48 @@ def create_app(test_config=None):
     app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS')
     app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
 
-    # initialise mail
+    # initialise mail and the background sender
     mail.init_app(app)
+    from .services.mail_queue import mail_queue
+    mail_queue.init_app(app)
+
+    # initialise the shared llm client
+    from .services.llm_gateway import llm
+    llm.init_app(app)
+
+    # initialise the background summarization workers
+    from .services.summary_jobs import summary_jobs
+    from .services.summary_cache import summary_cache
+    from .utils.text_store import text_store
+    summary_jobs.init_app(app)
+    summary_cache.init_app(app)
+    text_store.init_app(app)
+
+    # initialise the local mood recommender
+    from .services.mood_recommender import mood_recommender
+    from .services.similar_books import similar_books
+    mood_recommender.init_app(app)
+    similar_books.init_app(app)
+
+    # initialise the background notification writer
+    from .services.notifications import notification_pipeline
+    from .services.notification_stream import notification_broker
+    notification_pipeline.init_app(app)
+    notification_broker.init_app(app)
+
+    # stream uploads to disk while hashing them, then store every content once
+    from .services.uploads import UploadRequest
+    from .utils.storage import upload_storage
+    app.request_class = UploadRequest
+    upload_storage.init_app(app)
+
+    # initialise the background image processing
+    from .services.image_pipeline import image_pipeline
+    image_pipeline.init_app(app)
+
+    # initialise the response cache
+    from .utils.response_cache import response_cache
+    response_cache.init_app(app)
 
     # import blueprints
     from .routes.recommendations import recommender
@@ -83,6 +131,8 @@ def create_app(test_config=None):
     from .routes.tags import tag_bp
     from .routes.notifications import notification_bp
     from .routes.feed import feed_bp
+    from .routes.suggest import suggest_bp
+    from .routes.uploads import uploads_bp
 
     # configure blueprints here
     app.register_blueprint(recommender)
@@ -98,6 +148,12 @@ def create_app(test_config=None):
     app.register_blueprint(tag_bp)
     app.register_blueprint(notification_bp)
     app.register_blueprint(feed_bp)
+    app.register_blueprint(suggest_bp)
+    app.register_blueprint(uploads_bp)
+
+    # register cli commands
+    from .commands import register_commands
+    register_commands(app)
 
     # initialise swagger ui blueprint
     app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
@@ -120,6 +176,18 @@ def create_app(test_config=None):
     def handle_connection_error(error):
         return jsonify({'error': "Service is currently unavailable. Our team is working on it!"}), HTTP_503_SERVICE_UNAVAILABLE
 
+    @app.errorhandler(LLMError)
+    def handle_llm_error(error):
+        return jsonify({'error': "Service is currently unavailable. Our team is working on it!"}), HTTP_503_SERVICE_UNAVAILABLE
+
+    @app.errorhandler(StorageError)
+    def handle_storage_error(error):
+        return jsonify({'error': "Service is currently unavailable. Our team is working on it!"}), HTTP_503_SERVICE_UNAVAILABLE
+
+    @app.errorhandler(InvalidCursor)
+    def handle_invalid_cursor(error):
+        return jsonify({'error': "Invalid pagination cursor."}), HTTP_400_BAD_REQUEST
+
     @app.errorhandler(HTTP_429_TOO_MANY_REQUESTS)
     def handle_too_many_requests(error):
         return jsonify({'error': "You have reached your limit for the day. Please try again after 24 hours."}), HTTP_429_TOO_MANY_REQUESTS
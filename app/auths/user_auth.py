@@ -2,10 +2,11 @@ from flask import request, Blueprint, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from ..schema.models import db, Users
 from flask_jwt_extended import jwt_required, create_refresh_token, get_jwt_identity, create_access_token
-from ..utils.image_upload import upload_image
+from ..utils.image_upload import upload_image, image_variants
 from ..constants.http_status_codes import HTTP_400_BAD_REQUEST, HTTP_409_CONFLICT, HTTP_200_OK, HTTP_500_INTERNAL_SERVER_ERROR, HTTP_201_CREATED
 import validators
 from ..utils.send_email import send_password_reset_email
+from ..services import suggest
 from app import limiter, get_remote_address
 
 # create a blueprint for this route
@@ -70,6 +71,7 @@ def register():
         user = Users(username=username, email=email, password_hash=password_hashed, bio=bio, profile_pic_url=file_url)
         db.session.add(user)
         db.session.commit()
+        suggest.add_user(user)
 
         return jsonify({
             'message': 'User registered successfully!',
@@ -77,7 +79,8 @@ def register():
                 'username': username,
                 'email': email,
                 'bio': bio,
-                'profile_pic_url': file_url
+                'profile_pic_url': file_url,
+                'profile_pic_variants': image_variants(file_url)
             }
         }), HTTP_201_CREATED
 
@@ -0,0 +1,63 @@
+# flask cli commands for maintenance jobs
+import click
+from .schema.models import db, Users
+from .services.home_feed import refresh_user_feed
+from .services.counters import reconcile_counters
+from .services.summary_jobs import summary_jobs
+from .services.book_search import reindex_all
+from .services.mood_recommender import mood_recommender
+from .services.similar_books import similar_books
+from .services.uploads import collect_garbage
+
+def register_commands(app):
+
+    # rebuild every user's materialized feed, e.g. after deploying the feed_items table
+    @app.cli.command('rebuild-feeds')
+    def rebuild_feeds():
+        user_ids = [user_id for (user_id,) in db.session.query(Users.id).all()]
+        for user_id in user_ids:
+            refresh_user_feed(user_id)
+            db.session.commit()
+        click.echo(f'Rebuilt feeds for {len(user_ids)} users.')
+
+    # recompute the denormalized like/comment/follower/post/book counters in bulk
+    @app.cli.command('reconcile-counters')
+    def reconcile_counters_command():
+        reconcile_counters()
+        db.session.commit()
+        click.echo('Counters reconciled.')
+
+    # run summarization jobs left in the queue, e.g. after the server restarted
+    @app.cli.command('drain-summary-jobs')
+    def drain_summary_jobs():
+        count = summary_jobs.drain()
+        click.echo(f'Processed {count} summary jobs.')
+
+    # rebuild the full-text search index of every book
+    @app.cli.command('reindex-books')
+    def reindex_books():
+        reindex_all()
+        db.session.commit()
+        click.echo('Book search index rebuilt.')
+
+    # precompute the top books of every mood, run periodically (e.g. hourly cron)
+    @app.cli.command('build-mood-recommendations')
+    def build_mood_recommendations():
+        if not mood_recommender.available:
+            raise click.ClickException('numpy and scipy are required to build mood recommendations.')
+        books, moods = mood_recommender.build()
+        click.echo(f'Scored {books} books for {moods} moods.')
+
+    # precompute the item-item similarity index, run periodically next to the mood scores
+    @app.cli.command('build-similar-books')
+    def build_similar_books():
+        if not similar_books.available:
+            raise click.ClickException('numpy and scipy are required to build similar books.')
+        books, interactions = similar_books.build()
+        click.echo(f'Indexed {books} books from {interactions} reader interactions.')
+
+    # delete uploads no longer referenced, e.g. when the storage was down while a book was deleted
+    @app.cli.command('collect-uploads')
+    def collect_uploads():
+        count = collect_garbage()
+        click.echo(f'Deleted {count} unreferenced uploads.')
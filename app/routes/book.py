@@ -1,26 +1,36 @@
 from flask import Blueprint, request, jsonify
-from ..schema.models import db, Book
+from ..schema.models import db, Book, Users
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from ..constants.http_status_codes import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_201_CREATED
-from ..utils.file_upload import upload_file
-from ..utils.image_upload import upload_image
+from sqlalchemy.exc import IntegrityError
+from ..constants.http_status_codes import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_201_CREATED, HTTP_409_CONFLICT
+from ..utils.file_upload import upload_file, valid_file
+from ..utils.image_upload import upload_image, valid_image, image_variants
+from ..utils.pagination import cursor_paginate
+from ..services.counters import bump_counter
+from ..services.book_search import search_book_ids, index_book, remove_book
+from ..services import suggest
+from ..services.uploads import release_uploads, collect_garbage
+from ..utils.response_cache import response_cache
 
 books = Blueprint("books", __name__, static_url_path="static/", url_prefix="/api/v1.0/books")
 
+# drop the references a request took on its uploads when the book can't be saved
+def _give_back_uploads(*urls):
+    released = release_uploads(*urls)
+    db.session.commit()
+    collect_garbage(released)
+
 # Get books route
 @books.route("/", methods=['POST', 'GET'])
 @jwt_required()
+@response_cache.cached(tags=('books',))
 def get_all_books():
 
-    # add pagination
-    page=request.args.get('page', 1, type=int)
-    per_page=request.args.get('per_page', 10, type=int)
-
-    # List all the books with pagination
-    books = Book.query.paginate(page=page, per_page=per_page)
+    # List all the books newest first with cursor pagination
+    books = cursor_paginate(Book.query, Book.created_at, Book.id)
     data = []
         
-    if books:
+    if books.items:
         for book in books.items:
             data.append(
                 {
@@ -29,20 +39,12 @@ def get_all_books():
                     'author': book.author,
                     'description': book.description,
                     'cover_image_url': book.cover_image_url,
+                    'cover_image_variants': image_variants(book.cover_image_url),
                     'year_published': book.year_published,
                     'isbn': book.isbn
                     }
                 )
-        metadata={
-            'page': books.page,
-            'per_page':books.per_page,
-            'has_next': books.has_next,
-            'has_prev': books.has_prev,
-            'total': books.total,
-            'next_page': books.next_num,
-            'prev_page': books.prev_num
-        }
-        return jsonify({'data': data, 'metadata': metadata}), HTTP_200_OK
+        return jsonify({'data': data, 'metadata': books.metadata}), HTTP_200_OK
     return jsonify({'message': 'No books currently available!'}), HTTP_200_OK
 
 # Add new book route
@@ -69,15 +71,33 @@ def add_new_book():
         if not file or not cover:
             return jsonify({'error': 'No file provided.'}), HTTP_400_BAD_REQUEST
         
-        file_url = upload_file(file)
+        # check both before storing either, a rejected request leaves nothing behind
+        if not valid_file(file) or not valid_image(cover):
+            return jsonify({'error': 'Invalid file type.'}), HTTP_400_BAD_REQUEST
+
+        if Book.query.filter_by(title=title).first():
+            return jsonify({'error': 'Book title already exist.'}), HTTP_409_CONFLICT
+
+        # the cover first, it is only fully decoded while it is stored
         cover_url = upload_image(cover)
-        
-        if not file_url or not cover_url:
+        if not cover_url:
             return jsonify({'error': 'Invalid file type.'}), HTTP_400_BAD_REQUEST
+        file_url = upload_file(file)
 
         book = Book(title=title, author=author, description=description, isbn=isbn, year_published=year_published, cover_image_url=cover_url, file_url=file_url, user_id=userId)
-        db.session.add(book)
+        try:
+            with db.session.begin_nested():
+                db.session.add(book)
+                db.session.flush()
+        except IntegrityError:
+            # the same title was added in the meantime, give the uploads back
+            _give_back_uploads(file_url, cover_url)
+            return jsonify({'error': 'Book title already exist.'}), HTTP_409_CONFLICT
+        bump_counter(Users.books_count, userId)
+        index_book(book.id)
         db.session.commit()
+        suggest.add_book(book)
+        response_cache.invalidate('books', f'user:{userId}')
 
         return jsonify({
             'message': 'Book added successfully.',
@@ -88,6 +108,7 @@ def add_new_book():
                 'isbn': isbn,
                 'year_published': year_published,
                 'cover_image_url': cover_url,
+                'cover_image_variants': image_variants(cover_url),
                 'file_url': file_url
             }
         }), HTTP_201_CREATED
@@ -109,6 +130,7 @@ def get_book(book_id):
                 'title': book.title,
                 'description': book.description,
                 'cover_url': book.cover_image_url,
+                'cover_variants': image_variants(book.cover_image_url),
                 'file_url': book.file_url,
                 'isbn': book.isbn,
                 'year_published': book.year_published
@@ -117,47 +139,59 @@ def get_book(book_id):
     return jsonify({'error': 'Book not found.'}), HTTP_404_NOT_FOUND
     
 # Search books
-@books.route("/search", methods=['POST'])
+@books.route("/search", methods=['POST', 'GET'])
 @jwt_required()
 def search_books():
-    # a book search where users can search books based on the title or genre
+    # a full-text search over book titles, authors, tags and descriptions
+    query = request.args.get('q')
     title = request.args.get('title')
     author = request.args.get('author')
 
-    # get user id
-    userId = get_jwt_identity()
+    if not query:
+        query = ' '.join(value for value in (title, author) if value)
 
-    if request.method == 'POST':
-        query = Book.query.filter_by(user_id=userId)
+    if not query or query.strip() == '':
+        return jsonify({'error': 'Search query is required.'}), HTTP_400_BAD_REQUEST
 
-        if title:
-            query = query.filter(Book.title.ilike(f"%{title}%"))
-       
-        if author:
-            query = query.filter(Book.author.ilike(f"%{author}%"))
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(1, min(request.args.get('per_page', 10, type=int), 100))
 
-        books = query.all()
-        search_result_count = len(books)
+    # fetch one extra id to know whether there is a next page
+    book_ids = search_book_ids(query, limit=per_page + 1, offset=(page - 1) * per_page)
+    has_next = len(book_ids) > per_page
+    book_ids = book_ids[:per_page]
 
-        if not books:
-            return jsonify({'message': 'No books found matching the criteria.'}), HTTP_404_NOT_FOUND
+    if not book_ids:
+        return jsonify({'message': 'No books found matching the criteria.'}), HTTP_404_NOT_FOUND
 
-        data = []
-        for book in books:
-            data.append({
-                'id': book.id,
-                'title': book.title,
-                'author': book.author,
-                'description': book.description,
-                'cover_image_url': book.cover_image_url,
-                'year_published': book.year_published,
-                'isbn': book.isbn
-            })
+    books_by_id = {book.id: book for book in Book.query.filter(Book.id.in_(book_ids)).all()}
 
-        return jsonify({
-            'results_count': search_result_count,
-            'books': data
-            }), HTTP_200_OK
+    data = []
+    for book_id in book_ids:
+        book = books_by_id.get(book_id)
+        if not book:
+            continue
+        data.append({
+            'id': book.id,
+            'title': book.title,
+            'author': book.author,
+            'description': book.description,
+            'cover_image_url': book.cover_image_url,
+            'cover_image_variants': image_variants(book.cover_image_url),
+            'year_published': book.year_published,
+            'isbn': book.isbn
+        })
+
+    return jsonify({
+        'results_count': len(data),
+        'books': data,
+        'metadata': {
+            'page': page,
+            'per_page': per_page,
+            'has_next': has_next,
+            'next_page': page + 1 if has_next else None
+        }
+        }), HTTP_200_OK
 
 # Updated book route
 @books.route("/update/<int:book_id>", methods=['PUT', 'GET'])
@@ -186,20 +220,43 @@ def update_book(book_id):
             if not file or not cover:
                 return jsonify({'error': 'No file provided.'}), HTTP_400_BAD_REQUEST
             
-            file_url = upload_file(file)
+            # check both before storing either, a rejected request leaves nothing behind
+            if not valid_file(file) or not valid_image(cover):
+                return jsonify({'error': 'Invalid file type.'}), HTTP_400_BAD_REQUEST
+
+            if Book.query.filter(Book.title == title, Book.id != book.id).first():
+                return jsonify({'error': 'Book title already exist.'}), HTTP_409_CONFLICT
+
+            # the cover first, it is only fully decoded while it is stored
             cover_url = upload_image(cover)
-            
-            if not file_url or not cover_url:
+            if not cover_url:
                 return jsonify({'error': 'Invalid file type.'}), HTTP_400_BAD_REQUEST
+            file_url = upload_file(file)
 
-            book.title = title
-            book.author = author
-            book.description = description
-            book.year_published = year_published
-            book.isbn = isbn
-            book.file_url = file_url
-            book.cover_image_url = cover_url
+            previous_author = book.author
+            try:
+                with db.session.begin_nested():
+                    # the old files lose this book's reference
+                    released = release_uploads(book.file_url, book.cover_image_url)
+                    book.title = title
+                    book.author = author
+                    book.description = description
+                    book.year_published = year_published
+                    book.isbn = isbn
+                    book.file_url = file_url
+                    book.cover_image_url = cover_url
+                    db.session.flush()
+            except IntegrityError:
+                # the same title was taken in the meantime, give the new uploads back
+                _give_back_uploads(file_url, cover_url)
+                return jsonify({'error': 'Book title already exist.'}), HTTP_409_CONFLICT
+            index_book(book.id)
             db.session.commit()
+            collect_garbage(released)
+            # replace the old title and author in the autocomplete index
+            suggest.remove_book(book.id, previous_author)
+            suggest.add_book(book)
+            response_cache.invalidate('books', f'book:{book.id}')
 
             return jsonify({
                 'message': 'Book updated successfully.',
@@ -212,6 +269,7 @@ def update_book(book_id):
                     'year_published': book.year_published,
                     'file_url': book.file_url,
                     'cover_url': book.cover_image_url,
+                    'cover_variants': image_variants(book.cover_image_url),
                     'updated_at': book.updated_at
                 }
             }), HTTP_201_CREATED
@@ -229,6 +287,14 @@ def delete_book(book_id):
         if not book:
             return jsonify({'error': 'Book not found.'}), HTTP_404_NOT_FOUND
 
+        remove_book(book.id)
+        author = book.author
+        released = release_uploads(book.file_url, book.cover_image_url)
         db.session.delete(book)
+        bump_counter(Users.books_count, userId, -1)
         db.session.commit()
+        suggest.remove_book(book_id, author)
+        # delete the files nothing else holds a reference to
+        collect_garbage(released)
+        response_cache.invalidate('books', f'book:{book_id}', f'user:{userId}')
         return jsonify({'message': 'Book deleted successfully.'}), HTTP_200_OK
@@ -1,7 +1,12 @@
 from flask import request, Blueprint, jsonify
-from ..schema.models import db, Comment, Notification, Post, Users
+from ..schema.models import db, Comment, Post
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm import joinedload
+from ..services.counters import bump_counter
 from ..constants.http_status_codes import HTTP_200_OK, HTTP_404_NOT_FOUND, HTTP_201_CREATED, HTTP_400_BAD_REQUEST
+from ..utils.pagination import cursor_paginate
+from ..utils.response_cache import response_cache
+from ..services.notifications import notification_pipeline, COMMENT
 
 # create a blueprint for this route
 user_comments = Blueprint('comments', __name__, url_prefix='/api/v1.0/comments')
@@ -12,8 +17,6 @@ user_comments = Blueprint('comments', __name__, url_prefix='/api/v1.0/comments')
 def comment_post(post_id):
     userId = get_jwt_identity()
 
-    current_user = Users.query.get(userId)
-
     post = Post.query.get(post_id)
     if not post:
         return jsonify({'error': 'Post not found.'}), HTTP_404_NOT_FOUND
@@ -26,12 +29,11 @@ def comment_post(post_id):
 
         comment = Comment(content=content, user_id=userId, post_id=post_id)
         db.session.add(comment)
+        bump_counter(Post.comments_count, post_id)
         db.session.commit()
-        # send notification to the post author
-        message = f"{current_user.username} commented on your post."
-        notification = Notification(user_id=post.users.id, message=message)
-        db.session.add(notification)
-        db.session.commit()
+        response_cache.invalidate(f'post:{post_id}')
+        # notify the post author in the background
+        notification_pipeline.emit(COMMENT, post.user_id, userId, post_id)
 
         return jsonify({'message': 'Comment added.'}), HTTP_201_CREATED
     return jsonify({'error': 'Post not found.'}), HTTP_404_NOT_FOUND
@@ -39,10 +41,13 @@ def comment_post(post_id):
 # get comments for a specific post
 @user_comments.route('/post/<int:post_id>', methods=['GET'])
 @jwt_required()
+@response_cache.cached(tags=('post:{post_id}',))
 def get_comment_post(post_id):
     # get comments for the post (not just by the current user)
-    comments = Comment.query.filter_by(post_id=post_id).all()
-    comments_count = len(comments)
+    page = cursor_paginate(Comment.query.options(joinedload(Comment.users)).filter_by(post_id=post_id), Comment.posted_at, Comment.id)
+    comments = page.items
+    post = Post.query.get(post_id)
+    comments_count = post.comments_count if post else 0
 
     if not comments:
         return jsonify({'error': 'No available comments.'}), HTTP_404_NOT_FOUND
@@ -56,7 +61,7 @@ def get_comment_post(post_id):
         }
         for comment in comments
     ]
-    return jsonify({'comment_count': comments_count, 'comments': comments_data}), HTTP_200_OK
+    return jsonify({'comment_count': comments_count, 'comments': comments_data, 'metadata': page.metadata}), HTTP_200_OK
 
 # delete a comment
 @user_comments.route('/<int:comment_id>/delete', methods=['DELETE'])
@@ -71,5 +76,7 @@ def delete_comment(comment_id):
 
     if request.method == "DELETE":
         db.session.delete(comment)
+        bump_counter(Post.comments_count, comment.post_id, -1)
         db.session.commit()
+        response_cache.invalidate(f'post:{comment.post_id}')
         return jsonify({'message': 'Comment deleted.'}), HTTP_200_OK
\ No newline at end of file
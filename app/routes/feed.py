@@ -1,8 +1,10 @@
 from flask import Blueprint, jsonify
-from ..schema.models import db, Post, Likes, PostMood, UserMood, Comment, Follower, UserRecommendation
+from ..schema.models import Post, FeedItem
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from ..constants.http_status_codes import HTTP_200_OK
-from sqlalchemy import func, or_
+from ..utils.load_posts import with_post_relations
+from ..utils.image_upload import image_variants
+from ..utils.pagination import cursor_paginate
 
 feed_bp = Blueprint('feeds', __name__, static_url_path="/static", url_prefix="/api/v1.0/feed")
 
@@ -12,7 +14,11 @@ feed_bp = Blueprint('feeds', __name__, static_url_path="/static", url_prefix="/a
       1. Posts from people user follows
       2. Posts tagged with user's active moods
       3. Posts about books the recommendation engine cached
-    Ordered by: freshness + light popularity boost
+    The feed is materialized in the feed_items table when posts are created and
+    when follows, moods or recommendations change (see services/home_feed.py),
+    so reading it is a bounded range scan ordered by freshness. Posts from the
+    same instant come newest id first, the like and comment popularity
+    tiebreak of the old join is gone because it can't be part of the cursor.
 """
 
 @feed_bp.route("/", methods=["GET"])
@@ -20,46 +26,24 @@ feed_bp = Blueprint('feeds', __name__, static_url_path="/static", url_prefix="/a
 def get_feeds():
     user_id = get_jwt_identity()
 
-    # 1. Define the popularity calculation as a SQL expression
-    popularity = (
-        func.coalesce(func.count(Likes.id), 0) * 0.5 +
-        func.coalesce(func.count(Comment.id), 0) * 0.3
-    ).label("pop_score")
+    page = cursor_paginate(FeedItem.query.filter_by(user_id=user_id), FeedItem.posted_at, FeedItem.id)
+    post_ids = [item.post_id for item in page.items]
 
-    # 2. Get the current user's following list
-    followed = db.session.query(Follower.following_id).filter(Follower.follower_id == user_id).subquery()
-
-    # 3. get the current users active moods
-    active_moods = db.session.query(UserMood.mood_id).filter(UserMood.user_id == user_id).subquery()
-
-    # 4. Get stored book recommendations
-    rec_books = db.session.query(UserRecommendation.book_id).filter(UserRecommendation.user_id == user_id).subquery()
-
-    feed_query = (
-        db.session.query(Post)
-          .outerjoin(Likes, Likes.post_id == Post.id)
-          .outerjoin(Comment, Comment.post_id == Post.id)
-          .outerjoin(PostMood, PostMood.post_id == Post.id)
-          .filter(
-              or_(
-                  Post.user_id.in_(followed),
-                  PostMood.mood_id.in_(active_moods),
-                  Post.book_id.in_(rec_books)
-              )
-          )
-          .group_by(Post.id)
-          .order_by(Post.posted_at.desc(), popularity.desc())
-    )
+    if not post_ids:
+        return jsonify({"message": "No posts currently available."}), HTTP_200_OK
 
-    feed_results = feed_query.all()
+    posts_by_id = {
+        post.id: post
+        for post in with_post_relations(Post.query.filter(Post.id.in_(post_ids))).all()
+    }
 
-    # Process results: extract Post objects and convert to dictionary
+    # Keep the feed order and convert posts to dictionaries
     posts = []
-    for post_obj in feed_results:
-        # Pass current_user_id to to_dict if needed for personalization
-        post_dict = post_obj.to_dict(user_id=user_id)
-        posts.append(post_dict)
-
-    if not posts or posts == "" or posts == []:
-        return jsonify({"message": "No posts currently available."}), HTTP_200_OK
-    return jsonify(posts), HTTP_200_OK
\ No newline at end of file
+    for post_id in post_ids:
+        post_obj = posts_by_id.get(post_id)
+        if post_obj:
+            post = post_obj.to_dict(user_id=user_id)
+            post['post_image_variants'] = image_variants(post_obj.post_image_url)
+            posts.append(post)
+
+    return jsonify({"posts": posts, "metadata": page.metadata}), HTTP_200_OK
@@ -1,6 +1,10 @@
 from flask import request, Blueprint, jsonify
-from ..schema.models import db, Likes, Users, Notification, Post
+from ..schema.models import db, Likes, Post
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from ..services.counters import bump_counter
+from ..utils.response_cache import response_cache
+from ..services.similar_books import similar_books
+from ..services.notifications import notification_pipeline, LIKE
 from ..constants.http_status_codes import HTTP_200_OK, HTTP_404_NOT_FOUND
 
 # create a blueprint for this route
@@ -12,7 +16,6 @@ user_likes = Blueprint('likes', __name__, url_prefix='/api/v1.0/likes')
 def like_post(post_id):
     userId = get_jwt_identity()
     
-    current_user = Users.query.get(userId)
     # get post with that id
     post = Post.query.get(post_id)
     if not post:
@@ -23,17 +26,21 @@ def like_post(post_id):
     if existing_like:
          # allow users to unlike a post if the post alreaady exists
         db.session.delete(existing_like)
+        bump_counter(Post.likes_count, post_id, -1)
         db.session.commit()
+        response_cache.invalidate(f'post:{post_id}')
+        similar_books.mark_dirty(userId, post.book_id)
+        notification_pipeline.retract(LIKE, post.user_id, userId, post_id)
         return jsonify({'message': 'Post unliked successfully.'}), HTTP_200_OK
     
     if request.method == 'POST':
         like = Likes(user_id=userId, post_id=post_id)
         db.session.add(like)
+        bump_counter(Post.likes_count, post_id)
         db.session.commit()
-
-        message = f"{current_user.username} liked your post."
-        notification = Notification(user_id=post.users.id, message=message)
-        db.session.add(notification)
-        db.session.commit()
+        response_cache.invalidate(f'post:{post_id}')
+        similar_books.mark_dirty(userId, post.book_id)
+        # notify the post author in the background
+        notification_pipeline.emit(LIKE, post.user_id, userId, post_id)
         return jsonify({'message': 'Liked a post.'}), HTTP_200_OK
     return jsonify({'error': 'Post not found.'}), HTTP_404_NOT_FOUND
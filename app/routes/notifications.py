@@ -1,7 +1,11 @@
-from flask import request, Blueprint, jsonify
-from ..schema.models import db, Notification
+from flask import request, Blueprint, jsonify, Response, stream_with_context
+from ..schema.models import db, Notification, Users
+from sqlalchemy import update
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from ..constants.http_status_codes import HTTP_200_OK, HTTP_404_NOT_FOUND
+from ..constants.http_status_codes import HTTP_200_OK, HTTP_404_NOT_FOUND, HTTP_429_TOO_MANY_REQUESTS
+from ..utils.pagination import cursor_paginate, decode_cursor
+from ..services.notification_stream import notification_broker, event_stream, latest_cursor
+from ..services.counters import bump_counter
 
 # create a blueprint for this route
 notification_bp = Blueprint('notifications', __name__, url_prefix='/api/v1.0/notifications')
@@ -11,7 +15,8 @@ notification_bp = Blueprint('notifications', __name__, url_prefix='/api/v1.0/not
 @jwt_required()
 def get_notifications():
     user_id = get_jwt_identity()
-    notifications = Notification.query.filter_by(user_id=user_id).order_by(Notification.created_at.desc()).all()
+    page = cursor_paginate(Notification.query.filter_by(user_id=user_id), Notification.created_at, Notification.id)
+    notifications = page.items
 
     if not notifications or notifications == '':
         return jsonify({'message': 'You do not have any notification.'}), HTTP_200_OK
@@ -25,7 +30,36 @@ def get_notifications():
             'created_at' : notification.created_at,
             'is_read': notification.is_read
         })
-    return jsonify({'notifications': notifications_data, 'count': count}), HTTP_200_OK
+    return jsonify({'notifications': notifications_data, 'count': count, 'metadata': page.metadata}), HTTP_200_OK
+
+"""
+    Stream new notifications as server-sent events.
+    EventSource can't send headers, so the token is also accepted as ?jwt=.
+    A reconnecting client sends Last-Event-ID (or ?last_event_id=) and only
+    receives the notifications written since that event.
+    Every stream holds a worker, a user can only keep a few open at once.
+"""
+@notification_bp.route('/stream')
+@jwt_required(locations=['headers', 'query_string'])
+def stream_notifications():
+    user_id = int(get_jwt_identity())
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    # an invalid id is answered with 400 by the InvalidCursor handler
+    cursor = decode_cursor(last_event_id) if last_event_id else latest_cursor(user_id)
+
+    subscription = notification_broker.subscribe(user_id)
+    if subscription is None:
+        return jsonify({'error': 'Too many open notification streams.'}), HTTP_429_TOO_MANY_REQUESTS
+
+    response = Response(
+        stream_with_context(event_stream(subscription, cursor, resumed=bool(last_event_id))),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # the stream may be closed before it ever runs
+    response.call_on_close(lambda: notification_broker.unsubscribe(subscription))
+    return response
 
 # read notification
 @notification_bp.route('/<int:notification_id>/read')
@@ -33,14 +67,21 @@ def get_notifications():
 def read_notification(notification_id):
     user_id = get_jwt_identity()
 
+    # mark notification as read, only the request that flips it updates the counter
+    marked = db.session.execute(
+        update(Notification)
+        .where(Notification.id == notification_id, Notification.user_id == user_id, Notification.is_read == False)
+        .values(is_read=True),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    if marked:
+        bump_counter(Users.unread_notifications_count, user_id, -1)
+        db.session.commit()
+
     notification = Notification.query.filter_by(user_id=user_id, id=notification_id).first()
 
     if not notification:
         return jsonify({'error': 'Notification not found.'}), HTTP_404_NOT_FOUND
-    # mark notification as read
-    if notification.is_read == 'false' or notification.is_read == False:
-        notification.is_read = True
-        db.session.commit()
         
     return jsonify({
         'notification':{
@@ -64,38 +105,44 @@ def delete_notification(notification_id):
     
     if request.method == 'DELETE':
         # delete notification
+        if not notification.is_read:
+            bump_counter(Users.unread_notifications_count, user_id, -1)
         db.session.delete(notification)
         db.session.commit()
         return jsonify({'message': 'Notification deleted successfully.'}), HTTP_200_OK
     return None
 
-# Mark all as read
+"""
+    Mark the unread notifications as read in a single UPDATE.
+    With ?up_to=<id> only the notifications up to that id are marked, so a
+    client marks what it has shown without racing newer notifications.
+"""
 @notification_bp.route('/mark_as_read', methods=["PUT"])
 @jwt_required()
 def mark_all_notifications():
     user_id = get_jwt_identity()
+    up_to = request.args.get('up_to', type=int)
 
-    notifications = Notification.query.filter_by(user_id=user_id).all()
-    count = len(notifications)
-
-    if not notifications or notifications == '':
-        return jsonify({'message': 'You do not have any notifications.'}), HTTP_200_OK
-    
-    notifications_data = []
+    statement = update(Notification).where(Notification.user_id == user_id, Notification.is_read == False)
+    if up_to is not None:
+        statement = statement.where(Notification.id <= up_to)
+    marked = db.session.execute(
+        statement.values(is_read=True).returning(Notification.id),
+        execution_options={'synchronize_session': False}
+    ).scalars().all()
 
-    if request.method == "PUT":
-        for notification in notifications:
-            if notification.is_read == 'false' or notification.is_read == False:
-                # then set it to true to mark it as read
-                notification.is_read = True
-                db.session.commit()
+    if not marked:
+        return jsonify({'message': 'You do not have any unread notifications.', 'ids': [], 'count': 0}), HTTP_200_OK
 
-                notifications_data.append({
-                    'id' : notification.id,
-                    'message' : notification.message,
-                    'created_at' : notification.created_at,
-                    'is_read': notification.is_read
-                })
-        return jsonify({'notifications': notifications_data, 'count': count}), HTTP_200_OK
+    bump_counter(Users.unread_notifications_count, user_id, -len(marked))
+    db.session.commit()
+    return jsonify({'message': 'Notifications marked as read.', 'ids': sorted(marked), 'count': len(marked)}), HTTP_200_OK
 
+# number of unread notifications, read from the counter kept on the user
+@notification_bp.route('/unread_count')
+@jwt_required()
+def get_unread_count():
+    user_id = get_jwt_identity()
 
+    count = db.session.query(Users.unread_notifications_count).filter(Users.id == user_id).scalar()
+    return jsonify({'unread_count': max(count or 0, 0)}), HTTP_200_OK
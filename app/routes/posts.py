@@ -1,8 +1,14 @@
 from flask import request, Blueprint, jsonify
-from ..schema.models import db, Post, Book, Likes, Comment
+from ..schema.models import db, Post, Book, Comment, Users
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from ..constants.http_status_codes import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_201_CREATED, HTTP_204_NO_CONTENT
-from ..utils.image_upload import upload_image
+from ..utils.image_upload import upload_image, image_variants
+from ..utils.load_posts import serialize_posts, with_post_relations
+from ..utils.pagination import cursor_paginate
+from ..services.home_feed import fan_out_post, remove_post_from_feeds
+from ..services.counters import bump_counter
+from ..services.uploads import release_uploads, collect_garbage
+from ..utils.response_cache import response_cache
 
 # create a blueprint for this route
 user_posts = Blueprint('posts', __name__, static_url_path='static/', url_prefix='/api/v1.0/posts')
@@ -11,74 +17,26 @@ user_posts = Blueprint('posts', __name__, static_url_path='static/', url_prefix=
 @user_posts.route('/')
 @jwt_required()
 def posts():
-    posts = Post.query.all()
+    page = cursor_paginate(with_post_relations(Post.query), Post.posted_at, Post.id)
 
-    if not posts:
+    if not page.items:
         return jsonify({'message': 'No posts currently available!'}), HTTP_204_NO_CONTENT
 
-    posts_data = []
-    for post in posts:
-        likes_count = Likes.query.filter_by(post_id=post.id).count()
-        comments = Comment.query.filter_by(post_id=post.id).all()
-        comments_data = [
-            {
-                'id': comment.id,
-                'user': comment.users.username,
-                'content': comment.content,
-                'date_posted': comment.posted_at
-            }
-            for comment in comments
-        ]
-        posts_data.append({
-            'id': post.id,
-            'user': post.users.username,
-            'title': post.title,
-            'book': post.book.title,
-            'content': post.content,
-            'post_image_url': post.post_image_url,
-            'likes': likes_count,
-            'date_posted': post.posted_at,
-            'comments': comments_data
-            
-        })
-    return jsonify({'posts': posts_data}), HTTP_200_OK
+    posts_data = serialize_posts(page.items)
+    return jsonify({'posts': posts_data, 'metadata': page.metadata}), HTTP_200_OK
 
 # get user posts
 @user_posts.route('/user/<int:user_id>')
 @jwt_required()
 def get_posts_from_single_user(user_id):
 
-    posts = Post.query.filter_by(user_id=user_id).all()
+    page = cursor_paginate(with_post_relations(Post.query.filter_by(user_id=user_id)), Post.posted_at, Post.id)
 
-    if not posts:
+    if not page.items:
         return jsonify({'message': 'No posts currently available!'}), HTTP_204_NO_CONTENT
 
-    posts_data = []
-    for post in posts:
-        likes_count = Likes.query.filter_by(post_id=post.id).count()
-        comments = Comment.query.filter_by(post_id=post.id).all()
-        comments_data = [
-            {
-                'id': comment.id,
-                'user': comment.users.username,
-                'content': comment.content,
-                'date_posted': comment.posted_at
-            }
-            for comment in comments
-        ]
-        posts_data.append({
-            'id': post.id,
-            'user': post.users.username,
-            'title': post.title,
-            'book': post.book.title,
-            'content': post.content,
-            'post_image_url': post.post_image_url,
-            'likes': likes_count,
-            'date_posted': post.posted_at,
-            'comments': comments_data
-            
-        })
-    return jsonify({'posts': posts_data}), HTTP_200_OK
+    posts_data = serialize_posts(page.items)
+    return jsonify({'posts': posts_data, 'metadata': page.metadata}), HTTP_200_OK
 
 # create a posts
 @user_posts.route('/new', methods=['POST'])
@@ -117,7 +75,12 @@ def create_post():
             post_image_url=post_image_url
         )
         db.session.add(post)
+        bump_counter(Users.posts_count, userId)
+        db.session.flush()
+        # push the post into the feeds of followers and interested users
+        fan_out_post(post)
         db.session.commit()
+        response_cache.invalidate(f'user:{userId}')
 
         return jsonify({
             'message': 'Post added successfully!',
@@ -125,7 +88,8 @@ def create_post():
                 'title': title,
                 'content': content,
                 'book_title': book_title,
-                'post_image_url': post_image_url
+                'post_image_url': post_image_url,
+                'post_image_variants': image_variants(post_image_url)
             }
         }), HTTP_201_CREATED
     
@@ -138,7 +102,7 @@ def get_post(post_id):
     if not post:
         return jsonify({'error': 'Post not found.'}), HTTP_404_NOT_FOUND
         
-    likes_count = Likes.query.filter_by(post_id=post.id).count()
+    likes_count = post.likes_count
     comments = Comment.query.filter_by(post_id=post.id).all()
 
     if not comments:
@@ -162,6 +126,7 @@ def get_post(post_id):
             'book': post.book.title,
             'content': post.content,
             'post_image_url': post.post_image_url,
+            'post_image_variants': image_variants(post.post_image_url),
             'likes': likes_count,
             'date_posted': post.posted_at,
             'comments': comments_data
@@ -200,12 +165,16 @@ def update_post(post_id):
             if not post_image_url:
                 return ({'error': 'Invalid file type.'}), HTTP_400_BAD_REQUEST
             
+            # the old image loses this post's reference
+            released = release_uploads(post.post_image_url)
             post.title = title
             post.content = content
             post.user_id = userId
-            book.book_id = book_id
-            book.post_image_url = post_image_url
+            post.book_id = book_id
+            post.post_image_url = post_image_url
             db.session.commit()
+            collect_garbage(released)
+            response_cache.invalidate(f'user:{userId}', f'post:{post_id}')
 
             return jsonify({
             'message': 'Post added successfully!',
@@ -213,7 +182,8 @@ def update_post(post_id):
                 'title': post.title,
                 'content': post.content,
                 'book_title': post.book.title,
-                'post_image_url': post.post_image_url
+                'post_image_url': post.post_image_url,
+                'post_image_variants': image_variants(post.post_image_url)
                 }
             }), HTTP_201_CREATED
         else:
@@ -234,8 +204,14 @@ def delete_post(post_id):
         return jsonify({'error': 'Post not available.'}), HTTP_404_NOT_FOUND
     
     if request.method == "DELETE":
+        remove_post_from_feeds(post.id)
+        released = release_uploads(post.post_image_url)
         db.session.delete(post)
+        bump_counter(Users.posts_count, userId, -1)
         db.session.commit()
+        # delete the image nothing else holds a reference to
+        collect_garbage(released)
+        response_cache.invalidate(f'user:{userId}', f'post:{post_id}')
 
         return jsonify({'message': 'Post deleted!'}), HTTP_200_OK
 
@@ -1,7 +1,10 @@
 from flask import request, Blueprint, jsonify
 from ..schema.models import db, Quote, Book
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm import joinedload
 from ..constants.http_status_codes import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_201_CREATED, HTTP_204_NO_CONTENT
+from ..utils.pagination import cursor_paginate
+from ..services.similar_books import similar_books
 
 # create a blueprint for this route
 user_quotes = Blueprint('quotes', __name__, static_url_path='static/', url_prefix='/quotes')
@@ -12,7 +15,8 @@ user_quotes = Blueprint('quotes', __name__, static_url_path='static/', url_prefi
 def get_user_quotes():
 
     user_id = get_jwt_identity()
-    quotes = Quote.query.filter_by(user_id=user_id).all()
+    page = cursor_paginate(Quote.query.options(joinedload(Quote.book)).filter_by(user_id=user_id), Quote.created_at, Quote.id)
+    quotes = page.items
 
     if not quotes:
         return jsonify({'message': 'No quotes currently available!'}), HTTP_204_NO_CONTENT
@@ -26,7 +30,7 @@ def get_user_quotes():
             'date_created': quote.posted_at,            
         })
 
-    return jsonify({'quotes': quotes_data}), HTTP_200_OK
+    return jsonify({'quotes': quotes_data, 'metadata': page.metadata}), HTTP_200_OK
 
 # get all posts for a specific book
 @user_quotes.route('/book/<int:book_id>')
@@ -34,7 +38,8 @@ def get_user_quotes():
 def get_book_quotes(book_id):
 
     user_id = get_jwt_identity()
-    quotes = Quote.query.filter_by(user_id=user_id, book_id=book_id).all()
+    page = cursor_paginate(Quote.query.options(joinedload(Quote.book)).filter_by(user_id=user_id, book_id=book_id), Quote.created_at, Quote.id)
+    quotes = page.items
 
     if not quotes:
         return jsonify({'message': 'No quotes currently available!'}), HTTP_204_NO_CONTENT
@@ -48,7 +53,7 @@ def get_book_quotes(book_id):
             'date_created': quote.created_at,            
         })
 
-    return jsonify({'book_quotes': quotes_data}), HTTP_200_OK
+    return jsonify({'book_quotes': quotes_data, 'metadata': page.metadata}), HTTP_200_OK
 
 # create a quote
 @user_quotes.route('/book/<int:book_id>/new', methods=['POST', 'GET'])
@@ -70,6 +75,7 @@ def create_new_book_quote(book_id):
         quote = Quote(user_id=user_id, book_id=book_id, content=content)
         db.session.add(quote)
         db.session.commit()
+        similar_books.mark_dirty(user_id, book_id)
 
         return jsonify({
             'message': 'Quote added successfully!',
@@ -114,8 +120,10 @@ def delete_quote(quote_id):
         return jsonify({'error': 'Quote not available.'}), HTTP_404_NOT_FOUND
 
     if request.method == "DELETE":
+        book_id = quote.book_id
         db.session.delete(quote)
         db.session.commit()
+        similar_books.mark_dirty(userId, book_id)
 
         return jsonify({'message': 'Quote deleted successfully!'}), HTTP_200_OK
 
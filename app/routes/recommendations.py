@@ -1,16 +1,85 @@
-from flask import request, Blueprint, jsonify
-from ..constants.http_status_codes import HTTP_200_OK, HTTP_400_BAD_REQUEST
+from flask import request, Blueprint, jsonify, current_app, g
+from ..constants.http_status_codes import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_503_SERVICE_UNAVAILABLE
 from ..services.get_recommendations import get_mood_recommendations
-from ..schema.models import db, UserRecommendation, Book, Mood
+from ..services.mood_recommender import mood_recommender
+from ..services.similar_books import similar_books, user_book_weights
+from ..schema.models import db, UserRecommendation, Book, Mood, Users
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import limiter, get_remote_address
+from sqlalchemy.orm import joinedload
+from ..utils.pagination import cursor_paginate
+from ..services.home_feed import add_books_to_feed, refresh_user_feed
+from ..services.counters import bump_counter
+from ..services.book_search import index_book
+from ..services import suggest
+from ..utils.bulk import insert_ignore
+from ..utils.response_cache import response_cache
+from ..utils.rate_limit import get_user_or_remote_address
+from app import limiter
 
 recommender = Blueprint('recommendations', __name__, url_prefix='/api/v1.0/recommendations')
 
+RECOMMENDATIONS_PER_REQUEST = 5
+
+# store the books as the user's recommendations in a single insert, skipping the
+# ones already recommended, and surface posts about the new ones in the user's feed
+def _recommend_books(user_id, book_ids):
+    rows = [{'user_id': user_id, 'book_id': book_id} for book_id in book_ids]
+    added = insert_ignore(UserRecommendation, rows, ['user_id', 'book_id'], returning=(UserRecommendation.book_id,))
+    add_books_to_feed(user_id, [book_id for (book_id,) in added])
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+# save the books suggested by the llm and recommend them to the user in the current transaction
+# returns the Book rows in the order of the llm and whether any book was new
+def _store_llm_recommendations(user_id, book_list):
+    rows = {}
+    for book in book_list:
+        if not isinstance(book, dict):
+            continue
+        title = (book.get('title') or '').strip()[:255]
+        author = (book.get('author') or '').strip()[:255]
+        if not title or not author or title in rows:
+            continue
+        # the ids made up by the model are ignored, new books get theirs from the database
+        rows[title] = {
+            'title': title,
+            'author': author,
+            'description': book.get('description'),
+            'file_url': book.get('file_url'),
+            'cover_image_url': book.get('cover_image_url'),
+            'year_published': _to_int(book.get('year_published')),
+            'isbn': book.get('isbn') or None,
+            'user_id': user_id,
+        }
+    if not rows:
+        return [], False
+
+    # titles are unique, books already in the catalog are skipped by the database
+    added = {book_id for (book_id,) in insert_ignore(Book, list(rows.values()), ['title'], returning=(Book.id,))}
+    books_by_title = {
+        book.title: book
+        for book in Book.query.options(joinedload(Book.users)).filter(Book.title.in_(list(rows))).all()
+    }
+    books = [books_by_title[title] for title in rows if title in books_by_title]
+
+    if added:
+        bump_counter(Users.books_count, user_id, len(added))
+        for book in books:
+            if book.id in added:
+                index_book(book.id)
+                suggest.add_book(book)
+    _recommend_books(user_id, [book.id for book in books])
+    return books, bool(added)
+
 # Route to get mood-based book recommendations
 @recommender.route('/<int:mood_id>', methods=['GET'])
 @jwt_required()
-@limiter.limit("10 per day", key_func=get_remote_address)
+# only the requests answered by the llm count towards the daily limit
+@limiter.limit("10 per day", key_func=get_user_or_remote_address, deduct_when=lambda response: g.get('llm_fallback', False))
 def mood_based_recommendations(mood_id):
     user_id = get_jwt_identity()
 
@@ -24,8 +93,34 @@ def mood_based_recommendations(mood_id):
     mood = Mood.query.filter_by(id=mood_id).first()
     if not mood:
         return {"error": "Mood not found."}, HTTP_400_BAD_REQUEST
+
+    # serve the precomputed local recommendations, skipping books already recommended
+    already_recommended = {
+        book_id for (book_id,) in db.session.query(UserRecommendation.book_id).filter_by(user_id=user_id)
+    }
+    ranked = mood_recommender.recommend(mood.id, limit=RECOMMENDATIONS_PER_REQUEST, exclude=already_recommended)
+    if ranked:
+        books_by_id = {book.id: book for book in Book.query.options(joinedload(Book.users)).filter(Book.id.in_([book_id for book_id, _ in ranked])).all()}
+        recommended = [(books_by_id[book_id], score) for book_id, score in ranked if book_id in books_by_id]
+        _recommend_books(user_id, [book.id for book, _ in recommended])
+        data = [{**book.to_dict(), 'score': round(score, 4)} for book, score in recommended]
+        db.session.commit()
+
+        return jsonify({
+            'data': {
+                'reasoning': f"Books readers, posts and tags associate with feeling {mood.name}.",
+                'source': 'local',
+                'books': data
+            }
+        }), HTTP_200_OK
+
+    # cold start, no local signal for this mood yet
+    if not current_app.config.get('MOOD_RECOMMENDER_LLM_FALLBACK', True):
+        return {"error": "No recommendations found for the given mood."}, HTTP_400_BAD_REQUEST
+    g.llm_fallback = True
+
     # Get book recommendations based on the mood
-    book_recommendations = get_mood_recommendations(mood)
+    book_recommendations = get_mood_recommendations(mood.name)
     if not book_recommendations:
         return {"error": "No recommendations found for the given mood."}, HTTP_400_BAD_REQUEST  
     
@@ -33,44 +128,61 @@ def mood_based_recommendations(mood_id):
     if not book_list:
         return {"error": "No books found in the recommendations."}, HTTP_400_BAD_REQUEST
     
-    for book in book_list:
-        # add the book to the database if it does not exist
-        existing_book_id = Book.query.filter_by(id=book['id']).first()
-        existing_book_title = Book.query.filter_by(title=book['title']).first()
-        if existing_book_id or existing_book_title:
-            # if the book already exists, skip adding it
-            continue
-        else:
-            new_book = Book(
-                id=book['id'],
-                title=book['title'],
-                author=book['author'],
-                description=book['description'],
-                file_url=book['file_url'],
-                cover_image_url=book['cover_image_url'],
-                year_published=book.get('year_published', None),
-                isbn=book.get('isbn', None),
-                user_id=user_id
-            )
-            db.session.add(new_book)
-            db.session.commit()
-        # Store the recommendations in the UserRecommendation table
-        # Check if the recommendation already exists
-        existing_recommendation = UserRecommendation.query.filter_by(
-            user_id=user_id, book_id=book['id']
-        ).first()
-        if existing_recommendation:
-            # If it exists, skip adding it
-            continue
-        else:
-            recommendation = UserRecommendation(
-                user_id=user_id,
-                book_id=new_book.id
-            )
-            db.session.add(recommendation)
-            db.session.commit()
+    books, added_books = _store_llm_recommendations(user_id, book_list)
+    data = [book.to_dict() for book in books]
+    db.session.commit()
+    if added_books:
+        response_cache.invalidate('books', f'user:{user_id}')
+
+    return jsonify({
+        'data': {
+            'reasoning': book_recommendations.get('reasoning'),
+            'source': 'llm',
+            'books': data
+        }
+    }), HTTP_200_OK
+
+# Route to get books read by the same readers as a given book
+@recommender.route('/similar/<int:book_id>', methods=['GET'])
+@jwt_required()
+def get_similar_books(book_id):
+    if not similar_books.available:
+        return jsonify({'error': 'Similar books are currently unavailable.'}), HTTP_503_SERVICE_UNAVAILABLE
+
+    book = Book.query.get(book_id)
+    if not book:
+        return jsonify({'error': 'Book not found.'}), HTTP_404_NOT_FOUND
+
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    ranked = similar_books.similar(book_id, limit=limit)
+    books_by_id = {b.id: b for b in Book.query.options(joinedload(Book.users)).filter(Book.id.in_([i for i, _ in ranked])).all()}
+
+    similar = [{**books_by_id[i].to_dict(), 'score': round(score, 4)} for i, score in ranked if i in books_by_id]
+    return jsonify({'book_id': book_id, 'similar': similar}), HTTP_200_OK
+
+# Route to recommend books liked by readers with the same taste, stored as recommendations
+@recommender.route('/for-you', methods=['GET'])
+@jwt_required()
+def readers_like_you():
+    user_id = get_jwt_identity()
+
+    if not similar_books.available:
+        return jsonify({'error': 'Personal recommendations are currently unavailable.'}), HTTP_503_SERVICE_UNAVAILABLE
+
+    weights = user_book_weights(user_id)
+    if not weights:
+        return jsonify({'message': 'Bookmark, like or quote a few books to get personal recommendations.'}), HTTP_200_OK
+
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    ranked = similar_books.for_books(weights, limit=limit)
+    books_by_id = {b.id: b for b in Book.query.options(joinedload(Book.users)).filter(Book.id.in_([i for i, _ in ranked])).all()}
+    ranked = [(i, score) for i, score in ranked if i in books_by_id]
+
+    _recommend_books(user_id, [i for i, _ in ranked])
+    recommendations = [{**books_by_id[i].to_dict(), 'score': round(score, 4)} for i, score in ranked]
+    db.session.commit()
 
-    return jsonify({ 'data': book_recommendations }), HTTP_200_OK
+    return jsonify({'recommendations': recommendations}), HTTP_200_OK
 
 # Route to get all recommendations for a user
 @recommender.route('/', methods=['GET'])
@@ -78,14 +190,15 @@ def mood_based_recommendations(mood_id):
 def get_all_recommendations():
     user_id = get_jwt_identity()
     
-    recommendations = UserRecommendation.query.filter_by(user_id=user_id).all()
+    page = cursor_paginate(UserRecommendation.query.options(joinedload(UserRecommendation.book)).filter_by(user_id=user_id), None, UserRecommendation.id)
+    recommendations = page.items
     
     if not recommendations:
         return {"message": "No recommendations available."}, HTTP_400_BAD_REQUEST
     
     books = [rec.book.to_dict() for rec in recommendations]
     
-    return jsonify({"recommendations": books}), HTTP_200_OK
+    return jsonify({"recommendations": books, "metadata": page.metadata}), HTTP_200_OK
 
 # Route to clear all recommendations for a user
 @recommender.route('/clear', methods=['DELETE'])
@@ -95,6 +208,7 @@ def clear_recommendations():
     
     # Delete all recommendations for the user
     UserRecommendation.query.filter_by(user_id=user_id).delete()
+    refresh_user_feed(user_id)
     db.session.commit()
     
     return jsonify({"message": "All recommendations cleared."}), HTTP_200_OK
@@ -113,6 +227,8 @@ def delete_recommendation(book_id):
     
     # Delete the recommendation
     db.session.delete(recommendation)
+    db.session.flush()
+    refresh_user_feed(user_id)
     db.session.commit()
     
     return jsonify({"message": "Recommendation deleted successfully."}), HTTP_200_OK
@@ -0,0 +1,31 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+from ..constants.http_status_codes import HTTP_200_OK, HTTP_400_BAD_REQUEST
+from ..services.suggest import suggest, KINDS
+
+suggest_bp = Blueprint('suggest', __name__, static_url_path='static/', url_prefix='/api/v1.0/suggest')
+
+MAX_SUGGESTIONS = 25
+
+"""
+    Autocomplete for the search box
+    Returns book titles, authors, tag names and usernames that start with q,
+    falling back to close matches when q is misspelled.
+    Optional args: limit (default 10, max 25) and types, a comma separated
+    subset of book,author,tag,user.
+"""
+@suggest_bp.route('/', methods=['GET'])
+@jwt_required()
+def get_suggestions():
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_SUGGESTIONS)
+
+    kinds = [kind.strip() for kind in request.args.get('types', '').split(',') if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in KINDS]
+    if unknown:
+        return jsonify({'error': f"Unknown suggestion types: {', '.join(unknown)}."}), HTTP_400_BAD_REQUEST
+
+    if not query:
+        return jsonify({'suggestions': []}), HTTP_200_OK
+
+    return jsonify({'suggestions': suggest(query, limit=limit, kinds=kinds or None)}), HTTP_200_OK
@@ -1,17 +1,20 @@
-from flask import request, Blueprint, jsonify
-from ..constants.http_status_codes import HTTP_404_NOT_FOUND, HTTP_500_INTERNAL_SERVER_ERROR, HTTP_200_OK
-from ..services.get_summary import summarize_section
+from flask import request, Blueprint, jsonify, url_for
+from ..constants.http_status_codes import HTTP_404_NOT_FOUND, HTTP_200_OK, HTTP_202_ACCEPTED
+from ..services.summary_jobs import summary_jobs
+from ..services.summary_cache import summary_cache
+from ..services.llm_gateway import llm
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from ..schema.models import Book, Summary, db
-from ..utils.limit_tokens_count import truncate_text_to_token_limit
-from ..utils.downloads import download_or_get_local_file
-from ..utils.get_text_from_pdf import extract_text_content
-from app import limiter, get_remote_address
+from sqlalchemy.orm import joinedload
+from ..schema.models import Book, Summary, SummaryJob, db
+from ..utils.pagination import cursor_paginate
+from ..utils.response_cache import response_cache
+from ..utils.rate_limit import get_user_or_remote_address
+from app import limiter
 
 summarize = Blueprint('summaries', __name__, static_folder='static', url_prefix='/api/v1.0/summaries')
 
 @summarize.route('/book/<int:book_id>/summarize', methods=['POST'])
-@limiter.limit("10 per day", key_func=get_remote_address)
+@limiter.limit("10 per day", key_func=get_user_or_remote_address)
 @jwt_required()
 def summarise_book(book_id):
     user_id = get_jwt_identity()
@@ -21,37 +24,44 @@ def summarise_book(book_id):
 
         if not book:
             return jsonify({'error': 'Book not found.'}), HTTP_404_NOT_FOUND
-        
-        book_url = book.file_url
-
-        try:
-            file_path = download_or_get_local_file(book_url)
-            text_content = extract_text_content(file_path)
-            limited_text = truncate_text_to_token_limit(text_content, max_tokens=6000)
-
-            summary_text = summarize_section(limited_text)
-
-            if not summary_text or summary_text == '':
-                return jsonify({'message': 'Summary is empty.'})
-
-            summary = Summary(user_id=user_id, book_id=book.id, summary_text=summary_text)
-            db.session.add(summary)
-            db.session.commit()
-
-            return jsonify({
-                "summary":{
-                    "status": "success",
-                    "book": book.title,
-                    "author": book.author,
-                    "summary_text": summary_text
-                }
-            })
-        
-        except Exception as e:
-            return jsonify({
-                "status": "error",
-                "message": str(e)
-            }), HTTP_500_INTERNAL_SERVER_ERROR
+
+        # download, parsing and the LLM call run in the background workers
+        job = summary_jobs.enqueue(user_id=user_id, book_id=book.id)
+
+        return jsonify({
+            "job": {
+                "id": job.id,
+                "status": job.status,
+                "book": book.title,
+                "author": book.author,
+                "status_url": url_for('summaries.get_summary_job', job_id=job.id, _external=True)
+            }
+        }), HTTP_202_ACCEPTED
+
+# summary cache hit/miss metrics
+@summarize.route('/cache/stats')
+@jwt_required()
+def get_summary_cache_stats():
+    return jsonify({'cache': summary_cache.stats()}), HTTP_200_OK
+
+# per model latency, token and circuit breaker metrics of the llm gateway
+@summarize.route('/llm/stats')
+@jwt_required()
+def get_llm_stats():
+    return jsonify({'models': llm.metrics()}), HTTP_200_OK
+
+# check the progress of a summarization job
+@summarize.route('/jobs/<int:job_id>')
+@jwt_required()
+def get_summary_job(job_id):
+    user_id = get_jwt_identity()
+
+    job = SummaryJob.query.filter_by(user_id=user_id, id=job_id).first()
+
+    if not job:
+        return jsonify({'error': 'Job not found.'}), HTTP_404_NOT_FOUND
+
+    return jsonify({'job': job.to_dict()}), HTTP_200_OK
 
 @summarize.route('/summary/<int:summary_id>')
 @jwt_required()
@@ -74,9 +84,11 @@ def get_summarized_text(summary_id):
 # List all summaries
 @summarize.route('/summaries/<int:book_id>/all')
 @jwt_required()
+@response_cache.cached(tags=('book:{book_id}', 'summaries:{book_id}'))
 def get_all_summaries(book_id):
     
-    summaries = Summary.query.filter_by(book_id=book_id).all()
+    page = cursor_paginate(Summary.query.options(joinedload(Summary.book)).filter_by(book_id=book_id), Summary.created_at, Summary.id)
+    summaries = page.items
 
     if not summaries:
         return jsonify({'error': 'No summaries found.'}), HTTP_404_NOT_FOUND
@@ -89,7 +101,7 @@ def get_all_summaries(book_id):
             'author': summary.book.author,
             'summary_text': summary.summary_text
         })
-    return ({'summaries': summary_data}), HTTP_200_OK
+    return ({'summaries': summary_data, 'metadata': page.metadata}), HTTP_200_OK
 
 # delete a summary
 @summarize.route('/summary/<int:summary_id>/delete', methods=['DELETE'])
@@ -104,6 +116,7 @@ def delete_summary(summary_id):
     
     db.session.delete(summary)
     db.session.commit()
+    response_cache.invalidate(f'summaries:{summary.book_id}')
 
     return jsonify({'message': 'Summary deleted successfully.'}), HTTP_200_OK
 
@@ -113,7 +126,8 @@ def delete_summary(summary_id):
 def get_user_summaries():
     user_id = get_jwt_identity()
 
-    summaries = Summary.query.filter_by(user_id=user_id).all()
+    page = cursor_paginate(Summary.query.options(joinedload(Summary.book)).filter_by(user_id=user_id), Summary.created_at, Summary.id)
+    summaries = page.items
 
     if not summaries:
         return jsonify({'error': 'No summaries found.'}), HTTP_404_NOT_FOUND
@@ -127,4 +141,4 @@ def get_user_summaries():
             'summary_text': summary.summary_text
         })
 
-    return jsonify({'summaries': summary_data}), HTTP_200_OK
\ No newline at end of file
+    return jsonify({'summaries': summary_data, 'metadata': page.metadata}), HTTP_200_OK
\ No newline at end of file
@@ -1,17 +1,24 @@
 from flask import Blueprint, request, jsonify
 from ..schema.models import db, Tag, BookTag
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm import joinedload
+from ..services.book_search import index_book
+from ..services import suggest
+from ..utils.response_cache import response_cache
 from ..constants.http_status_codes import HTTP_404_NOT_FOUND, HTTP_200_OK,HTTP_400_BAD_REQUEST, HTTP_201_CREATED
+from ..utils.pagination import cursor_paginate
 
 tag_bp = Blueprint('tag', __name__, static_url_path='static/', url_prefix='/api/v1.0/tags')
 
 # get all tags
 @tag_bp.route('/', methods=['POST', 'GET'])
 @jwt_required()
+@response_cache.cached(tags=('tags',))
 def get_tags():
 
     if request.method == 'GET':
-        tags = Tag.query.all()
+        page = cursor_paginate(Tag.query, None, Tag.id)
+        tags = page.items
 
         if not tags:
             return ({'error': 'No tags available.'}), HTTP_404_NOT_FOUND
@@ -23,7 +30,7 @@ def get_tags():
                 'id': tag.id,
                 'name': tag.name
             })
-        return ({'tags': data_tag}), HTTP_200_OK
+        return ({'tags': data_tag, 'metadata': page.metadata}), HTTP_200_OK
     else:
         tag_name = request.json['name']
 
@@ -33,6 +40,8 @@ def get_tags():
         tag = Tag(name=tag_name)
         db.session.add(tag)
         db.session.commit()
+        suggest.add_tag(tag)
+        response_cache.invalidate('tags')
         return jsonify({
             'message': 'Tag added successfully.',
             'tag':{
@@ -50,8 +59,15 @@ def delete_tag(tag_id):
         return ({'error': 'Tag not found.'}), HTTP_400_BAD_REQUEST
     
     if request.method == 'DELETE':
+        book_ids = [book_tag.book_id for book_tag in tag.book_tags]
         db.session.delete(tag)
+        db.session.flush()
+        # the tag name is part of the search document of every book it was attached to
+        for book_id in book_ids:
+            index_book(book_id)
+        suggest.remove_tag(tag)
         db.session.commit()
+        response_cache.invalidate('tags', f'tag:{tag_id}')
         return ({'message': 'Tag deleted successfully.'}), HTTP_200_OK
     return None
 
@@ -71,14 +87,19 @@ def add_tag_to_book(book_id, tag_id):
         return jsonify({'error': 'Tag already exists for this book.'}), HTTP_400_BAD_REQUEST
     new_book_tag = BookTag(book_id=book_id, tag_id=tag_id)
     db.session.add(new_book_tag)
+    db.session.flush()
+    index_book(book_id)
     db.session.commit()
+    response_cache.invalidate(f'tag:{tag_id}')
     return jsonify({'message': 'Tag added to book successfully.'}), HTTP_201_CREATED
 
 # get all books with a specific tag
 @tag_bp.route('/books/<int:tag_id>', methods=['GET'])
 @jwt_required()
+@response_cache.cached(tags=('books', 'tag:{tag_id}'))
 def get_books_by_tag(tag_id):
-    books = BookTag.query.filter_by(tag_id=tag_id).all()
+    page = cursor_paginate(BookTag.query.options(joinedload(BookTag.book)).filter_by(tag_id=tag_id), BookTag.created_at, BookTag.id)
+    books = page.items
     if not books:
         return jsonify({'error': 'No books found for this tag.'}), HTTP_404_NOT_FOUND
 
@@ -92,4 +113,4 @@ def get_books_by_tag(tag_id):
             'file_url': book.book.file_url,
             'cover_image_url': book.book.cover_image_url,
         })
-    return jsonify({'books': book_data}), HTTP_200_OK
\ No newline at end of file
+    return jsonify({'books': book_data, 'metadata': page.metadata}), HTTP_200_OK
\ No newline at end of file
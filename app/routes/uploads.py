@@ -0,0 +1,12 @@
+from flask import Blueprint
+from app import limiter
+from ..utils.file_serving import send_upload
+
+# uploaded books and images, at the urls the static folder used to serve them on
+uploads_bp = Blueprint('uploads', __name__, url_prefix='/static/uploads')
+
+# readers fetch large books in many small ranges, so no request limits here
+@uploads_bp.route('/<path:key>')
+@limiter.exempt
+def serve_upload(key):
+    return send_upload(key)
@@ -1,7 +1,10 @@
 from flask import request, Blueprint, jsonify
 from ..schema.models import db, UserBook
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm import joinedload
 from ..constants.http_status_codes import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_201_CREATED, HTTP_204_NO_CONTENT
+from ..utils.pagination import cursor_paginate
+from ..services.similar_books import similar_books
 
 
 # create a blueprint for this route
@@ -14,7 +17,8 @@ def get_all_bookmarks():
     user_id = get_jwt_identity()
 
     # get all bookmarks
-    all_bookmarks = UserBook.query.filter_by(user_id=user_id).all()
+    page = cursor_paginate(UserBook.query.options(joinedload(UserBook.book)).filter_by(user_id=user_id), UserBook.added_at, UserBook.id)
+    all_bookmarks = page.items
 
     if not all_bookmarks:
         return jsonify({'message': 'No bookmarks currently available.'}), HTTP_200_OK
@@ -30,7 +34,7 @@ def get_all_bookmarks():
             'book_file_url': bookmark.book.file_url,
             'book_cover_image_url': bookmark.book.cover_image_url,
         })
-    return ({'bookmarks': bookmark_data}), HTTP_200_OK
+    return ({'bookmarks': bookmark_data, 'metadata': page.metadata}), HTTP_200_OK
 
 # add to bookmarks
 @user_bookmarks.route('/add/<int:book_id>/', methods=['POST'])
@@ -42,6 +46,7 @@ def add_bookmarks(book_id):
         bookmark = UserBook(user_id=user_id, book_id=book_id)
         db.session.add(bookmark)
         db.session.commit()
+        similar_books.mark_dirty(user_id, book_id)
         return jsonify({'message': 'Successfully added to bookmarks.'}), HTTP_201_CREATED
     else:
         return None
@@ -58,8 +63,10 @@ def delete_bookmarks(bookmark_id):
     
     if request.method == 'DELETE':
 
+        book_id = bookmark.book_id
         db.session.delete(bookmark)
         db.session.commit()
+        similar_books.mark_dirty(user_id, book_id)
         return jsonify({'message': 'Successfully removed from bookmarks.'}), HTTP_200_OK
     else:
         return None
@@ -76,9 +83,11 @@ def clear_bookmarks():
         if not bookmarks:
             return jsonify({'message': 'No bookmarks available.'}), HTTP_200_OK
         
+        book_ids = [bookmark.book_id for bookmark in bookmarks]
         for bookmark in bookmarks:
             db.session.delete(bookmark)
         
         db.session.commit()
+        similar_books.mark_dirty(user_id, *book_ids)
         return jsonify({'message': 'Bookmarks cleared successfully.'}), HTTP_204_NO_CONTENT
 
@@ -1,7 +1,13 @@
 from flask import request, Blueprint, jsonify
-from ..schema.models import db, Users, Follower, Notification
+from ..schema.models import db, Users, Follower
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm import joinedload
+from ..services.home_feed import add_author_to_feed, refresh_user_feed
+from ..services.counters import bump_counter
 from ..constants.http_status_codes import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_201_CREATED, HTTP_204_NO_CONTENT
+from ..utils.pagination import cursor_paginate
+from ..utils.response_cache import response_cache
+from ..services.notifications import notification_pipeline, FOLLOW
 
 # Create a blueprint for this route
 user_follow = Blueprint('users', __name__, url_prefix='/api/v1.0/users')
@@ -25,14 +31,15 @@ def follow_user(user_id):
 
         new_follow = Follower(follower_id=current_user_id, following_id=user_id)
         db.session.add(new_follow)
+        bump_counter(Users.followers_count, user_id)
+        bump_counter(Users.following_count, current_user_id)
+        # bring the followed user's recent posts into the follower's feed
+        add_author_to_feed(current_user_id, user_id)
         db.session.commit()
+        response_cache.invalidate(f'user:{user_id}', f'user:{current_user_id}')
 
-        # Add notification to the user being followed
-        current_user=Users.query.filter_by(id=current_user_id).first()
-        message = f"{current_user.username} is now following you."
-        notification = Notification(user_id=user_id, message=message)
-        db.session.add(notification)
-        db.session.commit()
+        # notify the user being followed in the background
+        notification_pipeline.emit(FOLLOW, user_id, current_user_id)
 
         return {"message": f"You are now following {user_to_follow.username}."}, HTTP_201_CREATED
 
@@ -53,9 +60,16 @@ def unfollow_user(following_user_id):
         return jsonify({"error": "You are not following this user."}), HTTP_400_BAD_REQUEST
     
     db.session.delete(unfollow)
+    bump_counter(Users.followers_count, following_user_id, -1)
+    bump_counter(Users.following_count, current_user_id, -1)
+    db.session.flush()
+    # rebuild the feed so posts that only came from this user are dropped
+    refresh_user_feed(current_user_id)
     db.session.commit()
+    response_cache.invalidate(f'user:{following_user_id}', f'user:{current_user_id}')
+    notification_pipeline.retract(FOLLOW, following_user_id, current_user_id)
 
-    return {"message": f"Successfully unfollowed {unfollow.username}."}, HTTP_201_CREATED
+    return {"message": f"Successfully unfollowed {user_to_unfollow.username}."}, HTTP_201_CREATED
 
 # get user's followers route
 @user_follow.route('/<int:user_id>/followers', methods=['GET'])
@@ -65,7 +79,8 @@ def get_followers(user_id):
     if not user:
         return jsonify({'error': 'User not found.'}), HTTP_404_NOT_FOUND
 
-    followers = Follower.query.filter_by(following_id=user_id).all()
+    page = cursor_paginate(Follower.query.options(joinedload(Follower.follower)).filter_by(following_id=user_id), Follower.followed_at, Follower.id)
+    followers = page.items
     follower_list = [
         {
             "id": follower.follower.id,
@@ -74,7 +89,7 @@ def get_followers(user_id):
         for follower in followers if follower.follower
     ]
 
-    return jsonify({"followers": follower_list}), HTTP_200_OK
+    return jsonify({"followers": follower_list, "metadata": page.metadata}), HTTP_200_OK
 
 # get user's following route
 @user_follow.route('/<int:user_id>/following', methods=['GET'])
@@ -85,20 +100,22 @@ def get_user_following(user_id):
     if not user:
         return jsonify({'error': 'User not found.'}), HTTP_404_NOT_FOUND
 
-    following = Follower.query.filter_by(follower_id=user_id).all()
+    page = cursor_paginate(Follower.query.options(joinedload(Follower.following)).filter_by(follower_id=user_id), Follower.followed_at, Follower.id)
+    following = page.items
     following_list = [
         {
-            "id": follow.followed.id,
-            "username": follow.followed.username
+            "id": follow.following.id,
+            "username": follow.following.username
         }
-        for follow in following if follow.followed
+        for follow in following if follow.following
     ]
 
-    return jsonify({"following": following_list}), HTTP_200_OK
+    return jsonify({"following": following_list, "metadata": page.metadata}), HTTP_200_OK
 
 # get the user's profile
 @user_follow.route('/<int:user_id>/profile', methods=['GET'])
 @jwt_required()
+@response_cache.cached(tags=('user:{user_id}',))
 def get_user_profile(user_id):
     user = Users.query.get(user_id)
     if not user:
@@ -109,11 +126,11 @@ def get_user_profile(user_id):
         "username": user.username,
         "email": user.email,
         "bio": user.bio,
-        "followers": len(user.followers),
-        "following": len(user.following),
-        "posts": len(user.posts),
+        "followers": user.followers_count,
+        "following": user.following_count,
+        "posts": user.posts_count,
         "profile_image_url": user.profile_pic_url,
-        "books": len(user.books),
+        "books": user.books_count,
         "joined_at": user.created_at
     }
 
@@ -1,5 +1,6 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from flask import current_app
 from time import time
 import jwt
@@ -16,6 +17,13 @@ class Users(db.Model):
     profile_pic_url = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
+    # denormalized counters maintained by the follow, post and book routes
+    followers_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    posts_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    books_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # maintained by the notification writer and the read/delete routes
+    unread_notifications_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     books = db.relationship('Book', backref='users', lazy=True)
     posts = db.relationship('Post', backref='users', lazy=True)
@@ -46,6 +54,9 @@ class Users(db.Model):
 
 # Books table
 class Book(db.Model):
+    __table_args__ = (
+        db.Index('ix_book_search_vector', 'search_vector', postgresql_using='gin'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False, unique=True)
     author = db.Column(db.String(255), nullable=False)
@@ -57,6 +68,8 @@ class Book(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    # weighted full-text document (title, author, tags, description), only used on PostgreSQL
+    search_vector = db.deferred(db.Column(db.Text().with_variant(TSVECTOR(), 'postgresql'), nullable=True))
 
     user_books = db.relationship('UserBook', backref='book', lazy=True)
     posts = db.relationship('Post', backref='book', lazy=True)
@@ -105,6 +118,9 @@ class Post(db.Model):
     title = db.Column(db.String(255), nullable=False)
     post_image_url = db.Column(db.Text, nullable=True)
     posted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # denormalized counters maintained by the like and comment routes
+    likes_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comments_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     comments = db.relationship('Comment', backref='post', lazy=True)
     likes = db.relationship('Likes', backref='post', lazy=True)
@@ -122,6 +138,8 @@ class Post(db.Model):
             'post_image_url': self.post_image_url,
             'posted_at': self.posted_at.isoformat(),
             'book_title': self.book.title,
+            'likes_count': self.likes_count,
+            'comments_count': self.comments_count,
         }
 
 # Comments table
@@ -161,6 +179,8 @@ class Summary(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), index=True)
     book_id = db.Column(db.Integer, db.ForeignKey("book.id"), index=True)
     summary_text = db.Column(db.Text, nullable=False)
+    # model, prompt version, token limit and hash of the summarized text
+    cache_key = db.Column(db.String(160), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self) -> str:
@@ -198,9 +218,21 @@ class BookTag(db.Model):
 
 # Notifications table
 class Notification(db.Model):
+    __table_args__ = (
+        db.Index('ix_notification_user_group', 'user_id', 'group_key'),
+        db.Index('ix_notification_user_created', 'user_id', 'created_at', 'id'),
+        # only the unread rows, what mark-as-read touches
+        db.Index(
+            'ix_notification_user_unread', 'user_id', 'id',
+            postgresql_where=db.text('is_read = false'), sqlite_where=db.text('is_read = 0')
+        ),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), index=True)
     message = db.Column(db.Text, nullable=False)
+    # e.g. 'like:<post id>', unread notifications of the same group are coalesced
+    group_key = db.Column(db.String(64), nullable=True)
+    actor_count = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -254,6 +286,9 @@ class PostMood(db.Model):
 # Recommendations with matching moods
 class UserRecommendation(db.Model):
     __tablename__ = "user_recommendations"
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'book_id', name='uq_user_recommendations_user_book'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     book_id = db.Column(db.ForeignKey("book.id", ondelete="CASCADE"), index=True)
     user_id = db.Column(db.ForeignKey("users.id", ondelete="CASCADE"), index=True)
@@ -261,3 +296,85 @@ class UserRecommendation(db.Model):
     def __repr__(self) -> str:
         return f'UserRecommendation>>>{self.id}'
 
+
+# Materialized home feed | one row per post fanned out to a user's feed
+class FeedItem(db.Model):
+    __tablename__ = "feed_items"
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', name='uq_feed_items_user_post'),
+        db.Index('ix_feed_items_user_posted', 'user_id', 'posted_at', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    post_id = db.Column(db.ForeignKey("post.id", ondelete="CASCADE"), nullable=False, index=True)
+    posted_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return f'FeedItem>>>{self.id}'
+
+# Background summarization jobs | the table doubles as the job queue
+class SummaryJob(db.Model):
+    __tablename__ = "summary_jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    book_id = db.Column(db.ForeignKey("book.id", ondelete="CASCADE"), index=True)
+    summary_id = db.Column(db.ForeignKey("summary.id", ondelete="SET NULL"), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    progress = db.Column(db.SmallInteger, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    # throughput and token usage of the map-reduce run
+    chunks = db.Column(db.Integer, nullable=False, default=0)
+    llm_calls = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    elapsed_seconds = db.Column(db.Float, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    summary = db.relationship('Summary', lazy=True)
+    book = db.relationship('Book', lazy=True)
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'book_id': self.book_id,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+            'usage': {
+                'chunks': self.chunks,
+                'llm_calls': self.llm_calls,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'elapsed_seconds': self.elapsed_seconds,
+                'tokens_per_second': round((self.prompt_tokens + self.completion_tokens) / self.elapsed_seconds, 2) if self.elapsed_seconds else None,
+            },
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+        if self.summary:
+            data['summary'] = {
+                'id': self.summary.id,
+                'book': self.book.title,
+                'author': self.book.author,
+                'summary_text': self.summary.summary_text
+            }
+        return data
+
+    def __repr__(self) -> str:
+        return f'SummaryJob>>>{self.id}'
+
+# Uploaded files, stored once per content hash and shared by every upload of the same bytes
+class StoredFile(db.Model):
+    __tablename__ = "stored_files"
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, unique=True)
+    # storage key, e.g. files/<sha256>.pdf
+    key = db.Column(db.Text, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+    # books, posts and users pointing at this file, unreferenced files are garbage collected
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        return f'StoredFile>>>{self.sha256}'
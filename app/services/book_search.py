@@ -0,0 +1,188 @@
+# full-text search over books
+# On PostgreSQL every book keeps a weighted tsvector of its title, author, tag names
+# and description behind a GIN index. Other databases (SQLite in tests) use an
+# in-process inverted index with the same weights. Both rank results, match every
+# query word as a prefix and are updated incrementally by the book and tag routes.
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from sqlalchemy import text, func
+from ..schema.models import db, Book, BookTag, Tag
+
+# same relative weights as ts_rank's default {D, C, B, A}
+FIELD_WEIGHTS = {'title': 1.0, 'author': 0.4, 'tags': 0.2, 'description': 0.1}
+
+STOPWORDS = {'a', 'an', 'and', 'the', 'of', 'to', 'in', 'on', 'for', 'is', 'it', 'by', 'with', 'at', 'or', 'as'}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(value):
+    return [token for token in TOKEN_RE.findall((value or '').lower()) if token not in STOPWORDS]
+
+def _is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+# PostgreSQL
+_PG_UPDATE = text("""
+    UPDATE book SET search_vector =
+        setweight(to_tsvector('english', coalesce(book.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(book.author, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(tag.name, ' ') FROM book_tag JOIN tag ON tag.id = book_tag.tag_id
+            WHERE book_tag.book_id = book.id
+        ), '')), 'C') ||
+        setweight(to_tsvector('english', coalesce(book.description, '')), 'D')
+    WHERE (:book_id IS NULL OR book.id = :book_id)
+""")
+
+def _pg_tsquery(query):
+    terms = [re.sub(r'[^\w]', '', token) for token in tokenize(query)]
+    return ' & '.join(f'{term}:*' for term in terms if term)
+
+def _pg_search(query, limit, offset):
+    tsquery = func.to_tsquery('english', _pg_tsquery(query))
+    rank = func.ts_rank_cd(Book.search_vector, tsquery)
+    rows = (
+        db.session.query(Book.id)
+        .filter(Book.search_vector.op('@@')(tsquery))
+        .order_by(rank.desc(), Book.id.desc())
+        .limit(limit)
+        .offset(offset)
+        .all()
+    )
+    return [book_id for (book_id,) in rows]
+
+# in-process fallback
+class InvertedIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = defaultdict(dict)  # term -> {book_id: weight}
+        self._terms = []  # sorted terms for prefix lookups
+        self._docs = {}  # book_id -> terms, so a book can be removed
+        self.built = False
+
+    def _add(self, book_id, fields):
+        weights = defaultdict(float)
+        for field, value in fields.items():
+            for token in tokenize(value):
+                weights[token] += FIELD_WEIGHTS[field]
+        for term, weight in weights.items():
+            if term not in self._postings:
+                insort(self._terms, term)
+            self._postings[term][book_id] = weight
+        self._docs[book_id] = set(weights)
+
+    def _remove(self, book_id):
+        for term in self._docs.pop(book_id, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(book_id, None)
+                if not postings:
+                    del self._postings[term]
+                    index = bisect_left(self._terms, term)
+                    if index < len(self._terms) and self._terms[index] == term:
+                        del self._terms[index]
+
+    def build(self, documents):
+        with self._lock:
+            self._postings.clear()
+            self._terms = []
+            self._docs.clear()
+            for book_id, fields in documents:
+                self._add(book_id, fields)
+            self.built = True
+
+    def update(self, book_id, fields):
+        with self._lock:
+            self._remove(book_id)
+            self._add(book_id, fields)
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def _prefix_terms(self, prefix):
+        start = bisect_left(self._terms, prefix)
+        for term in self._terms[start:]:
+            if not term.startswith(prefix):
+                break
+            yield term
+
+    def search(self, query, limit, offset):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            total_docs = max(len(self._docs), 1)
+            scores = None
+            for token in tokens:
+                # every query word must match some indexed word as a prefix
+                token_scores = defaultdict(float)
+                for term in self._prefix_terms(token):
+                    postings = self._postings[term]
+                    idf = math.log(1 + total_docs / len(postings))
+                    for book_id, weight in postings.items():
+                        token_scores[book_id] += weight * idf
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {book_id: score + token_scores[book_id] for book_id, score in scores.items() if book_id in token_scores}
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return [book_id for book_id, _ in ranked[offset:offset + limit]]
+
+_index = InvertedIndex()
+
+def _documents(book_ids=None):
+    books = db.session.query(Book.id, Book.title, Book.author, Book.description)
+    tags = db.session.query(BookTag.book_id, Tag.name).join(Tag, Tag.id == BookTag.tag_id)
+    if book_ids is not None:
+        books = books.filter(Book.id.in_(book_ids))
+        tags = tags.filter(BookTag.book_id.in_(book_ids))
+    tag_names = defaultdict(list)
+    for book_id, name in tags.all():
+        tag_names[book_id].append(name)
+    for book_id, title, author, description in books.all():
+        yield book_id, {
+            'title': title,
+            'author': author,
+            'tags': ' '.join(tag_names[book_id]),
+            'description': description,
+        }
+
+def _ensure_index():
+    if not _index.built:
+        _index.build(_documents())
+
+# public api
+
+# reindex one book, call after the book or its tags change (the book must be flushed)
+def index_book(book_id):
+    if _is_postgres():
+        db.session.execute(_PG_UPDATE, {'book_id': book_id})
+    elif _index.built:
+        for doc_id, fields in _documents([book_id]):
+            _index.update(doc_id, fields)
+
+def remove_book(book_id):
+    if not _is_postgres():
+        _index.remove(book_id)
+
+# rebuild the whole index
+def reindex_all():
+    if _is_postgres():
+        db.session.execute(_PG_UPDATE, {'book_id': None})
+    else:
+        _index.build(_documents())
+
+# return the ids of the books matching query, best match first
+def search_book_ids(query, limit=20, offset=0):
+    if not tokenize(query):
+        return []
+    if _is_postgres():
+        return _pg_search(query, limit, offset)
+    _ensure_index()
+    return _index.search(query, limit, offset)
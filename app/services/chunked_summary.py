@@ -0,0 +1,74 @@
+# map-reduce summarization for full-length books
+# The text is split into overlapping token windows, every window is summarized
+# concurrently with get_summary.summarize_section and the partial summaries are
+# merged in rounds with get_summary.combine_summaries until one is left, so a
+# whole novel takes roughly as long as a handful of sequential calls. The calls
+# only wait on the llm gateway, which enforces the per-model concurrency limit.
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from . import get_summary
+from ..utils.limit_tokens_count import split_text_into_token_chunks
+
+CHUNK_TOKENS = 6000
+CHUNK_OVERLAP = 200
+# upper bound on the windows sent to the model for a single book
+MAX_CHUNKS = 64
+# partial summaries merged by each reduce call
+REDUCE_FAN_IN = 8
+# calls waiting on the gateway at once for a single book
+MAX_CONCURRENT_CALLS = 8
+# tokens covered by MAX_CHUNKS windows, extraction can stop once this is reached
+MAX_BOOK_TOKENS = MAX_CHUNKS * (CHUNK_TOKENS - CHUNK_OVERLAP) + CHUNK_OVERLAP
+
+class SummaryUsage:
+    def __init__(self):
+        self.chunks = 0
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.elapsed_seconds = 0.0
+
+    def add(self, usage):
+        self.calls += 1
+        self.prompt_tokens += usage.get('prompt_tokens', 0)
+        self.completion_tokens += usage.get('completion_tokens', 0)
+
+# run fn over every item concurrently, returns the results in order
+# the first failure cancels the calls that have not started
+def _map_concurrently(fn, items):
+    if len(items) == 1:
+        return [fn(items[0])]
+    pool = ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_CALLS, len(items)), thread_name_prefix='summary-call')
+    try:
+        return list(pool.map(fn, items))
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+# summarize a whole book, returns the summary text and the usage of the run
+def summarize_long_text(text):
+    usage = SummaryUsage()
+    started = perf_counter()
+
+    chunks = split_text_into_token_chunks(text, CHUNK_TOKENS, CHUNK_OVERLAP, max_chunks=MAX_CHUNKS)
+    usage.chunks = len(chunks)
+
+    partials = []
+    for summary, chunk_usage in _map_concurrently(get_summary.summarize_section, chunks):
+        usage.add(chunk_usage)
+        partials.append(summary)
+
+    # hierarchical reduce keeps every call well inside the context window
+    while len(partials) > 1:
+        groups = [partials[i:i + REDUCE_FAN_IN] for i in range(0, len(partials), REDUCE_FAN_IN)]
+        merged = iter(_map_concurrently(get_summary.combine_summaries, [group for group in groups if len(group) > 1]))
+        partials = []
+        for group in groups:
+            if len(group) == 1:
+                partials.append(group[0])
+                continue
+            summary, group_usage = next(merged)
+            usage.add(group_usage)
+            partials.append(summary)
+
+    usage.elapsed_seconds = perf_counter() - started
+    return partials[0], usage
@@ -0,0 +1,54 @@
+# denormalized like/comment/follower/post/book/unread notification counters
+# Routes bump the counters in the same transaction as the row they add or remove,
+# so profile and feed reads never have to count rows or load collections.
+from sqlalchemy import update, select, func, bindparam
+from ..schema.models import db, Users, Post, Book, Likes, Comment, Follower, Notification
+
+# atomically add delta to a counter column, e.g. bump_counter(Post.likes_count, post.id)
+def bump_counter(column, row_id, delta=1):
+    model = column.class_
+    db.session.execute(
+        update(model)
+        .where(model.id == int(row_id))
+        .values({column: column + delta})
+    )
+
+# add a delta per row in one executemany, e.g. bump_counters(Users.unread_notifications_count, {user_id: 3})
+def bump_counters(column, deltas):
+    model = column.class_
+    rows = [{'row_id': int(row_id), 'delta': delta} for row_id, delta in deltas.items() if delta]
+    if rows:
+        db.session.connection().execute(
+            update(model)
+            .where(model.id == bindparam('row_id'))
+            .values({column: column + bindparam('delta')}),
+            rows
+        )
+
+def _count(model, fk_column, parent_id, *conditions):
+    return (
+        select(func.count(model.id))
+        .where(fk_column == parent_id, *conditions)
+        .correlate_except(model)
+        .scalar_subquery()
+    )
+
+# rebuild every counter from the source tables in a handful of bulk updates
+def reconcile_counters():
+    db.session.execute(
+        update(Post).values(
+            likes_count=_count(Likes, Likes.post_id, Post.id),
+            comments_count=_count(Comment, Comment.post_id, Post.id),
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.execute(
+        update(Users).values(
+            followers_count=_count(Follower, Follower.following_id, Users.id),
+            following_count=_count(Follower, Follower.follower_id, Users.id),
+            posts_count=_count(Post, Post.user_id, Users.id),
+            books_count=_count(Book, Book.user_id, Users.id),
+            unread_notifications_count=_count(Notification, Notification.user_id, Users.id, Notification.is_read == False),
+        ),
+        execution_options={'synchronize_session': False}
+    )
@@ -1,19 +1,12 @@
-from openai import OpenAI
 import json
-from dotenv import load_dotenv
-import os
+from .llm_gateway import llm
 
-load_dotenv()
-
-client = OpenAI(
-        base_url="https://models.inference.ai.azure.com",
-        api_key=os.getenv("GITHUB_TOKEN"),
-)
+MODEL = "gpt-4o"
 
 def get_mood_recommendations(mood):
         
-        response = client.chat.completions.create(
-        model="gpt-4o",
+        completion = llm.complete(
+        MODEL,
         temperature=1,
         max_tokens=4096,
         top_p=1,
@@ -53,7 +46,4 @@ def get_mood_recommendations(mood):
 
             )
 
-        response_message = response.choices[0].message
-        content = response_message.content
-
-        return json.loads(content)
\ No newline at end of file
+        return json.loads(completion.text)
\ No newline at end of file
@@ -1,25 +1,32 @@
-from openai import OpenAI
-from dotenv import load_dotenv
-import os
+from .llm_gateway import llm
 
-load_dotenv()
+MODEL="gpt-4.1"
+# bump whenever the prompts below change so cached summaries are not reused
+PROMPT_VERSION=2
 
-client = OpenAI(
-        base_url="https://models.inference.ai.azure.com",
-        api_key=os.getenv("GITHUB_TOKEN"),
-)
+SYSTEM_PROMPT = "You are a helpful assistant that summarizes documents topic-by-topic with relevant content."
 
-MODEL="gpt-4.1"
+PARAMS = {'temperature': 0.4, 'max_tokens': 1024}
+
+def _messages(prompt):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
 
+def _section_prompt(content):
+    return f"Summarize the following content clearly and concisely. Focus on separating topics or ideas where possible: {content}"
+
+def _combine_prompt(summaries):
+    parts = "\n\n".join(f"Part {i}:\n{summary}" for i, summary in enumerate(summaries, start=1))
+    return f"The following are summaries of consecutive parts of the same book. Combine them into a single clear and concise summary that keeps the order of events and separates topics or ideas where possible:\n\n{parts}"
+
+# summarize one section of a book, returns the summary and the tokens used
 def summarize_section(content):
-    prompt = f"Summarize the following content clearly and concisely. Focus on separating topics or ideas where possible: {content}"
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that summarizes documents topic-by-topic with relevant content."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.4,
-        max_tokens=1024
-    )
-    return response.choices[0].message.content.strip()
\ No newline at end of file
+    completion = llm.complete(MODEL, _messages(_section_prompt(content)), **PARAMS)
+    return completion.text, completion.usage
+
+# merge summaries of consecutive parts of a book into one, returns the summary and the tokens used
+def combine_summaries(summaries):
+    completion = llm.complete(MODEL, _messages(_combine_prompt(summaries)), **PARAMS)
+    return completion.text, completion.usage
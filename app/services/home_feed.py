@@ -0,0 +1,88 @@
+# fan-out-on-write home feed
+# Each user's feed is stored in the feed_items table so reading it is a range scan
+# on (user_id, posted_at, id) instead of a join over posts, likes, comments and moods.
+# Nothing writes user moods yet, mood posts come in through refresh_user_feed().
+from sqlalchemy import insert, select, union, or_
+from ..schema.models import db, Post, PostMood, UserMood, Follower, UserRecommendation, FeedItem
+
+# maximum number of posts kept when a feed is rebuilt
+FEED_MAX_ITEMS = 500
+
+def _insert_feed_items(rows):
+    if rows:
+        db.session.execute(insert(FeedItem), rows)
+
+# users who should see a post: followers of the author, users with a matching mood
+# and users who have the post's book in their recommendations
+def _audience_for_post(post):
+    followers = select(Follower.follower_id).where(Follower.following_id == post.user_id)
+    mood_users = (
+        select(UserMood.user_id)
+        .join(PostMood, PostMood.mood_id == UserMood.mood_id)
+        .where(PostMood.post_id == post.id)
+    )
+    rec_users = select(UserRecommendation.user_id).where(UserRecommendation.book_id == post.book_id)
+    return db.session.execute(union(followers, mood_users, rec_users)).scalars().all()
+
+# push a newly created post into every interested user's feed
+# called after the post is flushed so it commits in the same transaction
+def fan_out_post(post):
+    already = select(FeedItem.user_id).where(FeedItem.post_id == post.id)
+    existing = set(db.session.execute(already).scalars().all())
+    rows = [
+        {'user_id': user_id, 'post_id': post.id, 'posted_at': post.posted_at}
+        for user_id in _audience_for_post(post)
+        if user_id is not None and user_id not in existing
+    ]
+    _insert_feed_items(rows)
+
+def _add_posts_to_feed(user_id, condition):
+    in_feed = select(FeedItem.post_id).where(FeedItem.user_id == user_id)
+    posts = db.session.execute(
+        select(Post.id, Post.posted_at)
+        .where(condition, Post.id.not_in(in_feed))
+        .order_by(Post.posted_at.desc(), Post.id.desc())
+        .limit(FEED_MAX_ITEMS)
+    ).all()
+    _insert_feed_items([
+        {'user_id': user_id, 'post_id': post_id, 'posted_at': posted_at}
+        for post_id, posted_at in posts
+    ])
+
+# add the latest posts of a newly followed author to the follower's feed
+def add_author_to_feed(user_id, author_id):
+    _add_posts_to_feed(user_id, Post.user_id == author_id)
+
+# add the latest posts about newly recommended books to the user's feed
+def add_books_to_feed(user_id, book_ids):
+    if book_ids:
+        _add_posts_to_feed(user_id, Post.book_id.in_(book_ids))
+
+# rebuild a single user's feed from scratch
+# used when follows, moods or recommendations change in a way that removes posts
+def refresh_user_feed(user_id):
+    followed = select(Follower.following_id).where(Follower.follower_id == user_id)
+    active_moods = select(UserMood.mood_id).where(UserMood.user_id == user_id)
+    mood_posts = select(PostMood.post_id).where(PostMood.mood_id.in_(active_moods))
+    rec_books = select(UserRecommendation.book_id).where(UserRecommendation.user_id == user_id)
+
+    posts = db.session.execute(
+        select(Post.id, Post.posted_at)
+        .where(or_(
+            Post.user_id.in_(followed),
+            Post.id.in_(mood_posts),
+            Post.book_id.in_(rec_books)
+        ))
+        .order_by(Post.posted_at.desc(), Post.id.desc())
+        .limit(FEED_MAX_ITEMS)
+    ).all()
+
+    FeedItem.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    _insert_feed_items([
+        {'user_id': user_id, 'post_id': post_id, 'posted_at': posted_at}
+        for post_id, posted_at in posts
+    ])
+
+# drop a post from every feed, used when the post is deleted
+def remove_post_from_feeds(post_id):
+    FeedItem.query.filter_by(post_id=post_id).delete(synchronize_session=False)
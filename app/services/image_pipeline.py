@@ -0,0 +1,175 @@
+# background image processing for covers, avatars and post images
+# The upload request decodes the image, drops its metadata (EXIF, GPS, comments)
+# after applying the EXIF orientation and stores the cleaned full size image as
+# images/<sha256>.<ext>, so the url it returns works right away. The raw bytes
+# are kept under their sha256, outside the static folder, and a process pool
+# writes the resized copies into a staging folder:
+#   - <sha256>-<variant>.<format> for every size in IMAGE_VARIANTS and every
+#     format in IMAGE_VARIANT_FORMATS (webp, and avif when Pillow supports it)
+# The files are then moved to the upload storage under images/, in order so the
+# presence of the last one means the whole set is done, and only then is the
+# raw upload removed. Uploading the same bytes again reuses the existing files,
+# or the job in progress, and queues the variants again when a job failed.
+import logging
+import os
+import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps, features
+from ..utils.storage import upload_storage
+
+logger = logging.getLogger(__name__)
+
+# the incoming raw uploads, never served
+INCOMING_FOLDER = os.path.join('tmp', 'uploads', 'images')
+
+# Pillow format -> stored extension
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+SAVE_OPTIONS = {
+    'jpg': {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True},
+    'png': {'format': 'PNG', 'optimize': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'avif': {'format': 'AVIF', 'quality': 60},
+}
+
+CONTENT_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp', 'avif': 'image/avif'}
+
+def _supported(fmt):
+    return fmt != 'avif' or features.check('avif')
+
+def _save(image, path, fmt):
+    options = SAVE_OPTIONS[fmt]
+    if options['format'] == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+    # write next to the target and rename, so readers never see half a file
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    image.save(tmp_path, **options)
+    os.replace(tmp_path, path)
+
+# decode everything, truncated or corrupt files fail here, and apply the orientation
+def _clean(image):
+    image.load()
+    image = ImageOps.exif_transpose(image)
+    # keep the colour profile, drop everything else
+    icc_profile = image.info.get('icc_profile')
+    image.info = {'icc_profile': icc_profile} if icc_profile else {}
+    return image
+
+# write the full size image at source without its metadata to target
+def clean_image(source, target, extension):
+    with Image.open(source) as image:
+        _save(_clean(image), target, extension)
+
+"""
+    Turn one incoming upload into its resized variants in staging_folder,
+    returns their file names in publishing order, or an empty list when
+    there is nothing to do.
+    Runs in a worker process, so it only takes plain values and paths, the
+    caller removes the source once the files are published.
+"""
+def process_image(source, staging_folder, digest, variants, formats):
+    try:
+        image = Image.open(source)
+    except FileNotFoundError:
+        # a concurrent upload of the same bytes already took care of it
+        return []
+    try:
+        with image:
+            image = _clean(image)
+
+            os.makedirs(staging_folder, exist_ok=True)
+            names = []
+            for name, size in variants.items():
+                variant = image.copy()
+                # never upscales, small images keep their size
+                variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+                for fmt in formats:
+                    names.append(f'{digest}-{name}.{fmt}')
+                    _save(variant, os.path.join(staging_folder, names[-1]), fmt)
+        return names
+    except BaseException:
+        shutil.rmtree(staging_folder, ignore_errors=True)
+        raise
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class ImagePipeline:
+    def __init__(self, app=None):
+        self.app = None
+        self.variants = {}
+        self.formats = ()
+        self._processes = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # variant name -> longest side in pixels
+        app.config.setdefault('IMAGE_VARIANTS', {'thumb': 160, 'small': 320, 'medium': 640, 'large': 1280})
+        app.config.setdefault('IMAGE_VARIANT_FORMATS', ('avif', 'webp'))
+        app.config.setdefault('IMAGE_PROCESS_WORKERS', 2)
+        # uploads bigger than this are refused before decoding
+        app.config.setdefault('IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+        app.config.setdefault('IMAGE_MAX_PIXELS', 40_000_000)
+        # process inline in the calling thread, handy for tests and the shell
+        app.config.setdefault('IMAGES_EAGER', False)
+        self.app = app
+        self.variants = dict(app.config['IMAGE_VARIANTS'])
+        self.formats = tuple(fmt for fmt in app.config['IMAGE_VARIANT_FORMATS'] if _supported(fmt))
+        for fmt in set(app.config['IMAGE_VARIANT_FORMATS']) - set(self.formats):
+            logger.info('Pillow has no %s support, skipping %s image variants.', fmt, fmt)
+        app.extensions['image_pipeline'] = self
+
+    @property
+    def eager(self):
+        return self.app.config['IMAGES_EAGER']
+
+    def _process_pool(self):
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(max_workers=self.app.config['IMAGE_PROCESS_WORKERS'])
+        return self._processes
+
+    # storage keys of the resized copies of an image
+    def variant_keys(self, digest):
+        return [f'images/{digest}-{name}.{fmt}' for name in self.variants for fmt in self.formats]
+
+    def submit(self, source, digest):
+        # one per job, a racing upload of the same bytes never shares it
+        staging_folder = f'{source}.{uuid.uuid4().hex}.out'
+        args = (source, staging_folder, digest, self.variants, self.formats)
+        if self.eager:
+            self._finish(lambda: process_image(*args), source, staging_folder, digest)
+            return
+        future = self._process_pool().submit(process_image, *args)
+        future.add_done_callback(lambda f: self._finish(f.result, source, staging_folder, digest))
+
+    def _finish(self, result, source, staging_folder, digest):
+        try:
+            self._publish(staging_folder, result())
+        except Exception as e:
+            self._log_failure(digest, e)
+        finally:
+            # until now a duplicate upload finds the source and doesn't queue it again
+            _discard(source)
+
+    # move the processed files to the upload storage
+    def _publish(self, staging_folder, names):
+        if not names:
+            return
+        try:
+            for name in names:
+                content_type = CONTENT_TYPES[name.rsplit('.', 1)[1]]
+                upload_storage.save(f'images/{name}', os.path.join(staging_folder, name), content_type=content_type)
+        finally:
+            shutil.rmtree(staging_folder, ignore_errors=True)
+
+    def _log_failure(self, digest, error):
+        logger.error('Processing image %s failed: %s', digest, error)
+
+image_pipeline = ImagePipeline()
@@ -0,0 +1,306 @@
+# shared client for the chat completion api
+# Every service talks to the model through this gateway. Requests run on one
+# event loop in a background thread over a bounded connection pool, so Flask
+# workers and job threads only wait on a future. Each model has its own
+# concurrency limit, transient failures are retried with jittered exponential
+# backoff and a circuit breaker fails fast while the upstream keeps failing.
+# Latency and token usage are recorded per model.
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+DEFAULT_BASE_URL = "https://models.inference.ai.azure.com"
+# statuses worth retrying, anything else is the caller's fault
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+class LLMError(Exception):
+    pass
+
+# raised without calling the model while the circuit breaker is open
+class LLMUnavailable(LLMError):
+    pass
+
+class Completion:
+    def __init__(self, text, prompt_tokens=0, completion_tokens=0, latency=0.0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.latency = latency
+
+    @property
+    def usage(self):
+        return {'prompt_tokens': self.prompt_tokens, 'completion_tokens': self.completion_tokens}
+
+class CircuitBreaker:
+    def __init__(self, threshold=5, reset_after=30.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self._trial else 'open'
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        # after the cool down let a single trial call through
+        if not self._trial and time.monotonic() - self.opened_at >= self.reset_after:
+            self._trial = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        if self._trial or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self._trial = False
+
+    # the trial call ended without telling whether the upstream recovered,
+    # e.g. it was cancelled or rejected as a bad request, so the next call tries again
+    def release(self):
+        self._trial = False
+
+class ModelMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latencies = deque(maxlen=1024)
+        self._lock = threading.Lock()
+
+    def record(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def record_call(self, completion):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += completion.prompt_tokens
+            self.completion_tokens += completion.completion_tokens
+            self.latencies.append(completion.latency)
+
+    def to_dict(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            data = {
+                'calls': self.calls,
+                'errors': self.errors,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'in_flight': self.in_flight,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+            }
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1)
+
+        data['latency_ms'] = {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99)}
+        return data
+
+class LLMGateway:
+    def __init__(self, app=None):
+        self.base_url = DEFAULT_BASE_URL
+        self.api_key = os.getenv("GITHUB_TOKEN")
+        self.timeout = 60.0
+        self.max_connections = 20
+        self.default_concurrency = 4
+        self.model_concurrency = {'gpt-4.1': 8}
+        self.max_retries = 4
+        self.backoff_base = 0.5
+        self.backoff_cap = 20.0
+        self.breaker_threshold = 5
+        self.breaker_reset = 30.0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+        self._client = None
+        self._semaphores = {}
+        self._breakers = {}
+        self._metrics = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LLM_BASE_URL', os.getenv('LLM_BASE_URL', DEFAULT_BASE_URL))
+        app.config.setdefault('LLM_API_KEY', os.getenv('GITHUB_TOKEN'))
+        app.config.setdefault('LLM_TIMEOUT', 60.0)
+        app.config.setdefault('LLM_MAX_CONNECTIONS', 20)
+        app.config.setdefault('LLM_DEFAULT_CONCURRENCY', 4)
+        app.config.setdefault('LLM_MODEL_CONCURRENCY', {'gpt-4.1': 8})
+        app.config.setdefault('LLM_MAX_RETRIES', 4)
+        app.config.setdefault('LLM_BREAKER_THRESHOLD', 5)
+        app.config.setdefault('LLM_BREAKER_RESET', 30.0)
+        self.base_url = app.config['LLM_BASE_URL']
+        self.api_key = app.config['LLM_API_KEY']
+        self.timeout = app.config['LLM_TIMEOUT']
+        self.max_connections = app.config['LLM_MAX_CONNECTIONS']
+        self.default_concurrency = app.config['LLM_DEFAULT_CONCURRENCY']
+        self.model_concurrency = dict(app.config['LLM_MODEL_CONCURRENCY'])
+        self.max_retries = app.config['LLM_MAX_RETRIES']
+        self.breaker_threshold = app.config['LLM_BREAKER_THRESHOLD']
+        self.breaker_reset = app.config['LLM_BREAKER_RESET']
+        app.extensions['llm_gateway'] = self
+
+    # one loop per process, forked workers start their own
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='llm-gateway', daemon=True).start()
+                self._loop = loop
+                self._pid = os.getpid()
+                self._client = None
+                self._semaphores = {}
+            return self._loop
+
+    # the clients below are only touched from the gateway loop
+    def _get_client(self):
+        if self._client is None:
+            if not self.api_key:
+                raise LLMError('The LLM api key is not configured.')
+            self._client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                max_retries=0,
+                timeout=self.timeout,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                    timeout=self.timeout,
+                ),
+            )
+        return self._client
+
+    def _semaphore(self, model):
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.model_concurrency.get(model, self.default_concurrency))
+        return self._semaphores[model]
+
+    def _breaker(self, model):
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+        return self._breakers[model]
+
+    def _model_metrics(self, model):
+        with self._lock:
+            if model not in self._metrics:
+                self._metrics[model] = ModelMetrics()
+            return self._metrics[model]
+
+    @staticmethod
+    def _retryable(error):
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+    # full jitter backoff, a Retry-After from the server wins
+    def _backoff(self, attempt, error):
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_cap)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def acomplete(self, model, messages, **params):
+        breaker = self._breaker(model)
+        metrics = self._model_metrics(model)
+        async with self._semaphore(model):
+            metrics.record(in_flight=1)
+            try:
+                attempt = 0
+                while True:
+                    if not breaker.allow():
+                        metrics.record(rejected=1)
+                        raise LLMUnavailable(f'{model} is temporarily unavailable.')
+                    # nothing awaits between allow() and here, so half-open means this call is the trial
+                    trial = breaker.state == 'half-open'
+                    started = time.perf_counter()
+                    try:
+                        response = await self._get_client().chat.completions.create(model=model, messages=messages, **params)
+                    except openai.APIError as e:
+                        retryable = self._retryable(e)
+                        if retryable:
+                            breaker.failure()
+                        elif trial:
+                            breaker.release()
+                        if not retryable or attempt >= self.max_retries:
+                            metrics.record(errors=1)
+                            raise LLMError(f'{model} request failed: {e}') from e
+                        attempt += 1
+                        metrics.record(retries=1)
+                        await asyncio.sleep(self._backoff(attempt, e))
+                        continue
+                    except BaseException:
+                        # cancelled, e.g. by a failing sibling in acomplete_many, or no client
+                        if trial:
+                            breaker.release()
+                        raise
+                    breaker.success()
+                    usage = response.usage
+                    completion = Completion(
+                        (response.choices[0].message.content or '').strip(),
+                        prompt_tokens=usage.prompt_tokens if usage else 0,
+                        completion_tokens=usage.completion_tokens if usage else 0,
+                        latency=time.perf_counter() - started,
+                    )
+                    metrics.record_call(completion)
+                    return completion
+            finally:
+                metrics.record(in_flight=-1)
+
+    # run every request concurrently, the first failure cancels the rest
+    async def acomplete_many(self, model, batch, **params):
+        tasks = [asyncio.ensure_future(self.acomplete(model, messages, **params)) for messages in batch]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()).result()
+
+    # blocking wrappers for flask views and worker threads
+
+    def complete(self, model, messages, **params):
+        return self._run(self.acomplete(model, messages, **params))
+
+    def complete_many(self, model, batch, **params):
+        return self._run(self.acomplete_many(model, batch, **params))
+
+    def metrics(self):
+        with self._lock:
+            models = dict(self._metrics)
+        return {
+            model: {**metrics.to_dict(), 'circuit': self._breaker(model).state}
+            for model, metrics in models.items()
+        }
+
+llm = LLMGateway()
@@ -0,0 +1,225 @@
+# outbound mail queue
+# Routes hand their messages to the queue and return right away. A background
+# sender takes them in batches and sends them over one SMTP connection that
+# stays open between batches until it has been idle for MAIL_QUEUE_IDLE_TIMEOUT.
+# Temporary failures (connection errors, 4xx replies) close the connection and
+# retry the message with jittered exponential backoff, permanent ones (5xx) are
+# logged and dropped.
+import atexit
+import heapq
+import itertools
+import logging
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+from flask_mail import Message
+from app import mail
+
+logger = logging.getLogger(__name__)
+
+class OutgoingMail:
+    def __init__(self, message):
+        self.message = message
+        self.attempts = 0
+
+def _permanent(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    code = getattr(error, 'smtp_code', None)
+    return code is not None and code >= 500
+
+class MailQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self.batch_size = 50
+        self.flush_interval = 0.2
+        self.idle_timeout = 30.0
+        self.max_retries = 5
+        self.backoff_base = 1.0
+        self.backoff_cap = 300.0
+        self._queue = queue.SimpleQueue()
+        self._retries = []  # heap of (due at, sequence, OutgoingMail), touched under _sending
+        self._sequence = itertools.count()
+        self._connection = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        # held while the retries and the connection are used, by the sender or drain()
+        self._sending = threading.RLock()
+        self._worker = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_QUEUE_BATCH_SIZE', 50)
+        # seconds the sender waits for more messages before sending a batch
+        app.config.setdefault('MAIL_QUEUE_FLUSH_INTERVAL', 0.2)
+        # seconds an unused smtp connection is kept open
+        app.config.setdefault('MAIL_QUEUE_IDLE_TIMEOUT', 30.0)
+        app.config.setdefault('MAIL_QUEUE_MAX_RETRIES', 5)
+        app.config.setdefault('MAIL_QUEUE_BACKOFF_BASE', 1.0)
+        # send inline in the calling thread, handy for tests and the shell
+        app.config.setdefault('MAIL_QUEUE_EAGER', False)
+        self.app = app
+        self.batch_size = app.config['MAIL_QUEUE_BATCH_SIZE']
+        self.flush_interval = app.config['MAIL_QUEUE_FLUSH_INTERVAL']
+        self.idle_timeout = app.config['MAIL_QUEUE_IDLE_TIMEOUT']
+        self.max_retries = app.config['MAIL_QUEUE_MAX_RETRIES']
+        self.backoff_base = app.config['MAIL_QUEUE_BACKOFF_BASE']
+        app.extensions['mail_queue'] = self
+
+    @property
+    def eager(self):
+        return self.app.config['MAIL_QUEUE_EAGER']
+
+    def send(self, message):
+        if self.eager:
+            mail.send(message)
+            return
+        self._ensure_worker()
+        self._queue.put(OutgoingMail(message))
+
+    def send_message(self, subject, sender, recipients, body):
+        message = Message(subject, sender=sender, recipients=recipients)
+        message.body = body
+        self.send(message)
+
+    # one sender per process, forked workers start their own and a dead sender is replaced
+    def _ensure_worker(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # the parent's queue, retries and connection aren't ours
+                self._queue = queue.SimpleQueue()
+                self._retries = []
+                self._connection = None
+                self._sending = threading.RLock()
+                self._worker = None
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, name='mail-queue', daemon=True)
+                self._worker.start()
+                self._pid = os.getpid()
+
+    # seconds until there is something to do: a retry coming due or an idle connection to close
+    def _wait_time(self):
+        with self._sending:
+            return self._deadline()
+
+    def _deadline(self):
+        deadlines = []
+        if self._retries:
+            deadlines.append(self._retries[0][0])
+        if self._connection is not None:
+            deadlines.append(self._last_used + self.idle_timeout)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    def _due_retries(self):
+        now = time.monotonic()
+        due = []
+        with self._sending:
+            while self._retries and self._retries[0][0] <= now and len(due) < self.batch_size:
+                due.append(heapq.heappop(self._retries)[2])
+        return due
+
+    def _next_batch(self):
+        batch = self._due_retries()
+        if not batch:
+            try:
+                batch.append(self._queue.get(timeout=self._wait_time()))
+            except queue.Empty:
+                return self._due_retries()
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self):
+        while True:
+            try:
+                batch = self._next_batch()
+                with self._sending, self.app.app_context():
+                    if batch:
+                        self._send_batch(batch)
+                    elif self._connection is not None and time.monotonic() - self._last_used >= self.idle_timeout:
+                        self._close()
+            except Exception:
+                # keep the sender alive, the messages of a failed batch are lost but later ones are sent
+                logger.exception('Mail queue sender failed.')
+
+    def _connect(self):
+        if self._connection is None:
+            connection = mail.connect()
+            connection.__enter__()
+            self._connection = connection
+        return self._connection
+
+    def _close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None and connection.host is not None:
+            try:
+                connection.host.quit()
+            except (smtplib.SMTPException, OSError):
+                connection.host.close()
+
+    def _retry(self, item, error):
+        item.attempts += 1
+        recipients = ', '.join(item.message.send_to)
+        if _permanent(error) or item.attempts > self.max_retries:
+            logger.error('Giving up on mail to %s after %d attempts: %s', recipients, item.attempts, error)
+            return
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** item.attempts))
+        logger.warning('Mail to %s failed, retrying in %.1fs: %s', recipients, delay, error)
+        heapq.heappush(self._retries, (time.monotonic() + delay, next(self._sequence), item))
+
+    def _send_batch(self, batch):
+        for index, item in enumerate(batch):
+            try:
+                self._connect().send(item.message)
+                self._last_used = time.monotonic()
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError) as e:
+                # the connection is gone, try the rest of the batch again later
+                self._close()
+                for pending in batch[index:]:
+                    self._retry(pending, e)
+                return
+            except smtplib.SMTPException as e:
+                self._retry(item, e)
+                if not _permanent(e):
+                    self._close()
+            except Exception:
+                # a message flask-mail refuses (no sender, bad headers) is never going to work
+                logger.exception('Dropping mail to %s.', ', '.join(item.message.send_to))
+
+    # send whatever is queued or waiting for a retry, used at exit and by the shell
+    # waits for a batch the sender is working on
+    def drain(self):
+        with self._sending:
+            batch = [item for _, _, item in self._retries]
+            self._retries = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                with self.app.app_context():
+                    self._send_batch(batch)
+                    self._close()
+        return len(batch)
+
+mail_queue = MailQueue()
+
+@atexit.register
+def _drain_at_exit():
+    if mail_queue.app is not None and mail_queue._worker is not None:
+        mail_queue.drain()
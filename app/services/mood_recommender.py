@@ -0,0 +1,185 @@
+# local mood based book recommendations
+# Every catalog book is scored for every mood from signals already in the database:
+#   - direct book/mood labels (BookMood)
+#   - moods of posts written about the book (PostMood -> Post.book_id)
+#   - moods of readers who bookmarked the book or liked posts about it
+#     (UserMood x UserBook / Likes)
+#   - moods of other books carrying the same tags (BookTag)
+# Each signal is a sparse books x moods matrix. The columns are normalized and
+# blended, and the top books of every mood are precomputed into an .npz file
+# (flask build-mood-recommendations). Requests are answered from the arrays held
+# in memory, the llm is only asked for moods that have no signal yet or while
+# the file hasn't been built.
+import logging
+import os
+import tempfile
+import threading
+from ..schema.models import db, Book, Mood, BookMood, PostMood, Post, UserMood, UserBook, Likes, BookTag
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional, without them every request uses the llm fallback
+    np = None
+    sparse = None
+
+logger = logging.getLogger(__name__)
+
+# relative weight of every signal in the blended score
+SIGNAL_WEIGHTS = {'labels': 1.0, 'posts': 0.6, 'readers': 0.4, 'tags': 0.2}
+
+def _positions(ids, values):
+    positions = np.clip(np.searchsorted(ids, values), 0, max(len(ids) - 1, 0))
+    valid = ids[positions] == values if len(ids) else np.zeros(len(values), dtype=bool)
+    return positions, valid
+
+# sparse matrix from (row id, column id[, weight]) rows, dropping unknown ids and summing duplicates
+def _matrix(rows, row_ids, col_ids):
+    rows = np.array(rows, dtype=np.float64).reshape(-1, 3 if rows and len(rows[0]) == 3 else 2)
+    row_pos, row_ok = _positions(row_ids, rows[:, 0].astype(np.int64))
+    col_pos, col_ok = _positions(col_ids, rows[:, 1].astype(np.int64))
+    keep = row_ok & col_ok
+    data = rows[keep, 2] if rows.shape[1] == 3 else np.ones(int(keep.sum()))
+    return sparse.csr_matrix(
+        (data.astype(np.float32), (row_pos[keep], col_pos[keep])),
+        shape=(len(row_ids), len(col_ids)),
+    )
+
+# dampen heavy hitters and scale every mood column to [0, 1]
+def _normalize(matrix):
+    dense = np.log1p(np.asarray(matrix.todense(), dtype=np.float32))
+    peak = dense.max(axis=0, keepdims=True)
+    peak[peak == 0] = 1
+    return dense / peak
+
+def _unique_ids(*columns):
+    values = [np.array(column, dtype=np.int64) for column in columns if len(column)]
+    return np.unique(np.concatenate(values)) if values else np.array([], dtype=np.int64)
+
+def compute_mood_scores():
+    book_ids = np.array([book_id for (book_id,) in db.session.query(Book.id).order_by(Book.id)], dtype=np.int64)
+    mood_ids = np.array([mood_id for (mood_id,) in db.session.query(Mood.id).order_by(Mood.id)], dtype=np.int64)
+
+    labels = _matrix(db.session.query(BookMood.book_id, BookMood.mood_id).all(), book_ids, mood_ids)
+    posts = _matrix(
+        db.session.query(Post.book_id, PostMood.mood_id).join(Post, Post.id == PostMood.post_id).all(),
+        book_ids, mood_ids
+    )
+
+    # readers: users x moods weighted by strength, users x books from bookmarks and likes
+    user_moods = db.session.query(UserMood.user_id, UserMood.mood_id, db.func.coalesce(UserMood.strength, 1)).all()
+    interactions = db.session.query(UserBook.user_id, UserBook.book_id).all()
+    interactions += db.session.query(Likes.user_id, Post.book_id).join(Post, Post.id == Likes.post_id).all()
+    user_ids = _unique_ids([row[0] for row in user_moods], [row[0] for row in interactions])
+    user_mood = _matrix(user_moods, user_ids, mood_ids)
+    user_book = _matrix(interactions, user_ids, book_ids)
+    readers = user_book.T @ user_mood
+
+    # tags: spread the mood profile of tagged books to the other books with that tag
+    book_tags = db.session.query(BookTag.book_id, BookTag.tag_id).all()
+    tag_ids = _unique_ids([row[1] for row in book_tags])
+    book_tag = _matrix(book_tags, book_ids, tag_ids)
+    tag_mood = book_tag.T @ sparse.csr_matrix(_normalize(labels + posts))
+    tags = book_tag @ tag_mood
+
+    scores = np.zeros((len(book_ids), len(mood_ids)), dtype=np.float32)
+    for name, signal in (('labels', labels), ('posts', posts), ('readers', readers), ('tags', tags)):
+        scores += SIGNAL_WEIGHTS[name] * _normalize(signal)
+    return book_ids, mood_ids, scores
+
+# top k books of every mood, padded with -1 where a mood has fewer scored books
+def top_books(book_ids, scores, top_k):
+    k = min(top_k, len(book_ids))
+    top = np.full((scores.shape[1], top_k), -1, dtype=np.int64)
+    top_scores = np.zeros((scores.shape[1], top_k), dtype=np.float32)
+    if k == 0:
+        return top, top_scores
+    columns = scores.T
+    candidates = np.argpartition(-columns, k - 1, axis=1)[:, :k]
+    candidate_scores = np.take_along_axis(columns, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+    found = candidate_scores > 0
+    top[:, :k] = np.where(found, book_ids[candidates], -1)
+    top_scores[:, :k] = np.where(found, candidate_scores, 0)
+    return top, top_scores
+
+class MoodRecommender:
+    def __init__(self, app=None):
+        self.path = None
+        self.top_k = 50
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._rows = {}
+        self._books = None
+        self._scores = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MOOD_RECOMMENDER_PATH', os.path.join(app.instance_path, 'mood_recommendations.npz'))
+        app.config.setdefault('MOOD_RECOMMENDER_TOP_K', 50)
+        # ask the llm when a mood has no local signal yet
+        app.config.setdefault('MOOD_RECOMMENDER_LLM_FALLBACK', True)
+        self.path = app.config['MOOD_RECOMMENDER_PATH']
+        self.top_k = app.config['MOOD_RECOMMENDER_TOP_K']
+        app.extensions['mood_recommender'] = self
+
+    @property
+    def available(self):
+        return np is not None
+
+    # score the catalog and write the top books of every mood to self.path
+    def build(self):
+        book_ids, mood_ids, scores = compute_mood_scores()
+        top, top_scores = top_books(book_ids, scores, self.top_k)
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, mood_ids=mood_ids, books=top, scores=top_scores)
+        os.replace(tmp_path, self.path)
+        return len(book_ids), len(mood_ids)
+
+    # (re)load the precomputed arrays when the file changed, False while it hasn't been built
+    # building scores the whole catalog, that is left to the cli and never done in a request
+    def _ensure_loaded(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if self._mtime is not False:
+                logger.warning('%s is missing, run flask build-mood-recommendations.', self.path)
+                self._mtime = False
+            return False
+        if mtime == self._mtime:
+            return True
+        with self._lock:
+            if mtime == self._mtime:
+                return True
+            with np.load(self.path) as data:
+                self._rows = {int(mood_id): row for row, mood_id in enumerate(data['mood_ids'])}
+                self._books = data['books']
+                self._scores = data['scores']
+            self._mtime = mtime
+        return True
+
+    # best scored (book_id, score) pairs for the mood, skipping exclude
+    def recommend(self, mood_id, limit=5, exclude=()):
+        if not self.available or not self._ensure_loaded():
+            return []
+        row = self._rows.get(mood_id)
+        if row is None:
+            return []
+        results = []
+        for book_id, score in zip(self._books[row], self._scores[row]):
+            if book_id < 0:
+                break
+            if int(book_id) in exclude:
+                continue
+            results.append((int(book_id), float(score)))
+            if len(results) >= limit:
+                break
+        return results
+
+mood_recommender = MoodRecommender()
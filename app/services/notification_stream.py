@@ -0,0 +1,232 @@
+# real-time notifications over server-sent events
+# The notification writer publishes the ids of the users it wrote notifications
+# for. Every open stream subscribes to its user and, when woken, reads the
+# notifications after the last event it sent, keyed on (created_at, id) like
+# the list cursor. created_at is stamped before the writer commits, so a row
+# committed late can land behind the cursor: every read also goes back over
+# an overlap window (NOTIFICATIONS_STREAM_OVERLAP seconds) and sends the rows
+# in it the stream hasn't sent yet. Coalesced notifications get a new
+# created_at, so they are sent again with the same id and clients replace them.
+# The event id is the cursor, so a client reconnecting with Last-Event-ID gets
+# what it missed, plus possibly the overlap window again, which clients replace.
+# Wake-ups go through an in-process broker, or through any server speaking the
+# Redis protocol (NOTIFICATIONS_BROKER_URL=redis://host:port/db) when several
+# worker processes serve streams.
+# A stream holds its worker for up to NOTIFICATIONS_STREAM_MAX_DURATION seconds,
+# so serve the app with gevent workers (gunicorn -k gevent) or threaded ones
+# (gunicorn --threads 32); with plain sync workers each open tab takes a whole
+# worker. Every process accepts at most NOTIFICATIONS_STREAM_MAX_PER_USER open
+# streams per user.
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from ..schema.models import db, Notification
+from ..utils.pagination import encode_cursor
+from ..utils.response_cache import RedisBackend, CacheError
+
+logger = logging.getLogger(__name__)
+
+class Subscription:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    # True when woken before the timeout
+    # publishers notify after committing, so a query made after this returns sees their rows
+    def wait(self, timeout):
+        woken = self._event.wait(timeout)
+        if woken:
+            self._event.clear()
+        return woken
+
+class NotificationBroker:
+    def __init__(self, app=None):
+        self.redis = None
+        self.channel = 'notifications'
+        self.keepalive = 15
+        self.max_duration = 300
+        self.batch_size = 100
+        self.overlap = timedelta(seconds=5)
+        self.max_per_user = 5
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # user id -> set of Subscription
+        self._listener = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('NOTIFICATIONS_BROKER_URL', 'memory://')
+        app.config.setdefault('NOTIFICATIONS_BROKER_CHANNEL', 'notifications')
+        # seconds between keep-alive comments on an idle stream
+        app.config.setdefault('NOTIFICATIONS_STREAM_KEEPALIVE', 15)
+        # seconds before a stream is closed, the client reconnects with Last-Event-ID
+        app.config.setdefault('NOTIFICATIONS_STREAM_MAX_DURATION', 300)
+        app.config.setdefault('NOTIFICATIONS_STREAM_BATCH_SIZE', 100)
+        # seconds behind the cursor every read goes back over, longer than a notification write
+        app.config.setdefault('NOTIFICATIONS_STREAM_OVERLAP', 5)
+        app.config.setdefault('NOTIFICATIONS_STREAM_MAX_PER_USER', 5)
+
+        url = app.config['NOTIFICATIONS_BROKER_URL']
+        self.redis = RedisBackend(url) if url.startswith('redis://') else None
+        self.channel = app.config['NOTIFICATIONS_BROKER_CHANNEL']
+        self.keepalive = app.config['NOTIFICATIONS_STREAM_KEEPALIVE']
+        self.max_duration = app.config['NOTIFICATIONS_STREAM_MAX_DURATION']
+        self.batch_size = app.config['NOTIFICATIONS_STREAM_BATCH_SIZE']
+        self.overlap = timedelta(seconds=app.config['NOTIFICATIONS_STREAM_OVERLAP'])
+        self.max_per_user = app.config['NOTIFICATIONS_STREAM_MAX_PER_USER']
+        app.extensions['notification_broker'] = self
+
+    # None when the user already has max_per_user streams open in this process
+    def subscribe(self, user_id):
+        if self.redis is not None:
+            self._ensure_listener()
+        subscription = Subscription(user_id)
+        with self._lock:
+            subscriptions = self._subscriptions.setdefault(user_id, set())
+            if len(subscriptions) >= self.max_per_user:
+                return None
+            subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def _dispatch(self, user_ids):
+        with self._lock:
+            subscriptions = [s for user_id in user_ids for s in self._subscriptions.get(user_id, ())]
+        for subscription in subscriptions:
+            subscription.notify()
+
+    # wake the streams of these users, call after committing their notifications
+    def publish(self, *user_ids):
+        user_ids = {int(user_id) for user_id in user_ids if user_id is not None}
+        if not user_ids:
+            return
+        if self.redis is None:
+            self._dispatch(user_ids)
+            return
+        try:
+            self.redis.publish(self.channel, ','.join(str(user_id) for user_id in sorted(user_ids)))
+        except (OSError, CacheError) as e:
+            logger.warning('Publishing notifications failed: %s', e)
+
+    # one subscriber connection per process relays messages to the local streams
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None or self._pid != os.getpid():
+                self._listener = threading.Thread(target=self._listen, name='notification-broker', daemon=True)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def _listen(self):
+        while True:
+            try:
+                for message in self.redis.listen(self.channel):
+                    self._dispatch({int(user_id) for user_id in message.split(b',') if user_id})
+            except (OSError, CacheError, ValueError) as e:
+                logger.warning('Notification broker connection lost: %s', e)
+                # streams may have missed a wake-up while disconnected
+                with self._lock:
+                    user_ids = list(self._subscriptions)
+                self._dispatch(user_ids)
+                time.sleep(1)
+
+notification_broker = NotificationBroker()
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+def _event(name, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id else []
+    lines += [f'event: {name}', f'data: {json.dumps(data, default=_json_default)}']
+    return '\n'.join(lines) + '\n\n'
+
+def notification_to_dict(notification):
+    return {
+        'id': notification.id,
+        'message': notification.message,
+        'created_at': notification.created_at,
+        'is_read': notification.is_read,
+        'actor_count': notification.actor_count,
+    }
+
+# (created_at, id) of the user's newest notification, where a new stream starts
+def latest_cursor(user_id):
+    row = (
+        db.session.query(Notification.created_at, Notification.id)
+        .filter(Notification.user_id == user_id)
+        .order_by(Notification.created_at.desc(), Notification.id.desc())
+        .first()
+    )
+    return (row.created_at, row.id) if row else (None, 0)
+
+"""
+    The user's notifications after cursor, and the ones in the overlap window
+    behind it that aren't in sent (id -> created_at of the events already sent).
+    At most len(sent) of the rows read are skipped, so reading limit + len(sent)
+    rows returns up to limit fresh ones.
+"""
+def _notifications_after(user_id, cursor, sent, limit, overlap):
+    created_at = cursor[0]
+    query = Notification.query.filter(Notification.user_id == user_id)
+    if created_at is not None:
+        query = query.filter(Notification.created_at >= created_at - overlap)
+    rows = query.order_by(Notification.created_at, Notification.id).limit(limit + len(sent)).all()
+    fresh = [row for row in rows if sent.get(row.id) != row.created_at]
+    return fresh[:limit], len(rows) == limit + len(sent)
+
+"""
+    Generate the server-sent events of a subscription's stream, starting after cursor.
+    Sends the notifications written since, then waits for wake-ups from the
+    broker, with keep-alive comments while idle, until max_duration is reached.
+    A new stream (resumed=False) starts from what the user can already see, so
+    the overlap window behind its cursor counts as sent.
+"""
+def event_stream(subscription, cursor, resumed=True):
+    broker = notification_broker
+    user_id = subscription.user_id
+    sent = {}
+    if not resumed and cursor[0] is not None:
+        seen, _ = _notifications_after(user_id, cursor, sent, broker.batch_size, broker.overlap)
+        sent = {row.id: row.created_at for row in seen if (row.created_at, row.id) <= cursor}
+    try:
+        yield 'retry: 3000\n\n'
+        yield _event('ready', {}, encode_cursor(*cursor))
+        deadline = time.monotonic() + broker.max_duration
+        woken = True  # catch up right away on resume
+        while True:
+            while woken:
+                notifications, woken = _notifications_after(user_id, cursor, sent, broker.batch_size, broker.overlap)
+                data = [notification_to_dict(notification) for notification in notifications]
+                # don't hold a connection while idle
+                db.session.close()
+                for notification in data:
+                    sent[notification['id']] = notification['created_at']
+                    # a late row is sent without moving the cursor back
+                    latest = (notification['created_at'], notification['id'])
+                    if cursor[0] is None or latest > cursor:
+                        cursor = latest
+                    yield _event('notification', notification, encode_cursor(*cursor))
+                # rows behind the window are never read again
+                if cursor[0] is not None:
+                    sent = {row_id: created_at for row_id, created_at in sent.items() if created_at >= cursor[0] - broker.overlap}
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            woken = subscription.wait(min(broker.keepalive, remaining))
+            if not woken:
+                yield ': keep-alive\n\n'
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,270 @@
+# asynchronous notification fan-out
+# Likes, comments and follows only emit an event after their own commit. A
+# background worker drains the queue in batches and writes each batch in one
+# transaction:
+#   - a like followed by an unlike in the same batch cancels out, and a like or
+#     follow repeated by the same user within NOTIFICATIONS_DEDUP_WINDOW is
+#     dropped, so like/unlike toggles don't spam the author. Every comment counts.
+#   - events about the same target are coalesced per recipient, and folded into
+#     the recipient's unread notification for that target if there is a recent
+#     one ("alice and 41 others liked your post.")
+#   - new rows go out in one bulk insert, coalesced rows in one update
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import case, insert, update
+from ..schema.models import db, Notification, Users
+from .notification_stream import notification_broker
+from .counters import bump_counters
+
+logger = logging.getLogger(__name__)
+
+LIKE = 'like'
+COMMENT = 'comment'
+FOLLOW = 'follow'
+
+# (one event, several events), likes and follows count actors and comments count comments
+MESSAGES = {
+    LIKE: ('{actor} liked your post.', '{actor} and {others} liked your post.'),
+    COMMENT: ('{actor} commented on your post.', '{count} new comments on your post, the latest from {actor}.'),
+    FOLLOW: ('{actor} is now following you.', '{actor} and {others} are now following you.'),
+}
+
+# doing these twice means the same as once, so repeats are deduplicated
+IDEMPOTENT_KINDS = {LIKE, FOLLOW}
+
+EMIT = 'emit'
+RETRACT = 'retract'
+
+Event = namedtuple('Event', 'action kind recipient_id actor_id target_id')
+
+def render_message(kind, actor, actor_count):
+    single, many = MESSAGES[kind]
+    if actor_count <= 1:
+        return single.format(actor=actor)
+    others = actor_count - 1
+    return many.format(actor=actor, count=actor_count, others=f"{others} other" if others == 1 else f"{others} others")
+
+# jwt identities are strings
+def _id(value):
+    return int(value) if value is not None else None
+
+# notifications about the same kind of action on the same target share a group
+def group_key(kind, target_id=None):
+    return f'{kind}:{target_id}' if target_id is not None else kind
+
+class NotificationPipeline:
+    def __init__(self, app=None):
+        self.app = None
+        self.batch_size = 500
+        self.flush_interval = 0.5
+        self.dedup_window = 600
+        self.coalesce_window = 86400
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+        self._recent = OrderedDict()  # (kind, recipient, actor, target) -> monotonic time of the last emit
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('NOTIFICATIONS_BATCH_SIZE', 500)
+        # seconds the worker waits for more events before writing a batch
+        app.config.setdefault('NOTIFICATIONS_FLUSH_INTERVAL', 0.5)
+        # seconds during which a repeated action by the same user is ignored
+        app.config.setdefault('NOTIFICATIONS_DEDUP_WINDOW', 600)
+        # seconds an unread notification keeps absorbing new actors
+        app.config.setdefault('NOTIFICATIONS_COALESCE_WINDOW', 86400)
+        # write notifications inline in the calling thread, handy for tests and the shell
+        app.config.setdefault('NOTIFICATIONS_EAGER', False)
+        self.app = app
+        self.batch_size = app.config['NOTIFICATIONS_BATCH_SIZE']
+        self.flush_interval = app.config['NOTIFICATIONS_FLUSH_INTERVAL']
+        self.dedup_window = app.config['NOTIFICATIONS_DEDUP_WINDOW']
+        self.coalesce_window = app.config['NOTIFICATIONS_COALESCE_WINDOW']
+        app.extensions['notifications'] = self
+
+    @property
+    def eager(self):
+        return self.app.config['NOTIFICATIONS_EAGER']
+
+    # call after committing the action, e.g. emit(LIKE, post.user_id, user_id, post.id)
+    def emit(self, kind, recipient_id, actor_id, target_id=None):
+        self._put(Event(EMIT, kind, _id(recipient_id), _id(actor_id), target_id))
+
+    # undo an action that may still be waiting in the queue (unlike, unfollow)
+    def retract(self, kind, recipient_id, actor_id, target_id=None):
+        self._put(Event(RETRACT, kind, _id(recipient_id), _id(actor_id), target_id))
+
+    def _put(self, event):
+        if event.recipient_id is None:
+            return
+        if self.eager:
+            self.process([event])
+            return
+        self._ensure_worker()
+        self._queue.put(event)
+
+    # one worker per process, forked workers start their own
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                self._worker = threading.Thread(target=self._work, name='notifications', daemon=True)
+                self._worker.start()
+                self._pid = os.getpid()
+
+    def _next_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._next_batch(self._queue.get())
+            self._process_in_context(batch)
+
+    def _process_in_context(self, batch):
+        with self.app.app_context():
+            try:
+                self.process(batch)
+            except Exception:
+                db.session.rollback()
+                logger.exception('Writing %d notification events failed.', len(batch))
+            finally:
+                db.session.remove()
+
+    # write whatever is still queued, used at exit and by the shell
+    def drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._process_in_context(batch)
+        return len(batch)
+
+    # drop cancelled and recently seen events, returns the remaining ones in order
+    def _dedupe(self, events):
+        now = time.monotonic()
+        pending = OrderedDict()
+        with self._lock:
+            while self._recent and next(iter(self._recent.values())) < now - self.dedup_window:
+                self._recent.popitem(last=False)
+            for position, event in enumerate(events):
+                if event.kind not in IDEMPOTENT_KINDS:
+                    pending[position] = event
+                    continue
+                key = (event.kind, event.recipient_id, event.actor_id, event.target_id)
+                if event.action == RETRACT:
+                    pending.pop(key, None)
+                elif key not in pending and key not in self._recent:
+                    pending[key] = event
+            for key in pending:
+                if isinstance(key, tuple):
+                    self._recent[key] = now
+        return list(pending.values())
+
+    def process(self, events):
+        events = self._dedupe(events)
+        if not events:
+            return 0
+
+        # recipient, group -> (kind, actors in order)
+        groups = OrderedDict()
+        for event in events:
+            key = (event.recipient_id, group_key(event.kind, event.target_id))
+            groups.setdefault(key, (event.kind, []))[1].append(event.actor_id)
+
+        # only the latest actor of every group is named
+        latest_actors = {actors[-1] for _, actors in groups.values()}
+        names = dict(db.session.query(Users.id, Users.username).filter(Users.id.in_(latest_actors)).all())
+
+        now = datetime.utcnow()
+        existing = {}
+        unread = (
+            db.session.query(Notification.id, Notification.user_id, Notification.group_key, Notification.actor_count)
+            .filter(
+                Notification.user_id.in_({recipient for recipient, _ in groups}),
+                Notification.group_key.in_({key for _, key in groups}),
+                Notification.is_read == False,
+                Notification.created_at >= now - timedelta(seconds=self.coalesce_window),
+            )
+            .order_by(Notification.id)
+        )
+        for row in unread:
+            existing[(row.user_id, row.group_key)] = row
+
+        def new_row(recipient_id, key, kind, actors):
+            return {
+                'user_id': recipient_id,
+                'group_key': key,
+                'actor_count': len(actors),
+                'message': render_message(kind, names.get(actors[-1], 'Someone'), len(actors)),
+                'is_read': False,
+                'created_at': now,
+            }
+
+        inserts, coalesced = [], {}
+        for (recipient_id, key), (kind, actors) in groups.items():
+            current = existing.get((recipient_id, key))
+            if current is not None:
+                coalesced[current.id] = (current.actor_count + len(actors), recipient_id, key, kind, actors)
+            else:
+                inserts.append(new_row(recipient_id, key, kind, actors))
+        updated = []
+        if coalesced:
+            counts = {notification_id: item[0] for notification_id, item in coalesced.items()}
+            messages = {
+                notification_id: render_message(kind, names.get(actors[-1], 'Someone'), count)
+                for notification_id, (count, _, _, kind, actors) in coalesced.items()
+            }
+            # only rows still unread absorb the new actors, the unread counter already includes
+            # them. Coalesced rows move back to the top of the list and the streams.
+            updated = db.session.execute(
+                update(Notification)
+                .where(Notification.id.in_(coalesced), Notification.is_read == False)
+                .values(
+                    actor_count=case(counts, value=Notification.id),
+                    message=case(messages, value=Notification.id),
+                    created_at=now,
+                )
+                .returning(Notification.id),
+                execution_options={'synchronize_session': False}
+            ).scalars().all()
+            # a row marked read since it was selected gets a notification of its own
+            still_unread = set(updated)
+            inserts.extend(new_row(*item[1:]) for notification_id, item in coalesced.items() if notification_id not in still_unread)
+        if inserts:
+            db.session.execute(insert(Notification), inserts)
+            unread = {}
+            for row in inserts:
+                unread[row['user_id']] = unread.get(row['user_id'], 0) + 1
+            bump_counters(Users.unread_notifications_count, unread)
+        db.session.commit()
+        # wake the open notification streams of the recipients
+        notification_broker.publish(*{recipient_id for recipient_id, _ in groups})
+        return len(inserts) + len(updated)
+
+notification_pipeline = NotificationPipeline()
+
+@atexit.register
+def _drain_at_exit():
+    if notification_pipeline.app is not None:
+        notification_pipeline.drain()
@@ -0,0 +1,302 @@
+# item-item collaborative filtering, "readers who liked this also liked"
+# Bookmarks (UserBook), likes on posts about a book (Likes -> Post.book_id) and
+# quotes form a sparse users x books matrix. Book columns are L2 normalized and
+# the cosine similarity of every book with the catalog is computed one block of
+# books at a time with sparse products, keeping only the top neighbors of each
+# book in two fixed width arrays (neighbor positions and scores).
+# The full index is precomputed offline (flask build-similar-books) into an .npz
+# file. Routes that add or remove interactions mark the books dirty, and a
+# background worker recomputes only the rows whose similarities can change while
+# reads keep using the current index.
+import logging
+import os
+import tempfile
+import threading
+import time
+from ..schema.models import db, Book, UserBook, Likes, Post, Quote
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional, the endpoints answer 503 without them
+    np = None
+    sparse = None
+
+logger = logging.getLogger(__name__)
+
+# how much each kind of interaction says about a reader's taste
+INTERACTION_WEIGHTS = {'bookmark': 1.0, 'like': 0.5, 'quote': 1.5}
+# neighbors kept per book
+TOP_NEIGHBORS = 50
+# books whose similarities are computed per sparse product
+BLOCK_SIZE = 512
+
+def load_interactions():
+    rows = []
+    queries = (
+        ('bookmark', db.session.query(UserBook.user_id, UserBook.book_id)),
+        ('like', db.session.query(Likes.user_id, Post.book_id).join(Post, Post.id == Likes.post_id)),
+        ('quote', db.session.query(Quote.user_id, Quote.book_id)),
+    )
+    for kind, query in queries:
+        weight = INTERACTION_WEIGHTS[kind]
+        rows.extend((user_id, book_id, weight) for user_id, book_id in query.all() if user_id and book_id)
+    book_ids = np.array([book_id for (book_id,) in db.session.query(Book.id).order_by(Book.id)], dtype=np.int64)
+
+    data = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    user_ids = np.unique(data[:, 0].astype(np.int64))
+    users = np.searchsorted(user_ids, data[:, 0].astype(np.int64))
+    books = np.searchsorted(book_ids, data[:, 1].astype(np.int64))
+    known = books < len(book_ids)
+    known[known] = book_ids[books[known]] == data[known, 1]
+    matrix = sparse.csr_matrix(
+        (data[known, 2].astype(np.float32), (users[known], books[known])),
+        shape=(len(user_ids), len(book_ids)),
+    )
+    # repeated interactions saturate instead of dominating
+    matrix.data = np.log1p(matrix.data)
+    return user_ids, book_ids, matrix
+
+def _normalized_columns(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    norms[norms == 0] = 1
+    return (matrix @ sparse.diags(1 / norms)).tocsc()
+
+# top neighbors of the given book positions as (neighbors, scores) arrays
+def compute_neighbors(matrix, positions, top_n=TOP_NEIGHBORS, block_size=BLOCK_SIZE):
+    normalized = _normalized_columns(matrix)
+    by_book = normalized.T.tocsr()
+    neighbors = np.full((len(positions), top_n), -1, dtype=np.int32)
+    scores = np.zeros((len(positions), top_n), dtype=np.float32)
+    for start in range(0, len(positions), block_size):
+        block = positions[start:start + block_size]
+        similarities = (by_book[block] @ normalized).tocsr()
+        for offset, book in enumerate(block):
+            lo, hi = similarities.indptr[offset], similarities.indptr[offset + 1]
+            columns = similarities.indices[lo:hi]
+            values = similarities.data[lo:hi]
+            keep = (columns != book) & (values > 0)
+            columns, values = columns[keep], values[keep]
+            if len(values) > top_n:
+                best = np.argpartition(-values, top_n - 1)[:top_n]
+                columns, values = columns[best], values[best]
+            order = np.argsort(-values, kind='stable')
+            row = start + offset
+            neighbors[row, :len(order)] = columns[order]
+            scores[row, :len(order)] = values[order]
+    return neighbors, scores
+
+class SimilarBooks:
+    def __init__(self, app=None):
+        self.app = None
+        self.path = None
+        self.top_n = TOP_NEIGHBORS
+        self.refresh_delay = 5.0
+        self._lock = threading.RLock()
+        self._mtime = None
+        # (book_ids, neighbors, scores), replaced as a whole so readers never mix two versions
+        self._index = None
+        self._dirty = set()
+        self._dirty_users = set()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SIMILAR_BOOKS_PATH', os.path.join(app.instance_path, 'similar_books.npz'))
+        app.config.setdefault('SIMILAR_BOOKS_TOP_N', TOP_NEIGHBORS)
+        # seconds the background refresh waits for more changes before reading the interactions
+        app.config.setdefault('SIMILAR_BOOKS_REFRESH_DELAY', 5.0)
+        # refresh inline in the calling thread, handy for tests and the shell
+        app.config.setdefault('SIMILAR_BOOKS_EAGER', False)
+        self.app = app
+        self.path = app.config['SIMILAR_BOOKS_PATH']
+        self.top_n = app.config['SIMILAR_BOOKS_TOP_N']
+        self.refresh_delay = app.config['SIMILAR_BOOKS_REFRESH_DELAY']
+        app.extensions['similar_books'] = self
+
+    @property
+    def available(self):
+        return np is not None
+
+    @property
+    def eager(self):
+        return self.app.config['SIMILAR_BOOKS_EAGER']
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        book_ids, neighbors, scores = self._index
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, book_ids=book_ids, neighbors=neighbors, scores=scores)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime
+
+    # recompute the whole index and write it to self.path
+    def build(self):
+        with self._lock:
+            self._dirty.clear()
+            self._dirty_users.clear()
+            _, book_ids, matrix = load_interactions()
+            neighbors, scores = compute_neighbors(matrix, np.arange(len(book_ids)), self.top_n)
+            self._index = (book_ids, neighbors, scores)
+            self._save()
+            return len(book_ids), matrix.nnz
+
+    def _ensure_loaded(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            with self._lock:
+                if not os.path.exists(self.path):
+                    self.build()
+            mtime = os.stat(self.path).st_mtime
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            with np.load(self.path) as data:
+                self._index = (data['book_ids'], data['neighbors'], data['scores'])
+            self._mtime = mtime
+
+    # call after committing a bookmark, like or quote change of user_id on these books
+    def mark_dirty(self, user_id, *book_ids):
+        if not self.available:
+            return
+        with self._lock:
+            self._dirty.update(int(book_id) for book_id in book_ids if book_id)
+            if user_id is not None:
+                self._dirty_users.add(int(user_id))
+        if self.eager:
+            self.refresh()
+        else:
+            self._ensure_worker()
+            self._wakeup.set()
+
+    # one worker per process, forked workers start their own
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid():
+                self._wakeup = threading.Event()
+                self._worker = threading.Thread(target=self._work, name='similar-books', daemon=True)
+                self._worker.start()
+                self._pid = os.getpid()
+
+    def _work(self):
+        while True:
+            self._wakeup.wait()
+            # let a burst of likes and bookmarks land in one refresh
+            time.sleep(self.refresh_delay)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception('Refreshing the similar books index failed.')
+                finally:
+                    db.session.remove()
+
+    # resize an index to a new catalog, keeping the rows of books that still exist
+    # returns the new index and the positions of the books it did not have
+    def _remap(self, book_ids):
+        old_ids, old_neighbors, old_scores = self._index
+        mapping = np.full(len(old_ids) + 1, -1, dtype=np.int32)  # last slot maps the -1 padding
+        positions = np.searchsorted(book_ids, old_ids)
+        exists = positions < len(book_ids)
+        exists[exists] = book_ids[positions[exists]] == old_ids[exists]
+        mapping[:-1][exists] = positions[exists]
+
+        neighbors = np.full((len(book_ids), self.top_n), -1, dtype=np.int32)
+        scores = np.zeros((len(book_ids), self.top_n), dtype=np.float32)
+        neighbors[positions[exists]] = mapping[old_neighbors[exists]]
+        scores[positions[exists]] = old_scores[exists]
+        return neighbors, scores, np.flatnonzero(~np.isin(book_ids, old_ids))
+
+    """
+        Recompute only the rows whose similarities the dirty books can change.
+        A change to book A changes its column, so its cosine with every book
+        that shares a reader with A changes. Those readers are the ones A has
+        now plus the users who just changed their interaction with it, a reader
+        who removed A no longer shows up in its column but the books they share
+        with A still have to drop it.
+    """
+    def refresh(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._ensure_loaded()
+            dirty, self._dirty = self._dirty, set()
+            dirty_users, self._dirty_users = self._dirty_users, set()
+            user_ids, book_ids, matrix = load_interactions()
+            neighbors, scores, new_rows = self._remap(book_ids)
+
+            dirty_positions = np.flatnonzero(np.isin(book_ids, np.array(sorted(dirty), dtype=np.int64)))
+            readers = np.union1d(
+                matrix.tocsc()[:, dirty_positions].indices,
+                np.flatnonzero(np.isin(user_ids, np.array(sorted(dirty_users), dtype=np.int64))),
+            ).astype(np.int64)
+            affected = np.unique(np.concatenate([
+                dirty_positions, new_rows, matrix[readers].indices if len(readers) else np.array([], dtype=np.int32)
+            ])).astype(np.int64)
+            if len(affected):
+                neighbors[affected], scores[affected] = compute_neighbors(matrix, affected, self.top_n)
+            self._index = (book_ids, neighbors, scores)
+            self._save()
+
+    # most similar (book_id, score) pairs for a book
+    def similar(self, book_id, limit=10):
+        self._ensure_loaded()
+        book_ids, neighbors, scores = self._index
+        position = np.searchsorted(book_ids, book_id)
+        if position >= len(book_ids) or book_ids[position] != book_id:
+            return []
+        results = []
+        for neighbor, score in zip(neighbors[position], scores[position]):
+            if neighbor < 0:
+                continue
+            results.append((int(book_ids[neighbor]), float(score)))
+            if len(results) >= limit:
+                break
+        return results
+
+    # books similar to what a reader already interacted with, weighted by those interactions
+    def for_books(self, weights, limit=10, exclude=()):
+        self._ensure_loaded()
+        book_ids, all_neighbors, all_scores = self._index
+        seeds = np.array(list(weights), dtype=np.int64)
+        positions = np.searchsorted(book_ids, seeds)
+        known = positions < len(book_ids)
+        known[known] = book_ids[positions[known]] == seeds[known]
+        if not known.any():
+            return []
+        seed_weights = np.array([weights[int(book_id)] for book_id in seeds[known]], dtype=np.float32)
+
+        neighbors = all_neighbors[positions[known]]
+        contributions = all_scores[positions[known]] * seed_weights[:, None]
+        valid = neighbors >= 0
+        totals = np.zeros(len(book_ids), dtype=np.float32)
+        np.add.at(totals, neighbors[valid], contributions[valid])
+
+        totals[np.isin(book_ids, np.array(list(set(exclude) | set(weights)), dtype=np.int64))] = 0
+        candidates = np.flatnonzero(totals)
+        best = candidates[np.argsort(-totals[candidates], kind='stable')[:limit]]
+        return [(int(book_ids[position]), float(totals[position])) for position in best]
+
+similar_books = SimilarBooks()
+
+# interaction weights of one reader, the seeds of their personal recommendations
+def user_book_weights(user_id):
+    weights = {}
+    for kind, query in (
+        ('bookmark', db.session.query(UserBook.book_id).filter(UserBook.user_id == user_id)),
+        ('like', db.session.query(Post.book_id).join(Likes, Likes.post_id == Post.id).filter(Likes.user_id == user_id)),
+        ('quote', db.session.query(Quote.book_id).filter(Quote.user_id == user_id)),
+    ):
+        for (book_id,) in query.all():
+            if book_id:
+                weights[book_id] = weights.get(book_id, 0) + INTERACTION_WEIGHTS[kind]
+    return weights
@@ -0,0 +1,302 @@
+# typo-tolerant autocomplete over book titles, authors, tag names and usernames
+# Every entry is indexed under its full text and under the start of each word in a
+# sorted key array, so a prefix lookup is a binary search plus a short scan. When
+# that does not fill the page the query words are corrected against a trigram index
+# of the indexed vocabulary and the prefix lookup is repeated with the corrections.
+# Entries are added and removed incrementally by the routes.
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from ..schema.models import db, Book, Tag, Users
+
+BOOK = 'book'
+AUTHOR = 'author'
+TAG = 'tag'
+USER = 'user'
+KINDS = (BOOK, AUTHOR, TAG, USER)
+
+# only look at this many prefix keys per lookup
+MAX_PREFIX_SCAN = 200
+# share of a query word's trigrams a candidate correction must contain
+MIN_TRIGRAM_SHARE = 0.3
+# candidates checked with the edit distance per corrected word
+MAX_SHORTLIST = 24
+# upper bound on trigram postings read per corrected word
+MAX_POSTINGS_SCANNED = 4000
+# corrections tried for the word being typed
+MAX_CORRECTIONS = 3
+
+STOPWORDS = {'a', 'an', 'and', 'the', 'of', 'to', 'in', 'on', 'for', 'by', 'with'}
+
+def normalize(value):
+    return ' '.join(re.findall(r'\w+', (value or '').lower()))
+
+# the word being typed is not padded at the end so it matches longer words
+def trigrams(word, partial=False):
+    padded = f'  {word}' if partial else f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# 0, 1 or 2 for "two or more", without building the distance matrix
+def _one_edit(a, b):
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > 1:
+        return 2
+    i = 0
+    size = min(len(a), len(b))
+    while i < size and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return 1 if a[i + 1:] == b[i + 1:] else 2
+    if len(a) > len(b):
+        return 1 if a[i + 1:] == b[i:] else 2
+    return 1 if a[i:] == b[i + 1:] else 2
+
+# levenshtein distance, with partial=True the distance to the closest prefix of
+# candidate; returns limit + 1 as soon as the distance is known to exceed limit
+def edit_distance(word, candidate, partial=False, limit=2):
+    if limit == 1:
+        if not partial:
+            return _one_edit(word, candidate)
+        size = len(word)
+        return min((_one_edit(word, candidate[:k]) for k in (size - 1, size, size + 1) if k <= len(candidate)), default=2)
+    if partial:
+        candidate = candidate[:len(word) + limit]
+    elif abs(len(word) - len(candidate)) > limit:
+        return limit + 1
+    previous = list(range(len(candidate) + 1))
+    for i, char in enumerate(word, 1):
+        current = [i]
+        for j, other in enumerate(candidate, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous) if partial else previous[-1]
+
+class SuggestIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.built = False
+        self._reset()
+
+    def _reset(self):
+        self._entries = []  # entry id -> (kind, ref, text)
+        self._by_ref = {}  # (kind, ref) -> entry id
+        self._refcount = Counter()  # several books can share an author
+        self._deleted = set()
+        self._keys = []  # sorted normalized keys
+        self._key_ids = array('I')  # entry id of every key
+        self._words = []  # vocabulary used for corrections
+        self._word_ids = {}
+        self._word_grams = {}  # trigram -> array of word ids
+
+    def __len__(self):
+        return len(self._entries) - len(self._deleted)
+
+    def _add_word(self, word):
+        if word in self._word_ids:
+            return
+        word_id = len(self._words)
+        self._words.append(word)
+        self._word_ids[word] = word_id
+        for gram in trigrams(word):
+            postings = self._word_grams.get(gram)
+            if postings is None:
+                postings = self._word_grams[gram] = array('I')
+            postings.append(word_id)
+
+    def _add(self, kind, ref, text, sort_keys=True):
+        normalized = normalize(text)
+        if not normalized:
+            return
+        if (kind, ref) in self._by_ref:
+            entry_id = self._by_ref[(kind, ref)]
+            if self._entries[entry_id][2] == text:
+                self._refcount[entry_id] += 1
+                return
+            self._remove(kind, ref, force=True)
+
+        entry_id = len(self._entries)
+        self._entries.append((kind, ref, text))
+        self._by_ref[(kind, ref)] = entry_id
+        self._refcount[entry_id] = 1
+
+        words = normalized.split(' ')
+        keys = {normalized}
+        keys.update(' '.join(words[i:]) for i in range(1, len(words)) if words[i] not in STOPWORDS)
+        for key in keys:
+            if sort_keys:
+                position = bisect_left(self._keys, key)
+                self._keys.insert(position, key)
+                self._key_ids.insert(position, entry_id)
+            else:
+                self._keys.append(key)
+                self._key_ids.append(entry_id)
+        for word in words:
+            self._add_word(word)
+
+    def _remove(self, kind, ref, force=False):
+        entry_id = self._by_ref.get((kind, ref))
+        if entry_id is None:
+            return
+        self._refcount[entry_id] -= 1
+        if force or self._refcount[entry_id] <= 0:
+            # tombstone, the keys are dropped on the next rebuild
+            del self._by_ref[(kind, ref)]
+            del self._refcount[entry_id]
+            self._deleted.add(entry_id)
+
+    def build(self, entries):
+        with self._lock:
+            self._reset()
+            for kind, ref, text in entries:
+                self._add(kind, ref, text, sort_keys=False)
+            order = sorted(range(len(self._keys)), key=self._keys.__getitem__)
+            self._keys = [self._keys[i] for i in order]
+            self._key_ids = array('I', (self._key_ids[i] for i in order))
+            self.built = True
+
+    def add(self, kind, ref, text):
+        with self._lock:
+            self._add(kind, ref, text)
+
+    def remove(self, kind, ref):
+        with self._lock:
+            self._remove(kind, ref)
+
+    def _live(self):
+        return [
+            (kind, ref, text)
+            for entry_id, (kind, ref, text) in enumerate(self._entries)
+            if entry_id not in self._deleted
+            for _ in range(self._refcount[entry_id])
+        ]
+
+    # rebuild from the live entries once too many tombstones pile up
+    def compact(self):
+        with self._lock:
+            if len(self._deleted) > max(1000, len(self._entries) // 5):
+                self.build(self._live())
+
+    def _prefix_matches(self, prefix, kinds, limit, seen, results):
+        position = bisect_left(self._keys, prefix)
+        stop = min(position + MAX_PREFIX_SCAN, len(self._keys))
+        while position < stop and len(results) < limit:
+            if not self._keys[position].startswith(prefix):
+                break
+            entry_id = self._key_ids[position]
+            position += 1
+            if entry_id in seen or entry_id in self._deleted:
+                continue
+            kind, ref, text = self._entries[entry_id]
+            if kind not in kinds:
+                continue
+            seen.add(entry_id)
+            results.append({'type': kind, 'id': ref if kind != AUTHOR else None, 'text': text})
+
+    # vocabulary words within a small edit distance of word, best first
+    def _corrections(self, word, partial, count):
+        if word in self._word_ids and not partial:
+            return [word]
+        grams = trigrams(word, partial)
+        # count the rarest trigrams first and stop at the budget so common
+        # trigrams cannot blow up the latency on a large vocabulary
+        postings = sorted((self._word_grams.get(gram, ()) for gram in grams), key=len)
+        shared = Counter()
+        counted = 0
+        scanned = 0
+        for word_ids in postings:
+            if counted >= 2 and scanned + len(word_ids) > MAX_POSTINGS_SCANNED:
+                break
+            shared.update(word_ids)
+            counted += 1
+            scanned += len(word_ids)
+        needed = MIN_TRIGRAM_SHARE * counted
+
+        max_distance = 1 if len(word) < 8 else 2
+        scored = []
+        for word_id, hits in shared.most_common(MAX_SHORTLIST):
+            if hits < needed:
+                break
+            candidate = self._words[word_id]
+            distance = edit_distance(word, candidate, partial, max_distance)
+            if distance <= max_distance:
+                scored.append((distance, -hits, len(candidate), candidate))
+        scored.sort()
+        return [candidate for *_, candidate in scored[:count]]
+
+    def suggest(self, query, limit=10, kinds=None):
+        normalized = normalize(query)
+        if not normalized:
+            return []
+        kinds = set(kinds or KINDS)
+        results = []
+        seen = set()
+
+        with self._lock:
+            self._prefix_matches(normalized, kinds, limit, seen, results)
+            if len(results) >= limit or len(normalized) < 3:
+                return results
+
+            # retry with misspelled words replaced by their closest vocabulary words
+            words = normalized.split(' ')
+            head = []
+            for word in words[:-1]:
+                corrected = self._corrections(word, False, 1)
+                head.append(corrected[0] if corrected else word)
+            for last in self._corrections(words[-1], True, MAX_CORRECTIONS):
+                corrected_query = ' '.join(head + [last])
+                if corrected_query != normalized:
+                    self._prefix_matches(corrected_query, kinds, limit, seen, results)
+                if len(results) >= limit:
+                    break
+        return results
+
+_index = SuggestIndex()
+
+def _entries_from_db():
+    for book_id, title, author in db.session.query(Book.id, Book.title, Book.author).all():
+        yield BOOK, book_id, title
+        yield AUTHOR, normalize(author), author
+    for tag_id, name in db.session.query(Tag.id, Tag.name).all():
+        yield TAG, tag_id, name
+    for user_id, username in db.session.query(Users.id, Users.username).all():
+        yield USER, user_id, username
+
+# public api
+
+def suggest(query, limit=10, kinds=None):
+    if not _index.built:
+        _index.build(_entries_from_db())
+    return _index.suggest(query, limit=limit, kinds=kinds)
+
+def rebuild():
+    _index.build(_entries_from_db())
+
+def add_book(book):
+    if _index.built:
+        _index.add(BOOK, book.id, book.title)
+        _index.add(AUTHOR, normalize(book.author), book.author)
+
+# takes the id and author the book was indexed with, call it after the commit
+def remove_book(book_id, author):
+    if _index.built:
+        _index.remove(BOOK, book_id)
+        _index.remove(AUTHOR, normalize(author))
+        _index.compact()
+
+def add_tag(tag):
+    if _index.built:
+        _index.add(TAG, tag.id, tag.name)
+
+def remove_tag(tag):
+    if _index.built:
+        _index.remove(TAG, tag.id)
+        _index.compact()
+
+def add_user(user):
+    if _index.built:
+        _index.add(USER, user.id, user.username)
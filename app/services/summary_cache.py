@@ -0,0 +1,123 @@
+# content-addressed cache for LLM summaries
+# Summaries are keyed on the hash of the text sent to the model together with the
+# model name, prompt version and token limit, so every user summarizing the same
+# book shares one completion. Concurrent requests for the same key wait on the
+# first one instead of calling the model again.
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from time import monotonic
+from ..schema.models import Summary
+
+def make_cache_key(text, model, prompt_version, max_tokens):
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    return f'{model}:v{prompt_version}:{max_tokens}:{digest}'
+
+class SummaryCache:
+    def __init__(self, app=None):
+        self.max_entries = 1024
+        self.ttl = 7 * 24 * 3600
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'db_hits': 0, 'misses': 0, 'inflight_joins': 0, 'evictions': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SUMMARY_CACHE_MAX_ENTRIES', 1024)
+        app.config.setdefault('SUMMARY_CACHE_TTL', 7 * 24 * 3600)
+        self.max_entries = app.config['SUMMARY_CACHE_MAX_ENTRIES']
+        self.ttl = app.config['SUMMARY_CACHE_TTL']
+        app.extensions['summary_cache'] = self
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['inflight'] = len(self._inflight)
+        # every lookup that did not reach the model counts as a hit
+        served = stats['hits'] + stats['db_hits'] + stats['inflight_joins']
+        lookups = served + stats['misses']
+        stats['hit_ratio'] = round(served / lookups, 4) if lookups else None
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # must be called with the lock held
+    def _get_local(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, text = entry
+        if expires_at < monotonic():
+            del self._entries[key]
+            self._stats['evictions'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return text
+
+    def _store(self, key, text):
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    # reuse a summary another user already paid for
+    def _load_from_db(self, key):
+        oldest = datetime.utcnow() - timedelta(seconds=self.ttl)
+        summary = (
+            Summary.query
+            .filter(Summary.cache_key == key, Summary.created_at >= oldest)
+            .order_by(Summary.created_at.desc())
+            .first()
+        )
+        return summary.summary_text if summary else None
+
+    # return the cached summary for key, calling compute() at most once per key
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            text = self._get_local(key)
+            if text is not None:
+                self._stats['hits'] += 1
+                return text
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self._stats['inflight_joins'] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            text = self._load_from_db(key)
+            if text is not None:
+                self._count('db_hits')
+            else:
+                self._count('misses')
+                text = compute()
+            if text:
+                self._store(key, text)
+            future.set_result(text)
+            return text
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+summary_cache = SummaryCache()
@@ -0,0 +1,155 @@
+# background job queue for book summarization
+# The summary_jobs table is the queue. The POST route only inserts a row; a thread
+# pool picks the job up, hands the CPU heavy PDF parsing to a process pool and waits
+# on the LLM call outside the request.
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from sqlalchemy import update
+from ..schema.models import db, SummaryJob, Summary, Book
+from ..utils.downloads import download_or_get_local_file
+from ..utils.get_text_from_pdf import extract_text_content
+from ..utils.text_store import text_store
+from ..utils.response_cache import response_cache
+from . import get_summary
+from .summary_cache import summary_cache, make_cache_key
+from .chunked_summary import summarize_long_text, CHUNK_TOKENS, MAX_BOOK_TOKENS
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+class SummaryJobQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self._threads = None
+        self._processes = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SUMMARY_THREAD_WORKERS', 4)
+        app.config.setdefault('SUMMARY_PROCESS_WORKERS', 2)
+        # run jobs inline in the calling thread, handy for tests and the shell
+        app.config.setdefault('SUMMARY_JOBS_EAGER', False)
+        self.app = app
+        app.extensions['summary_jobs'] = self
+
+    @property
+    def eager(self):
+        return self.app.config['SUMMARY_JOBS_EAGER']
+
+    def _thread_pool(self):
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(
+                max_workers=self.app.config['SUMMARY_THREAD_WORKERS'],
+                thread_name_prefix='summary-job'
+            )
+        return self._threads
+
+    def _process_pool(self):
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(max_workers=self.app.config['SUMMARY_PROCESS_WORKERS'])
+        return self._processes
+
+    # create a queued job and hand it to the workers, returns the job row
+    def enqueue(self, user_id, book_id):
+        job = SummaryJob(user_id=user_id, book_id=book_id, status=QUEUED)
+        db.session.add(job)
+        db.session.commit()
+        self.submit(job.id)
+        return job
+
+    def submit(self, job_id):
+        if self.eager:
+            self.run(job_id)
+        else:
+            self._thread_pool().submit(self._run_in_context, job_id)
+
+    def _run_in_context(self, job_id):
+        with self.app.app_context():
+            try:
+                self.run(job_id)
+            finally:
+                db.session.remove()
+
+    # pick up every job still queued, e.g. after a restart
+    def drain(self):
+        job_ids = [job_id for (job_id,) in db.session.query(SummaryJob.id).filter_by(status=QUEUED).all()]
+        for job_id in job_ids:
+            self.run(job_id)
+        return len(job_ids)
+
+    # claim the job atomically so two workers never run the same one
+    def _claim(self, job_id):
+        result = db.session.execute(
+            update(SummaryJob)
+            .where(SummaryJob.id == job_id, SummaryJob.status == QUEUED)
+            .values(status=RUNNING, progress=5),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _set_progress(self, job, progress):
+        job.progress = progress
+        db.session.commit()
+
+    # pages are streamed until the token budget is met, page ranges run on the process pool
+    # and the result is kept in the text store so the same file is only parsed once
+    def _extract_text(self, file_path):
+        executor = None if self.eager else self._process_pool()
+        return text_store.get_or_extract(
+            file_path,
+            lambda path: extract_text_content(path, max_tokens=MAX_BOOK_TOKENS, executor=executor),
+            max_tokens=MAX_BOOK_TOKENS
+        )
+
+    def run(self, job_id):
+        if not self._claim(job_id):
+            return
+        job = db.session.get(SummaryJob, job_id)
+        try:
+            book = db.session.get(Book, job.book_id)
+            if not book:
+                raise LookupError('Book not found.')
+
+            file_path = download_or_get_local_file(book.file_url)
+            self._set_progress(job, 20)
+
+            text_content = self._extract_text(file_path)
+            self._set_progress(job, 50)
+
+            if not text_content or not text_content.strip():
+                raise ValueError('No text could be extracted from the book.')
+
+            # the whole book is summarized chunk by chunk and the usage is kept on the job
+            def summarize_book():
+                summary_text, usage = summarize_long_text(text_content)
+                job.chunks = usage.chunks
+                job.llm_calls = usage.calls
+                job.prompt_tokens = usage.prompt_tokens
+                job.completion_tokens = usage.completion_tokens
+                job.elapsed_seconds = round(usage.elapsed_seconds, 3)
+                return summary_text
+
+            # identical text, model and prompt share a single completion
+            cache_key = make_cache_key(text_content, get_summary.MODEL, get_summary.PROMPT_VERSION, CHUNK_TOKENS)
+            summary_text = summary_cache.get_or_compute(cache_key, summarize_book)
+            if not summary_text or summary_text == '':
+                raise ValueError('Summary is empty.')
+
+            summary = Summary(user_id=job.user_id, book_id=book.id, summary_text=summary_text, cache_key=cache_key)
+            db.session.add(summary)
+            db.session.flush()
+            job.summary_id = summary.id
+            job.status = DONE
+            job.progress = 100
+            db.session.commit()
+            response_cache.invalidate(f'summaries:{book.id}')
+        except Exception as e:
+            db.session.rollback()
+            job.status = FAILED
+            job.error = str(e)
+            db.session.commit()
+
+summary_jobs = SummaryJobQueue()
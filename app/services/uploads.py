@@ -0,0 +1,145 @@
+# content addressed, deduplicated uploads
+# Uploaded files are streamed to a temp file while the form is parsed and hashed
+# chunk by chunk on the way, so the sha256 is known without reading the file
+# again. Each distinct content is stored once, under files/<sha256>.<ext> or
+# images/<sha256>.<ext>, and a stored_files row counts the references to it.
+# Releasing references happens in the caller's transaction, collect_garbage()
+# then deletes the rows left without references together with their objects.
+# Both steps lock the row, so an upload of the same bytes racing a collection
+# either keeps the row alive or stores the object again.
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+from collections import Counter
+from flask import Request
+from sqlalchemy import update, delete, bindparam
+from ..schema.models import db, StoredFile
+from ..utils.bulk import insert_ignore
+from ..utils.storage import upload_storage, StorageError
+from .image_pipeline import image_pipeline
+
+logger = logging.getLogger(__name__)
+
+# uploads being received, on the same filesystem as the local storage so they can be renamed into place
+UPLOAD_TMP_FOLDER = os.path.join('tmp', 'uploads')
+
+# the sha256 in the url of a stored upload
+HASHED_URL = re.compile(r'/([0-9a-f]{64})\.\w+$')
+
+# a temp file computing the sha256 of everything written to it
+class HashingFile:
+    def __init__(self, folder=UPLOAD_TMP_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(dir=folder, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    # the file is gone unless the storage took it
+    def close(self):
+        self._file.close()
+        try:
+            os.remove(self.name)
+        except FileNotFoundError:
+            pass
+
+# request class writing every uploaded file straight to a HashingFile
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFile()
+
+# the HashingFile behind an uploaded file, copying it into one if it was parsed elsewhere
+def hashed_upload(file):
+    if isinstance(file.stream, HashingFile):
+        upload = file.stream
+    else:
+        upload = HashingFile()
+        shutil.copyfileobj(file.stream, upload)
+        # later calls get the copy, the original stream is used up
+        file.stream = upload
+    upload.flush()
+    upload.seek(0)
+    return upload
+
+# take a reference on the content, returns its storage key
+# key is used when the content is new, existing content keeps the key it was stored under
+def acquire_upload(sha256, key, size):
+    insert_ignore(StoredFile, [{'sha256': sha256, 'key': key, 'size': size, 'ref_count': 0}], ['sha256'])
+    return db.session.execute(
+        update(StoredFile)
+        .where(StoredFile.sha256 == sha256)
+        .values(ref_count=StoredFile.ref_count + 1)
+        .returning(StoredFile.key)
+    ).scalar_one()
+
+# store an uploaded file under folder/<sha256>.<extension> unless the same bytes are stored already, returns its url
+def store_upload(file, folder, extension):
+    upload = hashed_upload(file)
+    sha256 = upload.hexdigest()
+    key = acquire_upload(sha256, f'{folder}/{sha256}.{extension}', upload.size)
+    if not upload_storage.exists(key):
+        upload_storage.save(key, upload.name, content_type=file.mimetype, sha256=sha256)
+    return upload_storage.url(key)
+
+def upload_hash(url):
+    match = HASHED_URL.search(url or '')
+    return match.group(1) if match else None
+
+"""
+    Drop one reference for every url, in the caller's transaction. Urls of
+    uploads made before content addressing are ignored. Returns the hashes to
+    pass to collect_garbage() once the transaction is committed.
+"""
+def release_uploads(*urls):
+    released = Counter(sha256 for sha256 in map(upload_hash, urls) if sha256)
+    if released:
+        db.session.connection().execute(
+            update(StoredFile)
+            .where(StoredFile.sha256 == bindparam('file_hash'))
+            .values(ref_count=StoredFile.ref_count - bindparam('released')),
+            [{'file_hash': sha256, 'released': count} for sha256, count in released.items()]
+        )
+    return list(released)
+
+# the objects stored for one row, images come with their resized variants
+def _object_keys(sha256, key):
+    if key.startswith('images/'):
+        return [key] + image_pipeline.variant_keys(sha256)
+    return [key]
+
+"""
+    Delete the unreferenced uploads among sha256s, or all of them, and their
+    objects. Commits, returns the number of uploads deleted. When the storage
+    fails the rows are kept and the next collection tries again.
+"""
+def collect_garbage(sha256s=None):
+    statement = delete(StoredFile).where(StoredFile.ref_count <= 0)
+    if sha256s is not None:
+        if not sha256s:
+            return 0
+        statement = statement.where(StoredFile.sha256.in_(sha256s))
+    rows = db.session.execute(statement.returning(StoredFile.sha256, StoredFile.key)).all()
+    try:
+        for sha256, key in rows:
+            for object_key in _object_keys(sha256, key):
+                upload_storage.delete(object_key)
+    except StorageError as e:
+        db.session.rollback()
+        logger.warning('Deleting unreferenced uploads failed: %s', e)
+        return 0
+    db.session.commit()
+    return len(rows)
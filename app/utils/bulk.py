@@ -0,0 +1,34 @@
+# idempotent bulk inserts
+# INSERT ... ON CONFLICT DO NOTHING on PostgreSQL and SQLite, INSERT IGNORE on
+# MySQL. All rows go out in one statement and rows that would violate a unique
+# constraint are skipped by the database instead of being looked up first, so
+# concurrent requests inserting the same rows can't fail each other.
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from ..schema.models import db
+
+def _insert_ignore_statement(model, conflict_columns):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing(index_elements=conflict_columns)
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing(index_elements=conflict_columns)
+    if dialect in ('mysql', 'mariadb'):
+        return insert(model).prefix_with('IGNORE')
+    raise NotImplementedError(f'insert_ignore does not support {dialect}.')
+
+"""
+    Insert rows (a list of dicts) into model's table, skipping the rows that
+    conflict on the unique conflict_columns, e.g.
+    insert_ignore(UserRecommendation, rows, ['user_id', 'book_id']).
+    With returning columns the values of the rows actually inserted are returned
+    (PostgreSQL and SQLite only).
+"""
+def insert_ignore(model, rows, conflict_columns, returning=None):
+    if not rows:
+        return []
+    statement = _insert_ignore_statement(model, conflict_columns)
+    if returning:
+        return db.session.execute(statement.returning(*returning, sort_by_parameter_order=True), rows).all()
+    db.session.execute(statement, rows)
+    return []
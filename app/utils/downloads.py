@@ -1,7 +1,37 @@
+import hashlib
+import json
 import os
+import tempfile
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlparse
 
+# downloaded files are cached here under the sha256 of their url
+DOWNLOAD_DIR = os.path.join('tmp', 'downloads')
+# refuse anything bigger than this
+MAX_DOWNLOAD_BYTES = 200 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# (connect, read) timeouts in seconds
+TIMEOUT = (5, 30)
+# superseded bodies are deleted once they are this old
+STALE_BODY_SECONDS = 3600
+
+class DownloadError(Exception):
+    pass
+
+def _make_session():
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=('GET',))
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# one pooled session shared by every download so connections are reused
+session = _make_session()
+
 def is_localhost_url(url):
     return url.startswith("http://127.0.0.1") or url.startswith("http://localhost")
 
@@ -11,7 +41,100 @@ def get_local_path_from_url(url, static_folder='static'):
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))  # root dir
     return os.path.join(base_dir, local_path.lstrip('/'))
 
-def download_or_get_local_file(url, save_as="tmp/downloaded.pdf"):
+# a cache entry is a body file plus a json file naming it together with its validators
+# bodies get a unique name, so replacing the json swaps the body and its ETag in one step
+def _meta_path(url, download_dir):
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return key, os.path.join(download_dir, f'{key}.json')
+
+# the cached body and its validators, or None when nothing usable is cached
+def _read_entry(meta_path, download_dir):
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None, {}
+    body_path = os.path.join(download_dir, os.path.basename(meta.get('body') or ''))
+    if not meta.get('body') or not os.path.exists(body_path):
+        return None, {}
+    return body_path, meta
+
+def _write_meta(meta_path, meta, download_dir):
+    fd, tmp_path = tempfile.mkstemp(dir=download_dir, suffix='.json.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+# remove bodies of the key that no entry points at any more
+# recent ones are kept, a concurrent download may have just returned them
+def _remove_stale_bodies(key, current_path, download_dir):
+    for name in os.listdir(download_dir):
+        path = os.path.join(download_dir, name)
+        if not name.startswith(key + '-') or not name.endswith('.bin') or path == current_path:
+            continue
+        try:
+            if time.time() - os.path.getmtime(path) > STALE_BODY_SECONDS:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+"""
+    Download url into the local cache and return the cached path.
+    The body is streamed into a unique file and published together with its
+    ETag / Last-Modified by replacing the entry's json atomically, so
+    concurrent downloads of the same url never pair one's validators with the
+    other's body. A cached copy is revalidated and reused on 304.
+"""
+def download_file(url, download_dir=DOWNLOAD_DIR, max_bytes=MAX_DOWNLOAD_BYTES, timeout=TIMEOUT):
+    os.makedirs(download_dir, exist_ok=True)
+    key, meta_path = _meta_path(url, download_dir)
+
+    headers = {}
+    cached_path, meta = _read_entry(meta_path, download_dir)
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = session.get(url, headers=headers, stream=True, timeout=timeout)
+    except requests.RequestException as e:
+        raise DownloadError(f"Failed to download file. {e}")
+
+    with response:
+        if response.status_code == 304 and cached_path and os.path.exists(cached_path):
+            return cached_path
+        if response.status_code != 200:
+            raise DownloadError(f"Failed to download file. Status: {response.status_code}")
+
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise DownloadError(f"File is too large to download ({content_length} bytes).")
+
+        fd, body_path = tempfile.mkstemp(dir=download_dir, prefix=key + '-', suffix='.bin')
+        try:
+            received = 0
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise DownloadError(f"File is too large to download (over {max_bytes} bytes).")
+                    f.write(chunk)
+            _write_meta(meta_path, {
+                'url': url,
+                'body': os.path.basename(body_path),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }, download_dir)
+        except BaseException:
+            if os.path.exists(body_path):
+                os.remove(body_path)
+            raise
+
+    _remove_stale_bodies(key, body_path, download_dir)
+    return body_path
+
+def download_or_get_local_file(url):
     if is_localhost_url(url):
         local_path = get_local_path_from_url(url)
         if os.path.exists(local_path):
@@ -19,11 +142,4 @@ def download_or_get_local_file(url, save_as="tmp/downloaded.pdf"):
         else:
             raise FileNotFoundError(f"Local file not found: {local_path}")
     else:
-        response = requests.get(url)
-        if response.status_code == 200:
-            os.makedirs(os.path.dirname(save_as), exist_ok=True)
-            with open(save_as, "wb") as f:
-                f.write(response.content)
-            return save_as
-        else:
-            raise Exception(f"Failed to download file. Status: {response.status_code}")
+        return download_file(url)
@@ -0,0 +1,124 @@
+# serving uploaded books and images from the local storage
+# Uploads never change: content addressed files are named after their sha256
+# and older ones after a random uuid. They are served with immutable cache
+# headers, conditional requests get a 304 and a single byte range gets a 206,
+# so a PDF reader can fetch page 300 of a large book without the rest.
+# The body goes through the server's wsgi.file_wrapper positioned at the start
+# of the range, which gunicorn sends with os.sendfile() without copying it
+# through Python. Behind nginx or Apache (UPLOAD_SERVE_OFFLOAD=x-accel-redirect
+# or x-sendfile) only the headers are sent and the proxy serves the file.
+import mimetypes
+import os
+import re
+import stat
+from datetime import datetime, timezone
+from urllib.parse import quote
+from flask import current_app, request, Response, abort
+from werkzeug.http import http_date, is_resource_modified, quote_etag
+from werkzeug.security import safe_join
+from werkzeug.wsgi import FileWrapper
+from .storage import LOCAL_ROOT
+
+BLOCK_SIZE = 64 * 1024
+
+# content addressed names, the hash is the etag
+HASHED_NAME = re.compile(r'^([0-9a-f]{64})')
+
+# a file positioned at the start of a range that reads no further than its end
+class RangeFile:
+    def __init__(self, f, length):
+        self._file = f
+        self._remaining = length
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        size = self._remaining if size is None or size < 0 else min(size, self._remaining)
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    # servers using sendfile start at the current offset and stop at the Content-Length
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+# whether a Range request may be answered, a stale If-Range asks for the whole file
+def _if_range_matches(etag, last_modified):
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return last_modified <= if_range.date
+    return True
+
+def _offload(key, path, headers):
+    mode = current_app.config['UPLOAD_SERVE_OFFLOAD']
+    if mode == 'x-accel-redirect':
+        headers['X-Accel-Redirect'] = current_app.config['UPLOAD_X_ACCEL_PREFIX'].rstrip('/') + '/' + quote(key)
+    elif mode == 'x-sendfile':
+        headers['X-Sendfile'] = path
+    else:
+        return None
+    return Response(headers=headers)
+
+"""
+    Respond with the upload stored under key, e.g. files/<sha256>.pdf, honouring
+    If-None-Match, If-Modified-Since, Range and If-Range. Several ranges in one
+    request are answered with the whole file.
+"""
+def send_upload(key):
+    path = safe_join(os.path.abspath(LOCAL_ROOT), key)
+    if path is None:
+        abort(404)
+    headers = {
+        'Content-Type': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+        'Cache-Control': f"public, max-age={current_app.config['UPLOAD_CACHE_MAX_AGE']}, immutable",
+        'Accept-Ranges': 'bytes',
+        # cross-origin PDF readers need these to read ranged responses
+        'Access-Control-Expose-Headers': 'Accept-Ranges, Content-Length, Content-Range, ETag',
+    }
+    offloaded = _offload(key, path, headers)
+    if offloaded is not None:
+        return offloaded
+
+    try:
+        info = os.stat(path)
+    except OSError:
+        abort(404)
+    if not stat.S_ISREG(info.st_mode):
+        abort(404)
+    size = info.st_size
+    last_modified = datetime.fromtimestamp(int(info.st_mtime), timezone.utc)
+    match = HASHED_NAME.match(os.path.basename(path))
+    etag = match.group(1) if match else f'{int(info.st_mtime)}-{size}'
+    headers['ETag'] = quote_etag(etag)
+    headers['Last-Modified'] = http_date(last_modified)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    start, end, status = 0, size, 200
+    byte_range = request.range
+    if byte_range is not None and _if_range_matches(etag, last_modified):
+        span = byte_range.range_for_length(size)
+        if span is not None:
+            start, end = span
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+        elif len(byte_range.ranges) == 1:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+    headers['Content-Length'] = str(end - start)
+
+    if request.method == 'HEAD':
+        return Response(status=status, headers=headers)
+    f = open(path, 'rb')
+    f.seek(start)
+    file_wrapper = request.environ.get('wsgi.file_wrapper', FileWrapper)
+    return Response(
+        file_wrapper(RangeFile(f, end - start), BLOCK_SIZE),
+        status=status, headers=headers, direct_passthrough=True
+    )
@@ -1,29 +1,25 @@
-import os
 from werkzeug.utils import secure_filename
-from flask import url_for
-import uuid
+from ..services.uploads import store_upload
 
-UPLOAD_FOLDER = 'static/uploads/files'
 ALLOWED_EXTENSIONS = {'pdf', 'txt', 'docx', 'html', 'htm'}
 
 # Check allowed file types
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# whether upload_file() would store the file
+def valid_file(file):
+    return bool(file) and allowed_file(file.filename)
+
 # API Route: Upload file
 def upload_file(file):
 
-    if file and allowed_file(file.filename):
+    if valid_file(file):
         filename = secure_filename(file.filename)
         extension = filename.rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4().hex}.{extension}"
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
-        file_url = url_for('static', filename=f'uploads/files/{filename}', _external=True)
+        # stored once per content, the same book uploaded again gets the same url
+        file_url = store_upload(file, 'files', extension)
 
         return file_url
     else:
         return None
-
-
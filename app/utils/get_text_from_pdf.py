@@ -1,10 +1,82 @@
 # extract text from the PDFs
+# Pages are read lazily so extraction stops as soon as the token budget is met.
+# PyMuPDF is used when it is installed because it is much faster than pdfplumber,
+# and page ranges can be fanned out to a process pool for large books.
 import pdfplumber
+from .limit_tokens_count import count_tokens
 
-def extract_text_content(pdf_path):
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+# pages handed to a worker process at a time
+PAGES_PER_TASK = 16
+
+def get_page_count(pdf_path):
+    if pymupdf is not None:
+        with pymupdf.open(pdf_path) as doc:
+            return doc.page_count
     with pdfplumber.open(pdf_path) as pdf:
-        text = "".join([page.extract_text()
-        for page in pdf.pages])
-    return text
+        return len(pdf.pages)
+
+# extract the text of pages [start, stop), runs inside the worker processes too
+def extract_page_range(pdf_path, start, stop):
+    texts = []
+    if pymupdf is not None:
+        with pymupdf.open(pdf_path) as doc:
+            for number in range(start, min(stop, doc.page_count)):
+                texts.append(doc.load_page(number).get_text() or '')
+        return texts
+
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages[start:stop]:
+            # extract_text() returns None for pages without a text layer
+            texts.append(page.extract_text() or '')
+            # drop the parsed objects so memory stays flat on long books
+            page.flush_cache()
+    return texts
+
+# yield the text of every page in order, optionally using a process pool executor
+def iter_pdf_pages(pdf_path, executor=None, pages_per_task=PAGES_PER_TASK):
+    page_count = get_page_count(pdf_path)
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+    if executor is None:
+        for start, stop in ranges:
+            yield from extract_page_range(pdf_path, start, stop)
+        return
 
+    # keep a bounded window of ranges in flight and yield them in page order
+    window = max(2, getattr(executor, '_max_workers', 2) * 2)
+    pending = []
+    ranges = iter(ranges)
+    try:
+        for start, stop in ranges:
+            pending.append(executor.submit(extract_page_range, pdf_path, start, stop))
+            if len(pending) >= window:
+                break
+        while pending:
+            future = pending.pop(0)
+            next_range = next(ranges, None)
+            if next_range:
+                pending.append(executor.submit(extract_page_range, pdf_path, *next_range))
+            yield from future.result()
+    finally:
+        # the consumer stopped early, do not parse pages nobody will read
+        for future in pending:
+            future.cancel()
 
+def extract_text_content(pdf_path, max_tokens=None, executor=None):
+    texts = []
+    tokens = 0
+    for text in iter_pdf_pages(pdf_path, executor=executor):
+        texts.append(text)
+        if max_tokens is not None:
+            tokens += count_tokens(text)
+            if tokens >= max_tokens:
+                break
+    return "\n".join(texts)
@@ -1,29 +1,94 @@
 import os
-from werkzeug.utils import secure_filename
-from flask import url_for
-import uuid
+import re
+from flask import current_app
+from PIL import Image, UnidentifiedImageError
+from ..services.image_pipeline import image_pipeline, clean_image, FORMATS, CONTENT_TYPES, INCOMING_FOLDER
+from ..services.uploads import hashed_upload, acquire_upload
+from .storage import upload_storage
 
-UPLOAD_FOLDER = 'static/uploads/images'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 
+# names of processed uploads, <sha256>.<ext>
+HASHED_NAME = re.compile(r'^([0-9a-f]{64})\.(?:jpg|png|webp)$')
+
 # Check allowed file types
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# the stored extension when the bytes are an image we accept, None otherwise
+# only reads the header, the full decode happens in upload_image()
+def _image_extension(upload):
+    try:
+        with Image.open(upload) as image:
+            width, height = image.size
+            image_format = image.format
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return None
+    finally:
+        upload.seek(0)
+    if width * height > current_app.config['IMAGE_MAX_PIXELS']:
+        return None
+    return FORMATS.get(image_format)
+
+# the stored extension when the file is an image upload_image() accepts, None otherwise
+def image_extension(file):
+    if not (file and allowed_file(file.filename)):
+        return None
+    upload = hashed_upload(file)
+    if upload.size > current_app.config['IMAGE_MAX_BYTES']:
+        return None
+    return _image_extension(upload)
+
+# whether upload_image() would store the file, nothing is written
+def valid_image(file):
+    return image_extension(file) is not None
+
 # upload image function
+# stores the cleaned full size image before returning its url, the resized variants follow
 def upload_image(file):
 
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        extension = filename.rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4().hex}.{extension}"
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
-        image_url = url_for('static', filename=f'uploads/images/{filename}', _external=True)
+    extension = image_extension(file)
+    if extension:
+        upload = hashed_upload(file)
+        digest = upload.hexdigest()
+        cleaned = f'{upload.name}.{extension}'
+        try:
+            try:
+                clean_image(upload.name, cleaned, extension)
+            except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+                return None
+            key = acquire_upload(digest, f'images/{digest}.{extension}', upload.size)
+            if not upload_storage.exists(key):
+                upload_storage.save(key, cleaned, content_type=CONTENT_TYPES[extension])
+        finally:
+            try:
+                os.remove(cleaned)
+            except FileNotFoundError:
+                pass
 
-        return image_url
+        # unless the variants are there or being made right now, a failed job is queued again
+        variant_keys = image_pipeline.variant_keys(digest)
+        source = os.path.join(INCOMING_FOLDER, digest)
+        if variant_keys and not upload_storage.exists(variant_keys[-1]) and not os.path.exists(source):
+            os.makedirs(INCOMING_FOLDER, exist_ok=True)
+            os.replace(upload.name, source)
+            image_pipeline.submit(source, digest)
+
+        return upload_storage.url(key)
     else:
         return None
 
-
+# urls of the resized copies of an uploaded image, {variant: {format: url}}
+# empty for images uploaded before the pipeline and for external urls
+def image_variants(image_url):
+    if not image_url:
+        return {}
+    prefix, _, name = image_url.rpartition('/')
+    match = HASHED_NAME.match(name)
+    if not match:
+        return {}
+    digest = match.group(1)
+    return {
+        variant: {fmt: f'{prefix}/{digest}-{variant}.{fmt}' for fmt in image_pipeline.formats}
+        for variant in image_pipeline.variants
+    }
@@ -1,12 +1,21 @@
 import tiktoken
-from ..services.get_summary import MODEL
 
-def truncate_text_to_token_limit(text, max_tokens=6000):
-    # Use the GPT-compatible tokenizer
+# split text into windows of max_tokens that overlap by overlap tokens
+def split_text_into_token_chunks(text, max_tokens=6000, overlap=200, max_chunks=None):
     encoding = tiktoken.get_encoding("cl100k_base")
-    
-    tokens = encoding.encode(text)
-    if len(tokens) > max_tokens:
-        tokens = tokens[:max_tokens]
 
-    return encoding.decode(tokens)
+    # book text may contain special token strings like <|endoftext|>, encode them as plain text
+    tokens = encoding.encode(text, disallowed_special=())
+    step = max(1, max_tokens - overlap)
+    chunks = []
+    for start in range(0, max(len(tokens), 1), step):
+        chunks.append(encoding.decode(tokens[start:start + max_tokens]))
+        if start + max_tokens >= len(tokens):
+            break
+        if max_chunks and len(chunks) >= max_chunks:
+            break
+    return chunks
+
+def count_tokens(text):
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,49 @@
+# batch load everything the posts listings need in a fixed number of queries
+from collections import defaultdict
+from sqlalchemy.orm import joinedload
+from ..schema.models import Post, Comment
+from .image_upload import image_variants
+
+# eager load the post author and book so serialising a post never hits the database
+def with_post_relations(query):
+    return query.options(joinedload(Post.users), joinedload(Post.book))
+
+# serialise a list of posts with their comments, like counts come from the post row
+def serialize_posts(posts):
+    if not posts:
+        return []
+
+    post_ids = [post.id for post in posts]
+
+    # one query for all the comments together with their authors
+    comments = (
+        Comment.query
+        .options(joinedload(Comment.users))
+        .filter(Comment.post_id.in_(post_ids))
+        .order_by(Comment.posted_at, Comment.id)
+        .all()
+    )
+    comments_by_post = defaultdict(list)
+    for comment in comments:
+        comments_by_post[comment.post_id].append({
+            'id': comment.id,
+            'user': comment.users.username,
+            'content': comment.content,
+            'date_posted': comment.posted_at
+        })
+
+    posts_data = []
+    for post in posts:
+        posts_data.append({
+            'id': post.id,
+            'user': post.users.username,
+            'title': post.title,
+            'book': post.book.title,
+            'content': post.content,
+            'post_image_url': post.post_image_url,
+            'post_image_variants': image_variants(post.post_image_url),
+            'likes': post.likes_count,
+            'date_posted': post.posted_at,
+            'comments': comments_by_post[post.id]
+        })
+    return posts_data
@@ -0,0 +1,94 @@
+# keyset (cursor) pagination shared by all the list routes
+import base64
+import json
+from datetime import datetime
+from flask import request
+from sqlalchemy import and_, or_
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+class InvalidCursor(Exception):
+    pass
+
+# encode the sort key of the last row into an opaque token
+def encode_cursor(created_at, row_id):
+    key = [created_at.isoformat() if created_at else None, row_id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if created_at is not None:
+            created_at = datetime.fromisoformat(created_at)
+        return created_at, int(row_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+class CursorPage:
+    def __init__(self, items, per_page, next_cursor, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.has_next = next_cursor is not None
+        self.total = total
+
+    @property
+    def metadata(self):
+        metadata = {
+            'per_page': self.per_page,
+            'has_next': self.has_next,
+            'next_cursor': self.next_cursor,
+        }
+        if self.total is not None:
+            metadata['total'] = self.total
+        return metadata
+
+"""
+    Page through a query newest first, keyed on (created_at, id).
+    Reads `cursor`, `per_page` and `total` from the request args. The
+    COUNT(*) only runs when the client asks for it with `total=true`.
+    Pass created_column=None for tables that only have an id to sort on.
+    Rows without a created_at come last, ordered by id, and their cursor
+    carries no date.
+"""
+def cursor_paginate(query, created_column, id_column):
+    per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    cursor = request.args.get('cursor')
+    with_total = request.args.get('total', 'false').lower() == 'true'
+
+    total = query.order_by(None).count() if with_total else None
+
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        if created_column is None:
+            query = query.filter(id_column < row_id)
+        elif created_at is None:
+            # already in the rows without a date
+            query = query.filter(created_column.is_(None), id_column < row_id)
+        else:
+            query = query.filter(or_(
+                created_column < created_at,
+                and_(created_column == created_at, id_column < row_id),
+                created_column.is_(None)
+            ))
+
+    if created_column is None:
+        query = query.order_by(id_column.desc())
+    else:
+        # spelled out, PostgreSQL puts NULLs first in descending order and SQLite last
+        query = query.order_by(created_column.desc().nulls_last(), id_column.desc())
+
+    # fetch one extra row to know whether there is a next page
+    rows = query.limit(per_page + 1).all()
+    items = rows[:per_page]
+
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        created_at = getattr(last, created_column.key) if created_column is not None else None
+        next_cursor = encode_cursor(created_at, getattr(last, id_column.key))
+
+    return CursorPage(items, per_page, next_cursor, total)
@@ -0,0 +1,238 @@
+# shared rate limit storage and keys
+# Flask-Limiter's memory:// storage keeps separate counters in every worker, so
+# with N gunicorn workers a client gets N times its limit. Two storages are
+# registered with the limits library here, both supporting the
+# sliding-window-counter strategy (two fixed window counters weighted into an
+# approximate sliding window, O(1) per check):
+#   - sqlite:///path/to/ratelimits.db, one WAL database file shared by every
+#     worker on the host, checks run in a single write transaction
+#   - resp://host:port/db, any server speaking the Redis protocol through the
+#     response cache's client, checks run as Lua scripts
+# Authenticated requests are keyed on the JWT identity instead of the address.
+import os
+import sqlite3
+import threading
+import time
+from math import floor
+from urllib.parse import urlparse
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from flask_limiter.util import get_remote_address
+from limits.storage import Storage
+from limits.storage.base import SlidingWindowCounterSupport, TimestampedSlidingWindow
+from .response_cache import RedisBackend, CacheError
+
+# weight of the previous window and ttl of both windows at time now
+def _sliding_window_info(previous_count, current_count, expiry, now):
+    previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+    current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+    return previous_count, previous_ttl, current_count, current_ttl
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    STORAGE_SCHEME = ['sqlite']
+
+    # expired counters are purged every this many writes
+    PURGE_EVERY = 1000
+
+    def __init__(self, uri=None, wrap_exceptions=False, timeout=5.0, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        path = urlparse(uri).path
+        # sqlite:///relative.db and sqlite:////absolute.db, like SQLAlchemy
+        self.path = path[1:] if path.startswith('/') else path
+        if not self.path or self.path == ':memory:':
+            raise ValueError('The sqlite rate limit storage needs a database file.')
+        self.timeout = float(timeout)
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._execute(
+            'CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    # one connection per thread and process
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _execute(self, sql, params=()):
+        return self._connection().execute(sql, params)
+
+    def _incr(self, conn, key, expiry, amount, now):
+        (count,) = conn.execute(
+            """
+            INSERT INTO rate_limits (key, count, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END,
+                expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END
+            RETURNING count
+            """,
+            (key, amount, now + expiry, now, now)
+        ).fetchone()
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute('DELETE FROM rate_limits WHERE expires_at <= ?', (now,))
+        return count
+
+    def _get(self, conn, key, now):
+        row = conn.execute('SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?', (key, now)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key, expiry, amount=1):
+        return self._incr(self._connection(), key, expiry, amount, time.time())
+
+    def get(self, key):
+        return self._get(self._connection(), key, time.time())
+
+    def get_expiry(self, key):
+        row = self._execute('SELECT expires_at FROM rate_limits WHERE key = ?', (key,)).fetchone()
+        return row[0] if row and row[0] > time.time() else time.time()
+
+    def check(self):
+        try:
+            self._execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._execute('DELETE FROM rate_limits').rowcount
+
+    def clear(self, key):
+        self._execute('DELETE FROM rate_limits WHERE key = ?', (key,))
+
+    # read both windows and take the hit under the database write lock, so
+    # concurrent workers can never overshoot the limit
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            previous_count, previous_ttl, current_count, _ = _sliding_window_info(
+                self._get(conn, previous_key, now), self._get(conn, current_key, now), expiry, now
+            )
+            allowed = floor(previous_count * previous_ttl / expiry + current_count) + amount <= limit
+            if allowed:
+                self._incr(conn, current_key, 2 * expiry, amount, now)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed
+
+    def get_sliding_window(self, key, expiry):
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        conn = self._connection()
+        return _sliding_window_info(self._get(conn, previous_key, now), self._get(conn, current_key, now), expiry, now)
+
+    def clear_sliding_window(self, key, expiry):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self.clear(previous_key)
+        self.clear(current_key)
+
+# ARGV: expiry in ms, amount. The ttl is only set by the hit creating the counter.
+INCR_SCRIPT = """
+local count = redis.call('INCRBY', KEYS[1], ARGV[2])
+if count == tonumber(ARGV[2]) then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+return count
+"""
+
+# KEYS: previous window, current window
+# ARGV: limit, current window expiry in ms, amount, weight of the previous window
+SLIDING_WINDOW_SCRIPT = """
+local previous = tonumber(redis.call('GET', KEYS[1]) or '0')
+local current = tonumber(redis.call('GET', KEYS[2]) or '0')
+local amount = tonumber(ARGV[3])
+if math.floor(previous * tonumber(ARGV[4]) + current) + amount > tonumber(ARGV[1]) then
+    return 0
+end
+if redis.call('INCRBY', KEYS[2], amount) == amount then
+    redis.call('PEXPIRE', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+class RESPStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    STORAGE_SCHEME = ['resp']
+
+    def __init__(self, uri=None, wrap_exceptions=False, pool_size=10, timeout=0.5, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.backend = RedisBackend(uri, pool_size=int(pool_size), timeout=float(timeout))
+
+    @property
+    def base_exceptions(self):
+        return (OSError, CacheError)
+
+    def incr(self, key, expiry, amount=1):
+        return self.backend.execute('EVAL', INCR_SCRIPT, 1, key, int(expiry * 1000), amount)
+
+    def get(self, key):
+        return int(self.backend.execute('GET', key) or 0)
+
+    def get_expiry(self, key):
+        ttl = self.backend.execute('PTTL', key)
+        return time.time() + max(ttl, 0) / 1000
+
+    def check(self):
+        try:
+            return self.backend.execute('PING') == b'PONG'
+        except (OSError, CacheError):
+            return False
+
+    # only the limiter's own keys, the server may be shared with the response cache
+    def reset(self):
+        cursor, deleted = b'0', 0
+        while True:
+            cursor, keys = self.backend.execute('SCAN', cursor, 'MATCH', 'LIMITER*', 'COUNT', 1000)
+            if keys:
+                deleted += self.backend.execute('DEL', *keys)
+            if cursor == b'0':
+                return deleted
+
+    def clear(self, key):
+        self.backend.execute('DEL', key)
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_weight = 1 - (((now - expiry) / expiry) % 1)
+        return bool(self.backend.execute(
+            'EVAL', SLIDING_WINDOW_SCRIPT, 2, previous_key, current_key,
+            limit, int(2 * expiry * 1000), amount, repr(previous_weight)
+        ))
+
+    def get_sliding_window(self, key, expiry):
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count, current_count = (int(value or 0) for value in self.backend.execute('MGET', previous_key, current_key))
+        return _sliding_window_info(previous_count, current_count, expiry, now)
+
+    def clear_sliding_window(self, key, expiry):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self.backend.execute('DEL', previous_key, current_key)
+
+# key on the user for requests with a valid access token, on the address otherwise
+def get_user_or_remote_address():
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        identity = None
+    return f'user:{identity}' if identity else get_remote_address()
@@ -0,0 +1,346 @@
+# response cache for read-heavy routes
+# Views opt in with @response_cache.cached(tags=...). Every tag has a version
+# number and an entry remembers the versions it was built with, so write routes
+# invalidate with response_cache.invalidate(*tags) by bumping the versions instead
+# of hunting down keys. Cached responses carry an ETag and answer 304 when the
+# client already has them. RESPONSE_CACHE_URL picks where entries and versions live:
+#   - sqlite:///path/to/response_cache.db (the default, under the instance folder),
+#     one WAL database file shared by every worker on the host
+#   - redis://host:port/db, any server speaking the Redis protocol, shared by
+#     every host
+#   - memory://, an in-process LRU. Versions are only bumped in the worker
+#     handling the write, so the other workers keep serving stale entries until
+#     they expire. Only use it with a single worker process.
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from queue import LifoQueue, Empty, Full
+from urllib.parse import urlparse
+from flask import request, make_response
+
+logger = logging.getLogger(__name__)
+
+class CacheError(Exception):
+    pass
+
+class MemoryBackend:
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                if key in self._counters:
+                    values.append(str(self._counters[key]).encode())
+                    continue
+                item = self._entries.get(key)
+                if item is None or item[0] < now:
+                    self._entries.pop(key, None)
+                    values.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    values.append(item[1])
+        return values
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # counters are never evicted, losing one would revive stale entries
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+class SQLiteBackend:
+    # expired entries are purged every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, url, max_entries=2048, timeout=5.0):
+        path = urlparse(url).path
+        # sqlite:///relative.db and sqlite:////absolute.db, like SQLAlchemy
+        self.path = path[1:] if path.startswith('/') else path
+        if not self.path or self.path == ':memory:':
+            raise ValueError('The sqlite response cache needs a database file.')
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._execute('CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)')
+        self._execute('CREATE TABLE IF NOT EXISTS cache_counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    # one connection per thread and process
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _execute(self, sql, params=()):
+        try:
+            return self._connection().execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            raise CacheError(str(e)) from e
+
+    def get_many(self, keys):
+        marks = ', '.join('?' * len(keys))
+        rows = self._execute(
+            f'SELECT key, value FROM cache_entries WHERE key IN ({marks}) AND expires_at > ? '
+            f'UNION ALL SELECT key, value FROM cache_counters WHERE key IN ({marks})',
+            (*keys, time.time(), *keys)
+        )
+        # versions come back as bytes, like they do from a Redis server
+        found = {key: value if isinstance(value, bytes) else str(value).encode() for key, value in rows}
+        return [found.get(key) for key in keys]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        self._execute('INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)', (key, value, now + ttl))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._execute('DELETE FROM cache_entries WHERE expires_at <= ?', (now,))
+            self._execute(
+                'DELETE FROM cache_entries WHERE key IN (SELECT key FROM cache_entries ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+    # counters are never evicted, losing one would revive stale entries
+    def incr(self, key):
+        ((value,),) = self._execute(
+            'INSERT INTO cache_counters (key, value) VALUES (?, 1) '
+            'ON CONFLICT (key) DO UPDATE SET value = value + 1 RETURNING value',
+            (key,)
+        )
+        return value
+
+    def clear(self):
+        self._execute('DELETE FROM cache_entries')
+        self._execute('DELETE FROM cache_counters')
+
+class RedisBackend:
+    # a small RESP client so any Redis compatible server (or a local stand-in) works
+    def __init__(self, url, pool_size=10, timeout=0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._pool = LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile('rb'))
+        if self.password:
+            self._call(conn, 'AUTH', self.password)
+        if self.db:
+            self._call(conn, 'SELECT', self.db)
+        return conn
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise CacheError('Connection closed by the cache server.')
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b'+':
+            return rest
+        if prefix == b'-':
+            raise CacheError(rest.decode())
+        if prefix == b':':
+            return int(rest)
+        if prefix == b'$':
+            size = int(rest)
+            if size < 0:
+                return None
+            data = reader.read(size + 2)
+            return data[:-2]
+        if prefix == b'*':
+            size = int(rest)
+            return None if size < 0 else [self._read(reader) for _ in range(size)]
+        raise CacheError(f'Unexpected reply from the cache server: {line!r}')
+
+    def _call(self, conn, *args):
+        sock, reader = conn
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        sock.sendall(b''.join(parts))
+        return self._read(reader)
+
+    def execute(self, *args):
+        try:
+            conn = self._pool.get_nowait()
+        except Empty:
+            conn = self._connect()
+        try:
+            result = self._call(conn, *args)
+        except (OSError, CacheError):
+            conn[0].close()
+            raise
+        try:
+            self._pool.put_nowait(conn)
+        except Full:
+            conn[0].close()
+        return result
+
+    def get_many(self, keys):
+        return self.execute('MGET', *keys)
+
+    def set(self, key, value, ttl):
+        self.execute('SET', key, value, 'PX', int(ttl * 1000))
+
+    def incr(self, key):
+        return self.execute('INCR', key)
+
+    def clear(self):
+        self.execute('FLUSHDB')
+
+    def publish(self, channel, message):
+        return self.execute('PUBLISH', channel, message)
+
+    # yield the messages published on channel, over a dedicated blocking connection
+    def listen(self, channel):
+        conn = self._connect()
+        conn[0].settimeout(None)
+        try:
+            self._call(conn, 'SUBSCRIBE', channel)
+            while True:
+                reply = self._read(conn[1])
+                if isinstance(reply, list) and len(reply) == 3 and reply[0] == b'message':
+                    yield reply[2]
+        finally:
+            conn[0].close()
+
+class ResponseCache:
+    def __init__(self, app=None):
+        self.backend = MemoryBackend()
+        self.enabled = True
+        self.default_ttl = 300
+        self.prefix = 'rc:'
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RESPONSE_CACHE_ENABLED', True)
+        app.config.setdefault('RESPONSE_CACHE_URL', os.getenv(
+            'RESPONSE_CACHE_URL', 'sqlite:///' + os.path.join(app.instance_path, 'response_cache.db')
+        ))
+        app.config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', 2048)
+        app.config.setdefault('RESPONSE_CACHE_TTL', 300)
+        app.config.setdefault('RESPONSE_CACHE_PREFIX', 'rc:')
+
+        url = app.config['RESPONSE_CACHE_URL']
+        if url.startswith('redis://'):
+            self.backend = RedisBackend(url)
+        elif url.startswith('sqlite://'):
+            self.backend = SQLiteBackend(url, app.config['RESPONSE_CACHE_MAX_ENTRIES'])
+        else:
+            self.backend = MemoryBackend(app.config['RESPONSE_CACHE_MAX_ENTRIES'])
+        self.enabled = app.config['RESPONSE_CACHE_ENABLED']
+        self.default_ttl = app.config['RESPONSE_CACHE_TTL']
+        self.prefix = app.config['RESPONSE_CACHE_PREFIX']
+        app.extensions['response_cache'] = self
+
+    def _tag_key(self, tag):
+        return f'{self.prefix}tag:{tag}'
+
+    # bump the version of every tag, entries built with an older version become misses
+    def invalidate(self, *tags):
+        if not self.enabled:
+            return
+        for tag in tags:
+            try:
+                self.backend.incr(self._tag_key(tag))
+            except (OSError, CacheError) as e:
+                logger.warning('Response cache invalidation of %s failed: %s', tag, e)
+
+    def _lookup(self, key, tags):
+        values = self.backend.get_many([key] + [self._tag_key(tag) for tag in tags])
+        versions = {tag: int(value or 0) for tag, value in zip(tags, values[1:])}
+        entry = json.loads(values[0]) if values[0] is not None else None
+        if entry is not None and entry['versions'] != versions:
+            entry = None
+        return entry, versions
+
+    def _respond(self, entry, hit):
+        response = make_response(entry['body'], entry['status'])
+        response.mimetype = entry['mimetype']
+        response.set_etag(entry['etag'])
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response.make_conditional(request)
+
+    """
+        Cache the 200 responses of a view.
+        key and tags are format strings filled with the view arguments, e.g.
+        @response_cache.cached(tags=('books', 'tag:{tag_id}')). The query string
+        is always part of the key so every page is cached separately.
+    """
+    def cached(self, tags=(), key=None, ttl=None):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                entry_key = (key or request.endpoint).format(**kwargs)
+                query = '&'.join(f'{name}={value}' for name, value in sorted(request.args.items(multi=True)))
+                entry_key = f'{self.prefix}{entry_key}:{request.path}?{query}'
+                entry_tags = [tag.format(**kwargs) for tag in tags]
+
+                try:
+                    entry, versions = self._lookup(entry_key, entry_tags)
+                except (OSError, CacheError, ValueError) as e:
+                    logger.warning('Response cache lookup failed: %s', e)
+                    return view(*args, **kwargs)
+                if entry is not None:
+                    return self._respond(entry, hit=True)
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+
+                body = response.get_data()
+                entry = {
+                    'status': response.status_code,
+                    'mimetype': response.mimetype,
+                    'body': body.decode('utf-8'),
+                    'etag': hashlib.sha1(body).hexdigest(),
+                    'versions': versions,
+                }
+                try:
+                    self.backend.set(entry_key, json.dumps(entry).encode(), ttl or self.default_ttl)
+                except (OSError, CacheError) as e:
+                    logger.warning('Response cache store failed: %s', e)
+                return self._respond(entry, hit=False)
+            return wrapper
+        return decorator
+
+response_cache = ResponseCache()
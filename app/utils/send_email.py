@@ -1,13 +1,11 @@
 # This module contains utility functions for generating and sending password reset tokens.
-from flask_mail import Message
-from app import mail 
 from flask import current_app as app
 from flask import url_for
+from ..services.mail_queue import mail_queue
+
+# queue the email, the background sender delivers it
 def send_email(subject, sender, recipients, text_body):
-    msg = Message(subject, sender=sender, recipients=recipients)
-    msg.body = text_body
-    # Send the email using Flask-Mail
-    mail.send(msg)
+    mail_queue.send_message(subject, sender=sender, recipients=recipients, body=text_body)
 
 def send_password_reset_email(user):
     token = user.get_reset_password_token()
@@ -0,0 +1,191 @@
+# storage for uploaded books and images
+# Uploads are stored under keys like files/<sha256>.pdf or images/<sha256>.jpg,
+# either in the local static folder or in an S3 compatible bucket
+# (UPLOAD_STORAGE_URL=s3://bucket, works with AWS, MinIO and other stand-ins).
+# Files are handed over as local temp files: the local backend renames them
+# into place, the S3 backend streams them up signed with the sha256 computed
+# while the upload was received. Keys are content addressed, so an object never
+# changes once written.
+import hashlib
+import hmac
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from urllib.parse import quote, urlparse
+import requests
+from flask import url_for
+from .text_store import file_sha256
+
+# the local backend stores files here, served under /static/uploads
+LOCAL_ROOT = os.path.join('static', 'uploads')
+
+# (connect, read) timeouts in seconds
+TIMEOUT = (5, 60)
+
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+
+class StorageError(Exception):
+    pass
+
+class LocalBackend:
+    def __init__(self, root=LOCAL_ROOT):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    # move the temp file at source to key
+    def save(self, key, source, content_type=None, sha256=None):
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(source, target)
+        except OSError:
+            # temp dir on another filesystem, copy next to the target and rename
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.part')
+            os.close(fd)
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, target)
+            os.remove(source)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    # served by the uploads blueprint, with ranges and immutable cache headers
+    def url(self, key):
+        return url_for('uploads.serve_upload', key=key, _external=True)
+
+class S3Backend:
+    def __init__(self, bucket, endpoint=None, region='us-east-1', access_key=None, secret_key=None, public_url=None):
+        self.bucket = bucket
+        self.region = region
+        self.endpoint = (endpoint or f'https://s3.{region}.amazonaws.com').rstrip('/')
+        self.access_key = access_key
+        self.secret_key = secret_key
+        # path style addressing, supported by AWS and every stand-in
+        self.public_url = (public_url or f'{self.endpoint}/{bucket}').rstrip('/')
+        self.session = requests.Session()
+
+    def _signing_key(self, date):
+        key = ('AWS4' + self.secret_key).encode()
+        for part in (date, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        return key
+
+    # AWS signature version 4 headers for a request on key
+    def _headers(self, method, path, payload_sha256):
+        now = datetime.now(timezone.utc)
+        amz_date, date = now.strftime('%Y%m%dT%H%M%SZ'), now.strftime('%Y%m%d')
+        host = urlparse(self.endpoint).netloc
+        headers = {'host': host, 'x-amz-content-sha256': payload_sha256, 'x-amz-date': amz_date}
+        signed_headers = ';'.join(sorted(headers))
+        canonical_request = '\n'.join([
+            method, path, '',
+            ''.join(f'{name}:{headers[name]}\n' for name in sorted(headers)),
+            signed_headers, payload_sha256,
+        ])
+        scope = f'{date}/{self.region}/s3/aws4_request'
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+        ])
+        signature = hmac.new(self._signing_key(date), string_to_sign.encode(), hashlib.sha256).hexdigest()
+        headers['Authorization'] = (
+            f'AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, '
+            f'SignedHeaders={signed_headers}, Signature={signature}'
+        )
+        del headers['host']
+        return headers
+
+    def _request(self, method, key, payload_sha256=EMPTY_SHA256, headers=None, data=None):
+        path = f'/{self.bucket}/{quote(key)}'
+        signed = self._headers(method, path, payload_sha256)
+        signed.update(headers or {})
+        try:
+            return self.session.request(method, self.endpoint + path, headers=signed, data=data, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            raise StorageError(f'{method} {key} failed. {e}')
+
+    def exists(self, key):
+        response = self._request('HEAD', key)
+        if response.status_code == 404:
+            return False
+        if response.status_code != 200:
+            raise StorageError(f'HEAD {key} failed. Status: {response.status_code}')
+        return True
+
+    # upload the temp file at source to key and remove it
+    def save(self, key, source, content_type=None, sha256=None):
+        headers = {
+            'Content-Type': content_type or 'application/octet-stream',
+            # content addressed keys never change
+            'Cache-Control': 'public, max-age=31536000, immutable',
+        }
+        with open(source, 'rb') as f:
+            response = self._request('PUT', key, sha256 or file_sha256(source), headers, f)
+        if response.status_code != 200:
+            raise StorageError(f'PUT {key} failed. Status: {response.status_code}')
+        os.remove(source)
+
+    def delete(self, key):
+        response = self._request('DELETE', key)
+        if response.status_code not in (200, 204, 404):
+            raise StorageError(f'DELETE {key} failed. Status: {response.status_code}')
+
+    def url(self, key):
+        return f'{self.public_url}/{quote(key)}'
+
+class UploadStorage:
+    def __init__(self, app=None):
+        self.backend = LocalBackend()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('UPLOAD_STORAGE_URL', os.getenv('UPLOAD_STORAGE_URL', 'local://'))
+        app.config.setdefault('UPLOAD_S3_ENDPOINT', os.getenv('UPLOAD_S3_ENDPOINT'))
+        app.config.setdefault('UPLOAD_S3_REGION', os.getenv('UPLOAD_S3_REGION', 'us-east-1'))
+        app.config.setdefault('UPLOAD_S3_ACCESS_KEY', os.getenv('UPLOAD_S3_ACCESS_KEY'))
+        app.config.setdefault('UPLOAD_S3_SECRET_KEY', os.getenv('UPLOAD_S3_SECRET_KEY'))
+        # where clients fetch objects from, e.g. a CDN in front of the bucket
+        app.config.setdefault('UPLOAD_S3_PUBLIC_URL', os.getenv('UPLOAD_S3_PUBLIC_URL'))
+        # serving local uploads, they never change so browsers may keep them for a year
+        app.config.setdefault('UPLOAD_CACHE_MAX_AGE', 31536000)
+        # let the reverse proxy send the files: None, 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd)
+        app.config.setdefault('UPLOAD_SERVE_OFFLOAD', os.getenv('UPLOAD_SERVE_OFFLOAD'))
+        # the nginx internal location aliased to static/uploads
+        app.config.setdefault('UPLOAD_X_ACCEL_PREFIX', '/protected-uploads/')
+
+        url = urlparse(app.config['UPLOAD_STORAGE_URL'])
+        if url.scheme == 's3':
+            self.backend = S3Backend(
+                url.netloc,
+                endpoint=app.config['UPLOAD_S3_ENDPOINT'],
+                region=app.config['UPLOAD_S3_REGION'],
+                access_key=app.config['UPLOAD_S3_ACCESS_KEY'],
+                secret_key=app.config['UPLOAD_S3_SECRET_KEY'],
+                public_url=app.config['UPLOAD_S3_PUBLIC_URL'],
+            )
+        else:
+            self.backend = LocalBackend()
+        app.extensions['upload_storage'] = self
+
+    def exists(self, key):
+        return self.backend.exists(key)
+
+    def save(self, key, source, content_type=None, sha256=None):
+        self.backend.save(key, source, content_type=content_type, sha256=sha256)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def url(self, key):
+        return self.backend.url(key)
+
+upload_storage = UploadStorage()
@@ -0,0 +1,103 @@
+# on-disk cache of text extracted from uploaded books
+# Extracted text is stored zlib compressed under the sha256 of the book file so
+# summaries and other jobs never parse the same PDF twice. The directory is kept
+# under a size limit by evicting the least recently used entries.
+import hashlib
+import os
+import tempfile
+import threading
+import zlib
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class TextStore:
+    def __init__(self, app=None):
+        self.root = None
+        self.max_bytes = 512 * 1024 * 1024
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TEXT_STORE_DIR', os.path.join(app.instance_path, 'text_store'))
+        app.config.setdefault('TEXT_STORE_MAX_BYTES', 512 * 1024 * 1024)
+        self.root = app.config['TEXT_STORE_DIR']
+        self.max_bytes = app.config['TEXT_STORE_MAX_BYTES']
+        app.extensions['text_store'] = self
+
+    # max_tokens is part of the key because extraction may stop at a token budget
+    def _path(self, file_hash, max_tokens):
+        return os.path.join(self.root, f"{file_hash}.{max_tokens or 'full'}.txt.z")
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = zlib.decompress(f.read())
+        except (FileNotFoundError, zlib.error):
+            return None
+        # mark as recently used for the LRU eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def _write(self, path, data):
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(data, 6))
+        os.replace(tmp_path, path)
+
+    def get_text(self, file_hash, max_tokens=None):
+        data = self._read(self._path(file_hash, max_tokens))
+        return data.decode('utf-8') if data is not None else None
+
+    def put(self, file_hash, text, max_tokens=None):
+        self._write(self._path(file_hash, max_tokens), text.encode('utf-8'))
+        self.evict()
+
+    # return the cached text or extract it with extract(path) and store it
+    def get_or_extract(self, path, extract, max_tokens=None):
+        file_hash = file_sha256(path)
+        text = self.get_text(file_hash, max_tokens)
+        if text is None:
+            text = extract(path)
+            self.put(file_hash, text, max_tokens)
+        return text
+
+    # delete the least recently used files until the store fits in max_bytes
+    def evict(self):
+        with self._lock:
+            try:
+                names = os.listdir(self.root)
+            except FileNotFoundError:
+                return
+            entries = []
+            total = 0
+            for name in names:
+                if not name.endswith('.z'):
+                    continue
+                path = os.path.join(self.root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+text_store = TextStore()
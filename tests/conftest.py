@@ -0,0 +1,81 @@
+import os
+import socket
+import threading
+import pytest
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.schema.models import db
+
+# the app under test runs on an in-memory SQLite database with every
+# background worker in eager mode, so each request finishes its work inline.
+# A test module can override config to change it.
+@pytest.fixture
+def config(tmp_path):
+    return {
+        'TESTING': True,
+        'SECRET_KEY': 'test-secret',
+        'JWT_SECRET_KEY': 'test-jwt-secret-key-of-at-least-32-bytes',
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'RATELIMIT_ENABLED': False,
+        'RATELIMIT_STORAGE_URI': 'memory://',
+        'RESPONSE_CACHE_URL': 'sqlite:///' + str(tmp_path / 'response_cache.db'),
+        'MAIL_QUEUE_EAGER': True,
+        'NOTIFICATIONS_EAGER': True,
+        'SUMMARY_JOBS_EAGER': True,
+        'IMAGES_EAGER': True,
+        'SIMILAR_BOOKS_EAGER': True,
+        'MOOD_RECOMMENDER_PATH': str(tmp_path / 'mood_recommendations.npz'),
+        'SIMILAR_BOOKS_PATH': str(tmp_path / 'similar_books.npz'),
+        'TEXT_STORE_DIR': str(tmp_path / 'text_store'),
+    }
+
+@pytest.fixture
+def app(config):
+    os.environ.setdefault('GITHUB_TOKEN', 'test-token')
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+# authorization header for a user id
+@pytest.fixture
+def auth_headers(app):
+    def headers(user_id):
+        return {'Authorization': 'Bearer ' + create_access_token(identity=str(user_id))}
+    return headers
+
+# a server speaking the Redis protocol on a free local port
+@pytest.fixture
+def resp_server():
+    fakeredis = pytest.importorskip('fakeredis')
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = fakeredis.TcpFakeServer(('127.0.0.1', port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'127.0.0.1:{port}'
+    server.shutdown()
+    server.server_close()
+
+class ByteEncoding:
+    def encode(self, text, disallowed_special='all'):
+        return list(text.encode('utf-8'))
+
+    def decode(self, tokens):
+        return bytes(tokens).decode('utf-8', errors='ignore')
+
+# tiktoken downloads its vocabulary on first use, fall back to one token per byte when offline
+@pytest.fixture
+def tokenizer(monkeypatch):
+    import tiktoken
+    try:
+        tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        monkeypatch.setattr(tiktoken, 'get_encoding', lambda name: ByteEncoding())
@@ -0,0 +1,76 @@
+from app.schema.models import db, Users, Book, Tag, BookTag
+from app.services.book_search import search_book_ids, index_book, remove_book, reindex_all
+
+def seed(*books):
+    db.session.add(Users(username='reader', email='reader@example.com', password_hash='x'))
+    db.session.add_all(Book(user_id=1, **fields) for fields in books)
+    db.session.commit()
+    # the in-process index outlives the database of a single test
+    reindex_all()
+
+def tag_book(book_id, name):
+    tag = Tag.query.filter_by(name=name).first() or Tag(name=name)
+    db.session.add(BookTag(book_id=book_id, tag_obj=tag))
+    db.session.commit()
+
+def test_title_outranks_author_tags_and_description(app):
+    seed(
+        dict(title='Notes', author='Spice Merchant', description='Ledgers.'),
+        dict(title='Recipes', author='Someone', description='Cooking with spice.'),
+        dict(title='Spice', author='Someone', description='A history.'),
+        dict(title='Atlas', author='Someone', description='Maps.'),
+    )
+    tag_book(4, 'spice trade')
+    reindex_all()
+
+    assert search_book_ids('spice') == [3, 1, 4, 2]
+    # every word has to match, as a prefix
+    assert search_book_ids('spi someone') == [3, 4, 2]
+    assert search_book_ids('spice maps') == [4]
+    assert search_book_ids('spice nowhere') == []
+    assert search_book_ids('the of') == []
+
+def test_books_are_kept_up_to_date(app):
+    seed(dict(title='Dune', author='Frank Herbert'))
+    assert search_book_ids('dune') == [1]
+
+    book = Book(title='Dune Messiah', author='Frank Herbert', user_id=1)
+    db.session.add(book)
+    db.session.flush()
+    index_book(book.id)
+    db.session.commit()
+    assert search_book_ids('messiah') == [2]
+
+    # a renamed book loses its old words
+    book.title = 'Children of Dune'
+    index_book(book.id)
+    db.session.commit()
+    assert search_book_ids('messiah') == []
+    assert search_book_ids('children') == [2]
+
+    tag_book(2, 'desert')
+    index_book(2)
+    assert search_book_ids('desert') == [2]
+
+    remove_book(2)
+    assert search_book_ids('dune') == [1]
+    assert search_book_ids('desert') == []
+
+def test_pages_follow_the_offsets(app, client, auth_headers):
+    seed(*[dict(title=f'Dune {i}', author='Frank Herbert') for i in range(5)])
+
+    # equal scores, newest first
+    assert search_book_ids('dune', limit=10) == [5, 4, 3, 2, 1]
+    pages = [search_book_ids('dune', limit=2, offset=offset) for offset in (0, 2, 4, 6)]
+    assert pages == [[5, 4], [3, 2], [1], []]
+
+    response = client.get('/api/v1.0/books/search?q=dune&page=2&per_page=2', headers=auth_headers(1))
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [book['id'] for book in data['books']] == [3, 2]
+    assert data['metadata'] == {'page': 2, 'per_page': 2, 'has_next': True, 'next_page': 3}
+
+    data = client.get('/api/v1.0/books/search?q=dune&page=3&per_page=2', headers=auth_headers(1)).get_json()
+    assert [book['id'] for book in data['books']] == [1]
+    assert data['metadata']['has_next'] is False
+    assert client.get('/api/v1.0/books/search?q=dune&page=4&per_page=2', headers=auth_headers(1)).status_code == 404
@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from app.utils import downloads
+from app.utils.downloads import download_file, DownloadError
+
+# a local stand-in for the file host, every GET without a matching ETag serves a new version
+class FileHost(BaseHTTPRequestHandler):
+    version = 0
+    lock = threading.Lock()
+    requests = []
+    # seconds to wait before answering, per version
+    delays = {}
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path == '/missing.pdf':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/huge.pdf':
+            self.send_response(200)
+            self.send_header('Content-Length', str(10 * 1024 * 1024))
+            self.end_headers()
+            return
+        with self.lock:
+            etag = f'"v{FileHost.version}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            FileHost.version += 1
+            version = FileHost.version
+        time.sleep(self.delays.get(version, 0))
+        body = f'%PDF version {version}\n'.encode() * 1000
+        self.send_response(200)
+        self.send_header('ETag', f'"v{version}"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def file_host():
+    FileHost.version = 0
+    FileHost.requests = []
+    FileHost.delays = {}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FileHost)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_download_is_cached_and_revalidated(file_host, tmp_path):
+    url = file_host + '/book.pdf'
+    path = download_file(url, download_dir=str(tmp_path))
+    assert read(path).startswith(b'%PDF version 1')
+
+    # the server answers 304 and the cached copy is reused
+    assert download_file(url, download_dir=str(tmp_path)) == path
+    assert FileHost.requests[-1] == ('/book.pdf', '"v1"')
+
+def test_size_limit_and_errors(file_host, tmp_path):
+    with pytest.raises(DownloadError):
+        download_file(file_host + '/huge.pdf', download_dir=str(tmp_path), max_bytes=1024 * 1024)
+    with pytest.raises(DownloadError):
+        download_file(file_host + '/book.pdf', download_dir=str(tmp_path), max_bytes=1024)
+    with pytest.raises(DownloadError):
+        download_file(file_host + '/missing.pdf', download_dir=str(tmp_path))
+    # nothing half written is left behind
+    assert not [name for name in tmp_path.iterdir() if name.suffix in ('.bin', '.part', '.tmp')]
+
+def test_concurrent_downloads_keep_etag_and_body_together(file_host, tmp_path):
+    url = file_host + '/book.pdf'
+    # the first request finishes last
+    FileHost.delays = {1: 0.3}
+    paths = {}
+
+    def fetch(name):
+        paths[name] = download_file(url, download_dir=str(tmp_path))
+
+    first = threading.Thread(target=fetch, args=('first',))
+    first.start()
+    time.sleep(0.1)
+    second = threading.Thread(target=fetch, args=('second',))
+    second.start()
+    first.join()
+    second.join()
+
+    # each caller gets the body it downloaded
+    assert read(paths['first']).startswith(b'%PDF version 1')
+    assert read(paths['second']).startswith(b'%PDF version 2')
+
+    # the cache entry pairs the ETag with the body it came with
+    [meta_path] = tmp_path.glob('*.json')
+    meta = json.loads(meta_path.read_text())
+    version = meta['etag'].strip('"v')
+    assert read(tmp_path / meta['body']).startswith(f'%PDF version {version}\n'.encode())
+
+def test_superseded_bodies_are_removed(file_host, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloads, 'STALE_BODY_SECONDS', 0)
+    url = file_host + '/book.pdf'
+    download_file(url, download_dir=str(tmp_path))
+    # a new version on the server replaces the cached one
+    FileHost.version += 1
+    time.sleep(0.01)
+    path = download_file(url, download_dir=str(tmp_path))
+    assert [str(body) for body in tmp_path.glob('*.bin')] == [path]
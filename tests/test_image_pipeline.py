@@ -0,0 +1,78 @@
+import io
+import os
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from app.services import image_pipeline as image_pipeline_module
+from app.services.image_pipeline import image_pipeline, process_image
+from app.utils.image_upload import upload_image
+from app.utils.storage import upload_storage, LocalBackend
+
+def test_missing_source_is_nothing_to_publish(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_storage, 'backend', LocalBackend(str(tmp_path / 'uploads')))
+    source = str(tmp_path / 'gone')
+
+    assert process_image(source, f'{source}.out', 'a' * 64, {'thumb': 16}, ('webp',)) == []
+    image_pipeline.submit(source, 'a' * 64)
+    assert not (tmp_path / 'uploads').exists()
+
+def test_source_is_kept_until_the_files_are_published(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_storage, 'backend', LocalBackend(str(tmp_path / 'uploads')))
+    source = str(tmp_path / 'incoming')
+    Image.new('RGB', (64, 48), 'red').save(source, format='PNG')
+    digest = 'b' * 64
+
+    # a duplicate upload checks the source while the files are moved
+    seen = []
+    save = upload_storage.save
+    def save_and_check(key, path, **kwargs):
+        seen.append(os.path.exists(source))
+        save(key, path, **kwargs)
+    monkeypatch.setattr(upload_storage, 'save', save_and_check)
+    image_pipeline.submit(source, digest)
+
+    assert seen and all(seen)
+    assert all(upload_storage.exists(key) for key in image_pipeline.variant_keys(digest))
+    assert not os.path.exists(source)
+
+def photo():
+    data = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = 6  # taken rotated
+    exif[0x010F] = 'Camera'
+    Image.new('RGB', (64, 48), 'red').save(data, format='JPEG', exif=exif)
+    data.seek(0)
+    return FileStorage(data, filename='photo.jpg')
+
+def test_cleaned_original_is_stored_before_the_url_is_returned(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_storage, 'backend', LocalBackend(str(tmp_path / 'uploads')))
+    jobs = []
+    def submit(source, digest):
+        jobs.append(digest)
+        os.remove(source)
+    monkeypatch.setattr(image_pipeline, 'submit', submit)
+
+    with app.test_request_context():
+        url = upload_image(photo())
+    key = 'images/' + url.rsplit('/', 1)[1]
+    assert upload_storage.exists(key)
+    with Image.open(upload_storage.backend.path(key)) as image:
+        # the orientation is applied and the metadata is gone
+        assert image.size == (48, 64)
+        assert not image.getexif()
+    assert len(jobs) == 1
+
+def test_failed_variants_are_queued_again(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_storage, 'backend', LocalBackend(str(tmp_path / 'uploads')))
+    def fail_once(*args):
+        monkeypatch.setattr(image_pipeline_module, 'process_image', process_image)
+        raise OSError('broken')
+    monkeypatch.setattr(image_pipeline_module, 'process_image', fail_once)
+
+    with app.test_request_context():
+        url = upload_image(photo())
+        digest = url.rsplit('/', 1)[1].split('.')[0]
+        assert upload_storage.exists(f'images/{digest}.jpg')
+        assert not any(upload_storage.exists(key) for key in image_pipeline.variant_keys(digest))
+
+        assert upload_image(photo()) == url
+        assert all(upload_storage.exists(key) for key in image_pipeline.variant_keys(digest))
@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from app.services import get_summary, get_recommendations
+from app.services.llm_gateway import LLMGateway, LLMError, LLMUnavailable
+
+MESSAGES = [{'role': 'user', 'content': 'hi'}]
+
+# a local stand-in for an OpenAI compatible chat completion api
+class FakeOpenAI(BaseHTTPRequestHandler):
+    lock = threading.Lock()
+
+    @classmethod
+    def reset(cls):
+        cls.calls = 0
+        cls.active = 0
+        cls.max_active = 0
+        # statuses answered before the next successes
+        cls.failures = []
+        cls.delay = 0.02
+        cls.content = None
+        cls.bodies = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.lock:
+            FakeOpenAI.calls += 1
+            FakeOpenAI.active += 1
+            FakeOpenAI.max_active = max(FakeOpenAI.max_active, FakeOpenAI.active)
+            FakeOpenAI.bodies.append(body)
+            status = FakeOpenAI.failures.pop(0) if FakeOpenAI.failures else 200
+        time.sleep(FakeOpenAI.delay)
+        with self.lock:
+            FakeOpenAI.active -= 1
+        if status != 200:
+            payload = {'error': {'message': 'failed', 'type': 'server_error'}}
+        else:
+            payload = {
+                'id': 'chatcmpl-1',
+                'object': 'chat.completion',
+                'created': 0,
+                'model': body['model'],
+                'choices': [{
+                    'index': 0,
+                    'finish_reason': 'stop',
+                    'message': {'role': 'assistant', 'content': FakeOpenAI.content or f"reply {FakeOpenAI.calls}"},
+                }],
+                'usage': {'prompt_tokens': 12, 'completion_tokens': 3, 'total_tokens': 15},
+            }
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def fake_openai():
+    FakeOpenAI.reset()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenAI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    FakeOpenAI.base_url = f'http://127.0.0.1:{server.server_port}/v1'
+    yield FakeOpenAI
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def gateway(fake_openai):
+    gateway = LLMGateway()
+    gateway.base_url = fake_openai.base_url
+    gateway.api_key = 'test-key'
+    gateway.model_concurrency = {'test-model': 3}
+    gateway.backoff_base = 0.01
+    gateway.max_retries = 2
+    gateway.breaker_threshold = 3
+    gateway.breaker_reset = 0.2
+    return gateway
+
+# open the circuit and wait until a trial call is allowed
+def open_circuit(gateway, fake_openai):
+    # three failed attempts, the last one opens the circuit
+    fake_openai.failures = [503] * 3
+    with pytest.raises(LLMError):
+        gateway.complete('test-model', MESSAGES)
+    assert gateway.metrics()['test-model']['circuit'] == 'open'
+    fake_openai.failures = []
+    time.sleep(gateway.breaker_reset)
+
+def test_complete_returns_text_and_usage(gateway, fake_openai):
+    completion = gateway.complete('test-model', MESSAGES, temperature=0.4)
+    assert completion.text == 'reply 1'
+    assert completion.usage == {'prompt_tokens': 12, 'completion_tokens': 3}
+    assert fake_openai.bodies[0]['temperature'] == 0.4
+
+    metrics = gateway.metrics()['test-model']
+    assert metrics['calls'] == 1
+    assert metrics['prompt_tokens'] == 12
+    assert metrics['latency_ms']['p50'] > 0
+
+def test_concurrency_is_limited_per_model(gateway, fake_openai):
+    completions = gateway.complete_many('test-model', [MESSAGES] * 12)
+    assert len(completions) == 12
+    assert fake_openai.max_active == 3
+
+def test_transient_errors_are_retried(gateway, fake_openai):
+    fake_openai.failures = [503, 429]
+    assert gateway.complete('test-model', MESSAGES).text == 'reply 3'
+    assert gateway.metrics()['test-model']['retries'] == 2
+
+def test_bad_requests_are_not_retried(gateway, fake_openai):
+    fake_openai.failures = [400]
+    with pytest.raises(LLMError):
+        gateway.complete('test-model', MESSAGES)
+    assert fake_openai.calls == 1
+    assert gateway.metrics()['test-model']['circuit'] == 'closed'
+
+def test_circuit_opens_and_recovers(gateway, fake_openai):
+    open_circuit(gateway, fake_openai)
+    calls = fake_openai.calls
+    # the trial call closes the circuit again
+    assert gateway.complete('test-model', MESSAGES).text
+    assert gateway.metrics()['test-model']['circuit'] == 'closed'
+    assert fake_openai.calls == calls + 1
+
+def test_open_circuit_fails_fast(gateway, fake_openai):
+    fake_openai.failures = [503] * 3
+    with pytest.raises(LLMError):
+        gateway.complete('test-model', MESSAGES)
+    calls = fake_openai.calls
+    with pytest.raises(LLMUnavailable):
+        gateway.complete('test-model', MESSAGES)
+    assert fake_openai.calls == calls
+    assert gateway.metrics()['test-model']['rejected'] == 1
+
+def test_bad_request_during_trial_does_not_block_the_model(gateway, fake_openai):
+    open_circuit(gateway, fake_openai)
+    fake_openai.failures = [400]
+    with pytest.raises(LLMError):
+        gateway.complete('test-model', MESSAGES)
+    # the upstream is back, the next call is let through
+    assert gateway.complete('test-model', MESSAGES).text
+    assert gateway.metrics()['test-model']['circuit'] == 'closed'
+
+def test_cancelled_trial_does_not_block_the_model(gateway, fake_openai):
+    open_circuit(gateway, fake_openai)
+    fake_openai.delay = 0.2
+    # the first request takes the trial, the second is rejected and cancels it
+    with pytest.raises(LLMUnavailable):
+        gateway.complete_many('test-model', [MESSAGES, MESSAGES])
+    fake_openai.delay = 0.02
+    assert gateway.complete('test-model', MESSAGES).text
+    assert gateway.metrics()['test-model']['circuit'] == 'closed'
+
+def test_services_use_the_gateway(gateway, fake_openai, monkeypatch):
+    monkeypatch.setattr(get_summary, 'llm', gateway)
+    monkeypatch.setattr(get_recommendations, 'llm', gateway)
+
+    fake_openai.content = 'A short summary.'
+    assert get_summary.summarize_section('chapter one') == ('A short summary.', {'prompt_tokens': 12, 'completion_tokens': 3})
+    assert get_summary.combine_summaries(['one', 'two'])[0] == 'A short summary.'
+    assert 'Part 2:\ntwo' in fake_openai.bodies[-1]['messages'][-1]['content']
+
+    fake_openai.content = json.dumps({'reasoning': 'calm', 'books': [{'title': 'Walden'}]})
+    assert get_recommendations.get_mood_recommendations('calm')['books'] == [{'title': 'Walden'}]
+    assert fake_openai.bodies[-1]['response_format'] == {'type': 'json_object'}
+    assert set(gateway.metrics()) == {get_summary.MODEL, get_recommendations.MODEL}
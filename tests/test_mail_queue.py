@@ -0,0 +1,117 @@
+import socket
+import threading
+import pytest
+from app import mail
+from app.services.mail_queue import MailQueue
+
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+
+# a local smtp server recording every message with the connection it came in on
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+        self.received = threading.Condition()
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.received:
+            self.messages.append((session.peer, envelope.rcpt_tos))
+            self.received.notify_all()
+        return '250 OK'
+
+    def wait_for(self, count, timeout=10):
+        with self.received:
+            assert self.received.wait_for(lambda: len(self.messages) >= count, timeout)
+        return self.messages[:count]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# a local smtp server that can be restarted on the same port, dropping its connections
+class SMTPServer:
+    def __init__(self):
+        self.handler = RecordingHandler()
+        self.port = free_port()
+        self.controller = None
+
+    def start(self):
+        self.controller = aiosmtpd_controller.Controller(self.handler, hostname='127.0.0.1', port=self.port)
+        self.controller.start()
+
+    def stop(self):
+        self.controller.stop()
+
+    def wait_for(self, count):
+        return self.handler.wait_for(count)
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPServer()
+    server.start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def mail_queue(app, smtp_server):
+    app.config.update(
+        MAIL_SERVER='127.0.0.1', MAIL_PORT=smtp_server.port, MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False,
+        MAIL_QUEUE_EAGER=False, MAIL_QUEUE_BATCH_SIZE=10, MAIL_QUEUE_FLUSH_INTERVAL=0.2, MAIL_QUEUE_BACKOFF_BASE=0.01,
+    )
+    mail.init_app(app)
+    return MailQueue(app)
+
+def send(mail_queue, n, start=0):
+    for i in range(start, start + n):
+        mail_queue.send_message('Hello', 'books@example.com', [f'reader{i}@example.com'], 'Hi.')
+
+def test_batch_is_sent_over_one_connection(mail_queue, smtp_server):
+    send(mail_queue, 5)
+
+    messages = smtp_server.wait_for(5)
+    assert sorted(rcpt for _, (rcpt,) in messages) == sorted(f'reader{i}@example.com' for i in range(5))
+    assert len({peer for peer, _ in messages}) == 1
+
+    # the connection stays open for the next batch
+    send(mail_queue, 3, start=5)
+    assert len({peer for peer, _ in smtp_server.wait_for(8)}) == 1
+
+def test_retries_after_the_server_disconnects(mail_queue, smtp_server):
+    send(mail_queue, 1)
+    smtp_server.wait_for(1)
+
+    # the open connection is dropped, the next message is retried on a new one
+    smtp_server.stop()
+    smtp_server.start()
+    send(mail_queue, 1, start=1)
+    messages = smtp_server.wait_for(2)
+    assert messages[1][1] == ['reader1@example.com']
+    assert messages[0][0] != messages[1][0]
+
+def test_sender_survives_a_failed_batch(mail_queue, smtp_server, monkeypatch):
+    send_batch = mail_queue._send_batch
+    failed = threading.Event()
+    def fail_once(batch):
+        monkeypatch.setattr(mail_queue, '_send_batch', send_batch)
+        failed.set()
+        raise RuntimeError('boom')
+    monkeypatch.setattr(mail_queue, '_send_batch', fail_once)
+    send(mail_queue, 1)
+    assert failed.wait(5)
+
+    send(mail_queue, 1, start=1)
+    assert smtp_server.wait_for(1)[0][1] == ['reader1@example.com']
+
+def test_dead_sender_is_replaced(mail_queue, smtp_server, monkeypatch):
+    # the sender thread exits, as it would on an error nothing catches
+    send_batch = mail_queue._send_batch
+    def exit_once(batch):
+        monkeypatch.setattr(mail_queue, '_send_batch', send_batch)
+        raise SystemExit
+    monkeypatch.setattr(mail_queue, '_send_batch', exit_once)
+    send(mail_queue, 1)
+    mail_queue._worker.join(5)
+    assert not mail_queue._worker.is_alive()
+
+    send(mail_queue, 1, start=1)
+    assert smtp_server.wait_for(1)[0][1] == ['reader1@example.com']
@@ -0,0 +1,59 @@
+import os
+from app.schema.models import db, Users, Book, Mood, BookMood, Post, PostMood, UserRecommendation
+from app.services.mood_recommender import mood_recommender
+from app.routes import recommendations
+
+def seed():
+    db.session.add(Users(username='reader', email='reader@example.com', password_hash='x'))
+    db.session.add_all([Mood(name='calm'), Mood(name='curious')])
+    db.session.add_all([Book(title=f'book {i}', author='author', user_id=1) for i in range(1, 5)])
+    db.session.flush()
+    # book 1 is labeled calm and written about as calm, books 2 and 3 only labeled
+    db.session.add_all([BookMood(book_id=book_id, mood_id=1) for book_id in (1, 2, 3)])
+    db.session.add(Post(title='quiet', content='content', user_id=1, book_id=1))
+    db.session.flush()
+    db.session.add(PostMood(post_id=1, mood_id=1))
+    db.session.commit()
+
+def test_books_are_ranked_by_their_signals(app):
+    seed()
+    mood_recommender.build()
+
+    ranked = mood_recommender.recommend(1, limit=5)
+    assert [book_id for book_id, _ in ranked][0] == 1
+    assert sorted(book_id for book_id, _ in ranked[1:]) == [2, 3]
+    assert ranked[0][1] > ranked[1][1] == ranked[2][1] > 0
+    assert mood_recommender.recommend(1, limit=2) == ranked[:2]
+
+def test_excluded_books_are_skipped(app):
+    seed()
+    mood_recommender.build()
+
+    assert [book_id for book_id, _ in mood_recommender.recommend(1, exclude={1, 2})] == [3]
+
+def test_missing_file_is_not_built_in_the_request(app):
+    seed()
+
+    assert mood_recommender.recommend(1) == []
+    assert not os.path.exists(app.config['MOOD_RECOMMENDER_PATH'])
+
+def test_cold_start_falls_back_to_the_llm(app, client, auth_headers, monkeypatch):
+    seed()
+    mood_recommender.build()
+    asked = []
+    def llm_recommendations(mood):
+        asked.append(mood)
+        return {'reasoning': 'Curious minds.', 'books': [{'title': 'Cosmos', 'author': 'Carl Sagan'}]}
+    monkeypatch.setattr(recommendations, 'get_mood_recommendations', llm_recommendations)
+
+    # calm has local signal, curious has none
+    response = client.get('/api/v1.0/recommendations/1', headers=auth_headers(1))
+    assert response.status_code == 200
+    assert response.get_json()['data']['source'] == 'local'
+
+    response = client.get('/api/v1.0/recommendations/2', headers=auth_headers(1))
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert data['source'] == 'llm' and [book['title'] for book in data['books']] == ['Cosmos']
+    assert asked == ['curious']
+    assert UserRecommendation.query.filter_by(user_id=1).count() == 4
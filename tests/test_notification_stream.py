@@ -0,0 +1,134 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from app.schema.models import db, Users, Notification
+from app.services.notification_stream import NotificationBroker, notification_broker, event_stream, latest_cursor
+from app.utils.pagination import decode_cursor
+from app.utils.response_cache import RedisBackend
+
+def seed_user():
+    user = Users(username='reader', email='reader@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+def notify(user_id, message, created_at):
+    notification = Notification(user_id=user_id, message=message, created_at=created_at)
+    db.session.add(notification)
+    db.session.commit()
+    notification_broker.publish(user_id)
+    return notification.id
+
+def parse(chunk):
+    fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n') if not line.startswith(':'))
+    return fields.get('event'), json.loads(fields.get('data', 'null')), fields.get('id')
+
+# the next event of a stream, skipping keep-alive comments
+def next_event(stream, attempts=20):
+    for _ in range(attempts):
+        chunk = next(stream)
+        if not chunk.startswith(':') and not chunk.startswith('retry'):
+            return parse(chunk)
+    raise AssertionError('No event was sent.')
+
+def test_broker_wakes_the_subscribed_user_only(app):
+    reader = notification_broker.subscribe(1)
+    other = notification_broker.subscribe(2)
+    woken = []
+    waiter = threading.Thread(target=lambda: woken.append(reader.wait(5)))
+    waiter.start()
+
+    notification_broker.publish(1)
+    waiter.join(5)
+    assert woken == [True]
+    assert not other.wait(0.05)
+
+    notification_broker.unsubscribe(reader)
+    notification_broker.unsubscribe(other)
+
+def test_broker_wakes_streams_in_other_processes(app, resp_server):
+    url = f'redis://{resp_server}/0'
+    publisher, listener = NotificationBroker(), NotificationBroker()
+    publisher.redis, listener.redis = RedisBackend(url), RedisBackend(url)
+    subscription = listener.subscribe(7)
+
+    # the listener subscribes in the background, publish until it hears one
+    for _ in range(50):
+        publisher.publish(7)
+        if subscription.wait(0.1):
+            break
+    else:
+        raise AssertionError('The stream was never woken.')
+    listener.unsubscribe(subscription)
+
+def test_late_commits_are_sent(app, monkeypatch):
+    monkeypatch.setattr(notification_broker, 'keepalive', 0.05)
+    user_id = seed_user()
+    now = datetime.utcnow()
+    notify(user_id, 'seen', now - timedelta(seconds=1))
+    stream = event_stream(notification_broker.subscribe(user_id), latest_cursor(user_id), resumed=False)
+    assert next_event(stream)[0] == 'ready'
+
+    first = notify(user_id, 'first', now)
+    name, data, first_id = next_event(stream)
+    assert name == 'notification' and data['id'] == first
+
+    # stamped before the first one but committed after it
+    late = notify(user_id, 'late', now - timedelta(seconds=2))
+    name, data, event_id = next_event(stream)
+    assert data['id'] == late and event_id == first_id
+
+    # too late for the overlap window
+    notify(user_id, 'lost', now - timedelta(minutes=1))
+    latest = notify(user_id, 'latest', now + timedelta(seconds=1))
+    assert next_event(stream)[1]['id'] == latest
+
+    # a coalesced notification is sent again
+    db.session.get(Notification, first).created_at = now + timedelta(seconds=2)
+    db.session.commit()
+    notification_broker.publish(user_id)
+    assert next_event(stream)[1]['id'] == first
+    stream.close()
+
+def read_stream(client, headers):
+    response = client.get('/api/v1.0/notifications/stream', headers=headers)
+    assert response.status_code == 200
+    return [parse(chunk) for chunk in response.get_data(as_text=True).split('\n\n') if chunk.strip() and not chunk.startswith(('retry', ':'))]
+
+def test_stream_resumes_after_the_last_event(app, client, auth_headers, monkeypatch):
+    monkeypatch.setattr(notification_broker, 'max_duration', 0.1)
+    monkeypatch.setattr(notification_broker, 'keepalive', 0.05)
+    user_id = seed_user()
+    now = datetime.utcnow()
+    notify(user_id, 'old', now - timedelta(minutes=1))
+    notify(user_id, 'recent', now - timedelta(seconds=1))
+
+    # a new stream starts after what the user already has
+    events = read_stream(client, auth_headers(user_id))
+    assert [name for name, _, _ in events] == ['ready']
+    last_event_id = events[-1][2]
+    assert decode_cursor(last_event_id) == latest_cursor(user_id)
+
+    # written while disconnected, one of them stamped before the last event
+    missed = [notify(user_id, 'missed', now), notify(user_id, 'late', now - timedelta(seconds=2))]
+    headers = {**auth_headers(user_id), 'Last-Event-ID': last_event_id}
+    events = read_stream(client, headers)
+    sent = [data['id'] for name, data, _ in events if name == 'notification']
+    assert set(missed) <= set(sent)
+    assert 1 not in sent
+
+def test_open_streams_are_capped_per_user(app, client, auth_headers, monkeypatch):
+    monkeypatch.setattr(notification_broker, 'max_per_user', 1)
+    monkeypatch.setattr(notification_broker, 'max_duration', 0.1)
+    user_id = seed_user()
+    subscription = notification_broker.subscribe(user_id)
+
+    response = client.get('/api/v1.0/notifications/stream', headers=auth_headers(user_id))
+    assert response.status_code == 429
+
+    notification_broker.unsubscribe(subscription)
+    assert client.get('/api/v1.0/notifications/stream', headers=auth_headers(user_id)).status_code == 200
+    # the finished stream gave its place back
+    subscription = notification_broker.subscribe(user_id)
+    assert subscription is not None
+    notification_broker.unsubscribe(subscription)
@@ -0,0 +1,82 @@
+from sqlalchemy import event
+from app.schema.models import db, Users, Notification
+from app.services import notifications
+from app.services.notifications import NotificationPipeline, Event, EMIT, RETRACT, LIKE, COMMENT
+
+def seed_users(n):
+    users = [Users(username=f'reader{i}', email=f'reader{i}@example.com', password_hash='x') for i in range(n)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+def unread_count(user_id):
+    return db.session.get(Users, user_id).unread_notifications_count
+
+def test_repeated_comments_by_the_same_user_all_count(app):
+    author, reader = seed_users(2)
+    pipeline = NotificationPipeline(app)
+
+    pipeline.process([Event(EMIT, COMMENT, author, reader, 1)])
+    pipeline.process([Event(EMIT, COMMENT, author, reader, 1)])
+
+    notification = Notification.query.filter_by(user_id=author).one()
+    assert notification.actor_count == 2
+    assert notification.message == '2 new comments on your post, the latest from reader1.'
+    assert unread_count(author) == 1
+
+def test_like_toggles_are_still_deduplicated(app):
+    author, reader = seed_users(2)
+    pipeline = NotificationPipeline(app)
+
+    pipeline.process([Event(EMIT, LIKE, author, reader, 1), Event(RETRACT, LIKE, author, reader, 1)])
+    assert Notification.query.filter_by(user_id=author).count() == 0
+
+    pipeline.process([Event(EMIT, LIKE, author, reader, 1)])
+    pipeline.process([Event(EMIT, LIKE, author, reader, 1)])
+    notification = Notification.query.filter_by(user_id=author).one()
+    assert notification.actor_count == 1
+    assert unread_count(author) == 1
+
+def test_read_notification_is_not_reopened(app, client, auth_headers, monkeypatch):
+    author, first, second = seed_users(3)
+    pipeline = NotificationPipeline(app)
+    pipeline.process([Event(EMIT, LIKE, author, first, 1)])
+    notification_id = Notification.query.filter_by(user_id=author).one().id
+
+    # the author reads it after the pipeline picked it up for coalescing
+    render_message = notifications.render_message
+    def read_while_coalescing(*args):
+        monkeypatch.setattr(notifications, 'render_message', render_message)
+        response = client.get(f'/api/v1.0/notifications/{notification_id}/read', headers=auth_headers(author))
+        assert response.status_code == 200
+        return render_message(*args)
+    monkeypatch.setattr(notifications, 'render_message', read_while_coalescing)
+    pipeline.process([Event(EMIT, LIKE, author, second, 1)])
+
+    read, fresh = Notification.query.filter_by(user_id=author).order_by(Notification.id).all()
+    assert read.is_read and read.actor_count == 1
+    assert not fresh.is_read and fresh.message == 'reader2 liked your post.'
+    assert unread_count(author) == 1
+
+def test_notification_read_right_after_coalescing_is_not_duplicated(app):
+    author, first, second = seed_users(3)
+    pipeline = NotificationPipeline(app)
+    pipeline.process([Event(EMIT, LIKE, author, first, 1)])
+
+    # the author reads it as soon as the new actor is folded in
+    read = []
+    def read_after_update(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE notification') and not read:
+            reader = conn.connection.cursor()
+            reader.execute('UPDATE notification SET is_read = 1')
+            reader.execute('UPDATE users SET unread_notifications_count = unread_notifications_count - 1 WHERE id = ?', (author,))
+            read.append(True)
+    event.listen(db.engine, 'after_cursor_execute', read_after_update)
+    try:
+        pipeline.process([Event(EMIT, LIKE, author, second, 1)])
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', read_after_update)
+
+    notification = Notification.query.filter_by(user_id=author).one()
+    assert notification.is_read and notification.actor_count == 2
+    assert unread_count(author) == 0
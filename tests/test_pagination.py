@@ -0,0 +1,33 @@
+from app.schema.models import db, Users, Book
+
+def seed_books():
+    user = Users(username='reader', email='reader@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    for n in range(7):
+        book = Book(title=f'book {n}', author='author', user_id=user.id)
+        db.session.add(book)
+        db.session.flush()
+        # legacy rows imported without a date
+        if n % 3 == 0:
+            book.created_at = None
+    db.session.commit()
+    return user.id
+
+def test_cursor_pages_through_rows_without_created_at(app, client, auth_headers):
+    headers = auth_headers(seed_books())
+    seen = []
+    cursor = None
+    while True:
+        url = '/api/v1.0/books/?per_page=2' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        seen += [book['title'] for book in data['data']]
+        cursor = data['metadata']['next_cursor']
+        if not cursor:
+            break
+
+    assert sorted(seen) == [f'book {n}' for n in range(7)]
+    # dated books newest first, then the undated ones by id
+    assert seen[-3:] == ['book 6', 'book 3', 'book 0']
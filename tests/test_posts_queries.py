@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy import event
+from app.schema.models import db, Users, Book, Post, Comment, Likes
+
+def seed_posts(n_posts, n_users=3):
+    users = [Users(username=f'reader{i}', email=f'reader{i}@example.com', password_hash='x') for i in range(n_users)]
+    db.session.add_all(users)
+    db.session.flush()
+    book = Book(title='Dune', author='Frank Herbert', user_id=users[0].id)
+    db.session.add(book)
+    db.session.flush()
+    for n in range(n_posts):
+        post = Post(title=f'post {n}', content='content', user_id=users[n % n_users].id, book_id=book.id, likes_count=n_users)
+        db.session.add(post)
+        db.session.flush()
+        for user in users:
+            db.session.add(Comment(content='comment', user_id=user.id, post_id=post.id))
+            db.session.add(Likes(user_id=user.id, post_id=post.id))
+    db.session.commit()
+    return users[0].id
+
+def count_queries(client, url, headers):
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    assert response.status_code == 200
+    return len(statements), response.get_json()
+
+@pytest.mark.parametrize('n_posts', [3, 30])
+@pytest.mark.parametrize('url', ['/api/v1.0/posts/', '/api/v1.0/posts/user/{user_id}'])
+def test_posts_listing_query_count_does_not_grow_with_posts(app, client, auth_headers, url, n_posts):
+    user_id = seed_posts(n_posts)
+    queries, data = count_queries(client, url.format(user_id=user_id), auth_headers(user_id))
+
+    assert data['posts']
+    assert all(len(post['comments']) == 3 for post in data['posts'])
+    # the page of posts with their authors and books, then the comments with their authors
+    assert queries == 2
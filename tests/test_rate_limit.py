@@ -0,0 +1,111 @@
+import multiprocessing
+import threading
+import pytest
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+from app.schema.models import db, Users, Book, Mood
+from app.routes import recommendations
+from app.utils.rate_limit import SQLiteStorage, RESPStorage
+
+@pytest.fixture
+def sqlite_uri(tmp_path):
+    return 'sqlite:///' + str(tmp_path / 'ratelimits.db')
+
+@pytest.fixture(params=['sqlite', 'resp'])
+def storage(request, sqlite_uri):
+    if request.param == 'sqlite':
+        return storage_from_string(sqlite_uri)
+    return storage_from_string('resp://' + request.getfixturevalue('resp_server') + '/0')
+
+def test_storages_are_registered(sqlite_uri):
+    assert isinstance(storage_from_string(sqlite_uri), SQLiteStorage)
+    assert isinstance(storage_from_string('resp://127.0.0.1:6379/0'), RESPStorage)
+    with pytest.raises(ValueError):
+        storage_from_string('sqlite://')
+
+def test_sliding_window_counter(storage):
+    limiter = SlidingWindowCounterRateLimiter(storage)
+    limit = parse('3 per day')
+    assert storage.check()
+
+    assert [limiter.hit(limit, 'user:1') for _ in range(4)] == [True, True, True, False]
+    assert limiter.hit(limit, 'user:2')
+    assert not limiter.test(limit, 'user:1')
+    stats = limiter.get_window_stats(limit, 'user:1')
+    assert stats.remaining == 0 and stats.reset_time > 0
+    assert limiter.get_window_stats(limit, 'user:2').remaining == 2
+
+    limiter.clear(limit, 'user:1')
+    assert limiter.hit(limit, 'user:1')
+    # more than the limit at once is never let through
+    assert not limiter.hit(limit, 'user:3', cost=4)
+
+def test_fixed_window(storage):
+    limiter = FixedWindowRateLimiter(storage)
+    limit = parse('2 per minute')
+
+    assert [limiter.hit(limit, 'ip:1') for _ in range(3)] == [True, True, False]
+    assert limiter.get_window_stats(limit, 'ip:1').remaining == 0
+    assert storage.get_expiry(limit.key_for('ip:1')) > 0
+
+    storage.reset()
+    assert limiter.hit(limit, 'ip:1')
+
+def test_resp_reset_only_clears_the_limiter(resp_server):
+    storage = storage_from_string(f'resp://{resp_server}/0')
+    storage.backend.execute('SET', 'rc:entry', 'cached')
+    FixedWindowRateLimiter(storage).hit(parse('2 per minute'), 'ip:1')
+
+    assert storage.reset() == 1
+    assert storage.backend.execute('GET', 'rc:entry') == b'cached'
+
+def hit_many(uri, hits, allowed):
+    limiter = SlidingWindowCounterRateLimiter(storage_from_string(uri))
+    allowed.put(sum(limiter.hit(parse('20 per day'), 'user:1') for _ in range(hits)))
+
+def test_sqlite_limit_is_shared_between_processes(sqlite_uri):
+    context = multiprocessing.get_context('fork')
+    allowed = context.Queue()
+    # gunicorn workers hitting the same limit at once
+    workers = [context.Process(target=hit_many, args=(sqlite_uri, 10, allowed)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+
+    assert sum(allowed.get(timeout=5) for _ in workers) == 20
+
+def test_resp_limit_holds_under_concurrent_hits(resp_server):
+    uri = f'resp://{resp_server}/0'
+    allowed = multiprocessing.Queue()
+    threads = [threading.Thread(target=hit_many, args=(uri, 10, allowed)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert sum(allowed.get(timeout=5) for _ in threads) == 20
+
+@pytest.fixture
+def config(config, sqlite_uri):
+    return {**config, 'RATELIMIT_ENABLED': True, 'RATELIMIT_STORAGE_URI': sqlite_uri}
+
+def test_only_llm_answers_count_towards_the_limit(app, client, auth_headers, monkeypatch):
+    db.session.add(Users(username='reader', email='reader@example.com', password_hash='x'))
+    db.session.add_all([Mood(name='calm'), Mood(name='curious')])
+    db.session.add(Book(title='Quiet', author='Someone', user_id=1))
+    db.session.commit()
+    # calm is answered locally, curious by the llm
+    monkeypatch.setattr(recommendations.mood_recommender, 'recommend', lambda mood_id, **kwargs: [(1, 1.0)] if mood_id == 1 else [])
+    monkeypatch.setattr(recommendations, 'get_mood_recommendations', lambda mood: {
+        'reasoning': 'Curious minds.', 'books': [{'title': 'Cosmos', 'author': 'Carl Sagan'}],
+    })
+    headers = auth_headers(1)
+
+    for _ in range(12):
+        assert client.get('/api/v1.0/recommendations/1', headers=headers).get_json()['data']['source'] == 'local'
+    for _ in range(10):
+        assert client.get('/api/v1.0/recommendations/2', headers=headers).get_json()['data']['source'] == 'llm'
+    assert client.get('/api/v1.0/recommendations/2', headers=headers).status_code == 429
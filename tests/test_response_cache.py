@@ -0,0 +1,119 @@
+import multiprocessing
+import time
+import pytest
+from flask import jsonify, request
+from app.utils.response_cache import response_cache, RedisBackend, SQLiteBackend, CacheError
+
+# a cached view counting how often it really runs
+@pytest.fixture
+def calls(app):
+    calls = []
+    @response_cache.cached(tags=('things', 'thing:{thing_id}'))
+    def thing(thing_id):
+        calls.append(thing_id)
+        return jsonify({'id': thing_id, 'page': request.args.get('page'), 'version': len(calls)})
+    app.add_url_rule('/things/<int:thing_id>', 'thing', thing)
+    return calls
+
+def test_responses_are_cached_until_invalidated(app, client, calls):
+    first = client.get('/things/1')
+    assert first.headers['X-Cache'] == 'MISS'
+    second = client.get('/things/1')
+    assert second.headers['X-Cache'] == 'HIT' and second.get_json() == first.get_json()
+    assert client.get('/things/1', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert calls == [1]
+
+    # every page is cached separately
+    assert client.get('/things/1?page=2').get_json()['page'] == '2'
+    assert client.get('/things/2').headers['X-Cache'] == 'MISS'
+    assert calls == [1, 1, 2]
+
+    # a tag filled with the view arguments only drops that thing
+    response_cache.invalidate('thing:1')
+    response = client.get('/things/1')
+    assert response.headers['X-Cache'] == 'MISS' and response.headers['ETag'] != first.headers['ETag']
+    assert client.get('/things/2').headers['X-Cache'] == 'HIT'
+
+    response_cache.invalidate('things')
+    assert client.get('/things/2').headers['X-Cache'] == 'MISS'
+    assert calls == [1, 1, 2, 1, 2]
+
+def test_errors_are_not_cached(app, client):
+    calls = []
+    @response_cache.cached(tags=('things',))
+    def missing():
+        calls.append(1)
+        return jsonify({'error': 'Not found.'}), 404
+    app.add_url_rule('/missing', 'missing', missing)
+
+    assert client.get('/missing').status_code == 404
+    assert client.get('/missing').status_code == 404
+    assert len(calls) == 2
+
+def invalidate_in_another_process(tag):
+    response_cache.invalidate(tag)
+
+def test_invalidation_reaches_every_worker(app, client, calls):
+    client.get('/things/1')
+    assert client.get('/things/1').headers['X-Cache'] == 'HIT'
+
+    # a write handled by another gunicorn worker
+    worker = multiprocessing.get_context('fork').Process(target=invalidate_in_another_process, args=('thing:1',))
+    worker.start()
+    worker.join(10)
+    assert worker.exitcode == 0
+
+    assert client.get('/things/1').headers['X-Cache'] == 'MISS'
+    assert calls == [1, 1]
+
+def test_sqlite_backend(tmp_path):
+    url = 'sqlite:///' + str(tmp_path / 'cache.db')
+    backend, other = SQLiteBackend(url, max_entries=2), SQLiteBackend(url)
+
+    backend.set('a', b'1', 60)
+    backend.set('b', b'2', 0.05)
+    assert backend.incr('version') == 1 and other.incr('version') == 2
+    assert other.get_many(['a', 'b', 'version', 'missing']) == [b'1', b'2', b'2', None]
+    time.sleep(0.1)
+    assert other.get_many(['b']) == [None]
+
+    # only the newest entries are kept, versions are never evicted
+    backend.PURGE_EVERY = 1
+    backend.set('c', b'3', 60)
+    backend.set('d', b'4', 60)
+    assert other.get_many(['a', 'c', 'd', 'version']) == [None, b'3', b'4', b'2']
+
+    other.clear()
+    assert backend.get_many(['c', 'version']) == [None, None]
+
+def test_redis_backend(resp_server):
+    backend = RedisBackend(f'redis://{resp_server}/1')
+
+    backend.set('entry', b'{"body": ""}', 0.05)
+    assert backend.incr('version') == 1 and backend.incr('version') == 2
+    assert backend.get_many(['entry', 'version', 'missing']) == [b'{"body": ""}', b'2', None]
+    time.sleep(0.1)
+    assert backend.get_many(['entry']) == [None]
+
+    backend.clear()
+    assert backend.get_many(['version']) == [None]
+    with pytest.raises(CacheError):
+        backend.execute('NOSUCHCOMMAND')
+    assert backend.execute('PING') == b'PONG'
+
+def test_cached_views_through_redis(app, client, calls, resp_server, monkeypatch):
+    monkeypatch.setattr(response_cache, 'backend', RedisBackend(f'redis://{resp_server}/0'))
+
+    assert client.get('/things/1').headers['X-Cache'] == 'MISS'
+    assert client.get('/things/1').headers['X-Cache'] == 'HIT'
+    response_cache.invalidate('things')
+    assert client.get('/things/1').headers['X-Cache'] == 'MISS'
+    assert calls == [1, 1]
+
+def test_unreachable_cache_still_serves(app, client, calls, monkeypatch):
+    monkeypatch.setattr(response_cache, 'backend', RedisBackend('redis://127.0.0.1:1/0', timeout=0.1))
+
+    response_cache.invalidate('things')
+    assert client.get('/things/1').status_code == 200
+    assert client.get('/things/1').status_code == 200
+    assert calls == [1, 1]
@@ -0,0 +1,97 @@
+import random
+import time
+import numpy as np
+import pytest
+from app.schema.models import db, Users, Book, UserBook
+from app.services.similar_books import similar_books, load_interactions, compute_neighbors
+
+def seed(n_users, n_books):
+    db.session.add_all([Users(username=f'reader{i}', email=f'reader{i}@example.com', password_hash='x') for i in range(n_users)])
+    db.session.flush()
+    db.session.add_all([Book(title=f'book {i}', author='author', user_id=1) for i in range(n_books)])
+    db.session.commit()
+
+# what a rebuild from scratch says about every book
+def full_rebuild():
+    _, book_ids, matrix = load_interactions()
+    neighbors, scores = compute_neighbors(matrix, np.arange(len(book_ids)), similar_books.top_n)
+    return {
+        int(book_id): [(int(book_ids[n]), round(float(score), 5)) for n, score in zip(neighbors[row], scores[row]) if n >= 0]
+        for row, book_id in enumerate(book_ids)
+    }
+
+def incremental():
+    return {
+        book_id: [(other, round(score, 5)) for other, score in similar_books.similar(book_id, limit=similar_books.top_n)]
+        for book_id in full_rebuild()
+    }
+
+def test_removing_an_interaction_updates_the_books_it_was_shared_with(app, client, auth_headers):
+    seed(1, 2)
+    db.session.add_all([UserBook(user_id=1, book_id=1), UserBook(user_id=1, book_id=2)])
+    db.session.commit()
+    similar_books.build()
+    [(other, score)] = similar_books.similar(2)
+    assert other == 1 and score == pytest.approx(1.0)
+
+    bookmark = UserBook.query.filter_by(user_id=1, book_id=1).one()
+    response = client.delete(f'/api/v1.0/bookmarks/{bookmark.id}/remove', headers=auth_headers(1))
+    assert response.status_code == 200
+
+    assert similar_books.similar(1) == []
+    assert similar_books.similar(2) == []
+
+def test_incremental_refresh_matches_a_full_rebuild(app):
+    rng = random.Random(7)
+    seed(12, 15)
+    pairs = {(rng.randint(1, 12), rng.randint(1, 15)) for _ in range(60)}
+    db.session.add_all([UserBook(user_id=user_id, book_id=book_id) for user_id, book_id in pairs])
+    db.session.commit()
+    similar_books.build()
+
+    for _ in range(40):
+        user_id, book_id = rng.randint(1, 12), rng.randint(1, 15)
+        bookmark = UserBook.query.filter_by(user_id=user_id, book_id=book_id).first()
+        if bookmark:
+            db.session.delete(bookmark)
+        else:
+            db.session.add(UserBook(user_id=user_id, book_id=book_id))
+        db.session.commit()
+        similar_books.mark_dirty(user_id, book_id)
+        assert incremental() == full_rebuild()
+
+def test_changes_are_refreshed_in_the_background(app, monkeypatch):
+    seed(2, 2)
+    db.session.add(UserBook(user_id=1, book_id=1))
+    db.session.commit()
+    similar_books.build()
+    monkeypatch.setitem(app.config, 'SIMILAR_BOOKS_EAGER', False)
+    monkeypatch.setattr(similar_books, 'refresh_delay', 0.05)
+
+    db.session.add(UserBook(user_id=1, book_id=2))
+    db.session.commit()
+    similar_books.mark_dirty(1, 2)
+    # the request that marked the change does not wait for the refresh
+    assert similar_books.similar(1) == []
+
+    for _ in range(100):
+        if similar_books.similar(1):
+            break
+        time.sleep(0.02)
+    assert [other for other, _ in similar_books.similar(1)] == [2]
+
+def test_similar_and_for_you_endpoints(app, client, auth_headers):
+    seed(3, 3)
+    # readers 1 and 2 share books 1 and 2, reader 2 also read book 3
+    db.session.add_all([UserBook(user_id=user_id, book_id=book_id) for user_id, book_id in ((1, 1), (1, 2), (2, 1), (2, 2), (2, 3))])
+    db.session.commit()
+    similar_books.build()
+    headers = auth_headers(1)
+
+    response = client.get('/api/v1.0/recommendations/similar/1', headers=headers)
+    assert response.status_code == 200
+    assert [book['id'] for book in response.get_json()['similar']] == [2, 3]
+
+    response = client.get('/api/v1.0/recommendations/for-you', headers=headers)
+    assert response.status_code == 200
+    assert [book['id'] for book in response.get_json()['recommendations']] == [3]
@@ -0,0 +1,93 @@
+import os
+import random
+import string
+import time
+import pytest
+from app.services.suggest import SuggestIndex, BOOK, AUTHOR, TAG, USER
+
+def texts(results):
+    return [result['text'] for result in results]
+
+@pytest.fixture
+def index():
+    index = SuggestIndex()
+    index.build([
+        (BOOK, 1, 'The Name of the Wind'),
+        (BOOK, 2, 'Dune'),
+        (BOOK, 3, 'Dune Messiah'),
+        (AUTHOR, 'Frank Herbert', 'Frank Herbert'),
+        (AUTHOR, 'Patrick Rothfuss', 'Patrick Rothfuss'),
+        (TAG, 1, 'science fiction'),
+        (USER, 1, 'wanderer'),
+    ])
+    return index
+
+def test_prefix_and_word_prefix(index):
+    assert texts(index.suggest('dun')) == ['Dune', 'Dune Messiah']
+    assert texts(index.suggest('messi')) == ['Dune Messiah']
+    assert texts(index.suggest('name of')) == ['The Name of the Wind']
+
+def test_typos_are_corrected(index):
+    assert texts(index.suggest('rothfus')) == ['Patrick Rothfuss']
+    assert texts(index.suggest('frank hebert')) == ['Frank Herbert']
+    assert texts(index.suggest('sceince')) == []
+    assert texts(index.suggest('scienc fic')) == ['science fiction']
+
+def test_kinds_filter(index):
+    assert index.suggest('wander', kinds=[BOOK]) == []
+    assert index.suggest('wander', kinds=[USER]) == [{'type': USER, 'id': 1, 'text': 'wanderer'}]
+
+def test_incremental_add_and_remove(index):
+    index.add(BOOK, 4, 'Children of Dune')
+    assert 'Children of Dune' in texts(index.suggest('dune'))
+    index.remove(BOOK, 2)
+    assert sorted(texts(index.suggest('dune'))) == ['Children of Dune', 'Dune Messiah']
+    # a renamed book is only found under its new title
+    index.add(BOOK, 3, 'Dune: Messiah')
+    assert texts(index.suggest('dune m')) == ['Dune: Messiah']
+
+SYLLABLES = ['ka', 'ro', 'mi', 'ten', 'dar', 'vel', 'sh', 'or', 'an', 'is', 'el', 'mur', 'qui', 'zo', 'pen', 'lith', 'gra', 'ny', 'bo', 'fe']
+
+def p99(latencies):
+    latencies = sorted(latencies)
+    return latencies[int(len(latencies) * 0.99)]
+
+# p99 latency of prefix, misspelled and unknown queries against a large synthetic index
+# SUGGEST_BENCHMARK_ENTRIES makes the index smaller for a quick run
+@pytest.mark.slow
+def test_suggest_p99_latency_at_one_million_entries():
+    entries_count = int(os.getenv('SUGGEST_BENCHMARK_ENTRIES', 1_000_000))
+    rng = random.Random(1)
+    vocabulary = list({''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(60000)})
+    kinds = [BOOK, AUTHOR, TAG, USER]
+    entries = []
+    for ref in range(entries_count):
+        kind = kinds[ref % 4]
+        words = rng.randint(1, 4) if kind == BOOK else (2 if kind == AUTHOR else 1)
+        entries.append((kind, ref, ' '.join(rng.choice(vocabulary) for _ in range(words))))
+    index = SuggestIndex()
+    index.build(entries)
+
+    def typo(word):
+        i = rng.randrange(len(word))
+        return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]
+
+    queries = {
+        'prefix': lambda: rng.choice(entries)[2][:rng.randint(2, 8)],
+        'typo': lambda: typo(rng.choice(entries)[2][:rng.randint(5, 12)]),
+        'miss': lambda: ''.join(rng.choice(string.ascii_lowercase) for _ in range(7)),
+    }
+    for name, make_query in queries.items():
+        latencies = []
+        for _ in range(2000):
+            query = make_query()
+            started = time.perf_counter()
+            index.suggest(query, 10)
+            latencies.append(time.perf_counter() - started)
+        assert p99(latencies) < 0.005, f'{name} p99 {p99(latencies) * 1000:.2f} ms'
+
+    # incremental adds stay cheap on the full index
+    started = time.perf_counter()
+    for n in range(1000):
+        index.add(USER, entries_count + n, rng.choice(vocabulary) + str(n))
+    assert (time.perf_counter() - started) / 1000 < 0.005
@@ -0,0 +1,67 @@
+import pymupdf
+import pytest
+from app.schema.models import db, Users, Book, SummaryJob
+from app.services import get_summary, chunked_summary, summary_jobs as summary_jobs_module
+from app.services.summary_cache import summary_cache
+
+@pytest.fixture
+def book_pdf(tmp_path):
+    path = tmp_path / 'book.pdf'
+    doc = pymupdf.open()
+    for number in range(3):
+        doc.new_page().insert_text((72, 72), f'Chapter {number}: the spice must flow.')
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+@pytest.fixture
+def book_id(app, book_pdf, monkeypatch):
+    user = Users(username='reader', email='reader@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    book = Book(title='Dune', author='Frank Herbert', user_id=user.id, file_url='http://localhost:5000/static/uploads/files/book.pdf')
+    db.session.add(book)
+    db.session.commit()
+    monkeypatch.setattr(summary_jobs_module, 'download_or_get_local_file', lambda url: book_pdf)
+    summary_cache.clear()
+    return book.id
+
+def test_summarize_book_runs_as_a_job_with_a_stubbed_model(app, client, auth_headers, book_id, tokenizer, monkeypatch):
+    sections = []
+    def summarize_section(content):
+        sections.append(content)
+        return f'summary of part {len(sections)}', {'prompt_tokens': 10, 'completion_tokens': 2}
+    def combine_summaries(summaries):
+        return ' + '.join(summaries), {'prompt_tokens': 5, 'completion_tokens': 3}
+    monkeypatch.setattr(get_summary, 'summarize_section', summarize_section)
+    monkeypatch.setattr(get_summary, 'combine_summaries', combine_summaries)
+    # small windows so the book takes a map and a reduce step
+    monkeypatch.setattr(chunked_summary, 'CHUNK_TOKENS', 40)
+    monkeypatch.setattr(chunked_summary, 'CHUNK_OVERLAP', 0)
+
+    response = client.post(f'/api/v1.0/summaries/book/{book_id}/summarize', headers=auth_headers(1))
+    assert response.status_code == 202
+    job = response.get_json()['job']
+    assert job['status_url'].endswith(f"/api/v1.0/summaries/jobs/{job['id']}")
+
+    response = client.get(f"/api/v1.0/summaries/jobs/{job['id']}", headers=auth_headers(1))
+    assert response.status_code == 200
+    job = response.get_json()['job']
+    assert job['status'] == 'done', job['error']
+    assert job['progress'] == 100
+    assert 'Chapter 2' in ''.join(sections)
+    assert job['usage']['chunks'] == len(sections) > 1
+    assert job['usage']['llm_calls'] == len(sections) + 1
+    assert job['summary']['summary_text'] == ' + '.join(f'summary of part {n}' for n in range(1, len(sections) + 1))
+
+def test_failed_job_reports_the_error(app, client, auth_headers, book_id, tokenizer, monkeypatch):
+    def summarize_section(content):
+        raise RuntimeError('model is down')
+    monkeypatch.setattr(get_summary, 'summarize_section', summarize_section)
+
+    job = client.post(f'/api/v1.0/summaries/book/{book_id}/summarize', headers=auth_headers(1)).get_json()['job']
+
+    job = db.session.get(SummaryJob, job['id'])
+    assert job.status == 'failed'
+    assert job.error == 'model is down'
+    assert job.summary_id is None
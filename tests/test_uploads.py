@@ -0,0 +1,110 @@
+import io
+import pytest
+from PIL import Image
+from app.schema.models import db, Users, Book, Post, StoredFile
+from app.utils.storage import upload_storage, LocalBackend
+from app.services import suggest
+from app.routes import book as book_routes
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    backend = LocalBackend(str(tmp_path / 'uploads'))
+    monkeypatch.setattr(upload_storage, 'backend', backend)
+    return tmp_path / 'uploads'
+
+def image_file(color, name='cover.png'):
+    data = io.BytesIO()
+    Image.new('RGB', (32, 32), color).save(data, format='PNG')
+    data.seek(0)
+    return data, name
+
+def stored_keys(storage):
+    return sorted(path.relative_to(storage).as_posix() for path in storage.rglob('*') if path.is_file())
+
+def seed_user_and_books(*titles):
+    user = Users(username='reader', email='reader@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    db.session.add_all(Book(title=title, author='Frank Herbert', user_id=user.id) for title in titles)
+    db.session.commit()
+    return user.id
+
+def test_rejected_cover_stores_nothing(app, client, auth_headers, storage):
+    user_id = seed_user_and_books()
+    response = client.post('/api/v1.0/books/new', headers=auth_headers(user_id), data={
+        'title': 'Dune', 'author': 'Frank Herbert', 'description': 'Spice.',
+        'file': (io.BytesIO(b'%PDF-1.4 dune'), 'dune.pdf'),
+        'cover': (io.BytesIO(b'not an image'), 'cover.png'),
+    })
+
+    assert response.status_code == 400
+    assert stored_keys(storage) == []
+    assert StoredFile.query.count() == 0
+
+def test_post_images_are_released(app, client, auth_headers, storage):
+    user_id = seed_user_and_books('Dune', 'Emma')
+    headers = auth_headers(user_id)
+    response = client.post('/api/v1.0/posts/new', headers=headers, data={
+        'title': 'Spice', 'content': 'Must flow.', 'book_title': 'Dune', 'post_image': image_file('red'),
+    })
+    assert response.status_code == 201
+    post = Post.query.one()
+    first_image = post.post_image_url
+
+    response = client.put(f'/api/v1.0/posts/update/{post.id}', headers=headers, data={
+        'title': 'Matchmaking', 'content': 'Badly.', 'book_title': 'Emma', 'post_image': image_file('blue'),
+    })
+    assert response.status_code == 201
+    db.session.expire_all()
+    post = db.session.get(Post, post.id)
+    assert post.book.title == 'Emma'
+    assert post.post_image_url != first_image
+    # the replaced image and its variants are gone
+    assert StoredFile.query.count() == 1
+    assert all(StoredFile.query.one().sha256 in key for key in stored_keys(storage))
+
+    response = client.delete(f'/api/v1.0/posts/delete/{post.id}', headers=headers)
+    assert response.status_code == 200
+    assert StoredFile.query.count() == 0
+    assert stored_keys(storage) == []
+
+def new_book(client, headers, title='Dune'):
+    return client.post('/api/v1.0/books/new', headers=headers, data={
+        'title': title, 'author': 'Frank Herbert', 'description': 'Spice.',
+        'file': (io.BytesIO(b'%PDF-1.4 ' + title.encode()), 'book.pdf'),
+        'cover': image_file('green'),
+    })
+
+def test_duplicate_title_stores_nothing(app, client, auth_headers, storage):
+    user_id = seed_user_and_books('Dune')
+
+    response = new_book(client, auth_headers(user_id))
+    assert response.status_code == 409
+    assert stored_keys(storage) == []
+    assert StoredFile.query.count() == 0
+
+def test_uploads_are_given_back_when_the_book_cannot_be_saved(app, client, auth_headers, storage, monkeypatch):
+    user_id = seed_user_and_books()
+    suggest.rebuild()
+
+    # another request adds the same title after the check
+    upload_image = book_routes.upload_image
+    def upload_while_the_title_is_taken(file):
+        url = upload_image(file)
+        db.session.add(Book(title='Dune', author='Someone Else', user_id=user_id))
+        db.session.commit()
+        return url
+    monkeypatch.setattr(book_routes, 'upload_image', upload_while_the_title_is_taken)
+
+    response = new_book(client, auth_headers(user_id))
+    assert response.status_code == 409
+    assert stored_keys(storage) == []
+    assert StoredFile.query.count() == 0
+    assert Book.query.filter_by(title='Dune').one().author == 'Someone Else'
+    assert suggest.suggest('frank herbert', kinds=[suggest.AUTHOR]) == []
+
+    # the request only touches the autocomplete index once the book is saved
+    monkeypatch.setattr(book_routes, 'upload_image', upload_image)
+    response = new_book(client, auth_headers(user_id), title='Dune Messiah')
+    assert response.status_code == 201
+    assert [entry['text'] for entry in suggest.suggest('frank herbert', kinds=[suggest.AUTHOR])] == ['Frank Herbert']